@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+import sys
+import time
+
+# Batch query mode shared by the search scripts (-b): every line of the query file (or of
+# stdin, with -q -) is a query, and one line of ranked doc IDs is written per query (to
+# stdout with -o -). The index is loaded once by the caller and reused for every query.
+
+def open_stream(path, mode, default):
+    if path == '-':
+        return default
+    return open(path, mode, encoding="utf8")
+
+def run_batch(query_file, results_file, search):
+    """
+    Run `search(query) -> ranked doc IDs` on every query line and report throughput
+    """
+    qfile = open_stream(query_file, 'r', sys.stdin)
+    rfile = open_stream(results_file, 'w', sys.stdout)
+    num_queries = 0
+    start_time = time.perf_counter()
+    try:
+        for line in qfile:
+            ranked_results = search(line.strip())
+            rfile.write(' '.join(map(str, ranked_results)) + '\n')
+            rfile.flush()
+            num_queries += 1
+    finally:
+        if qfile is not sys.stdin:
+            qfile.close()
+        if rfile is not sys.stdout:
+            rfile.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Searched {num_queries} queries in {elapsed:.2f} seconds"
+          f" ({num_queries / elapsed if elapsed else 0:.1f} queries/sec)", file=sys.stderr)
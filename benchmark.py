@@ -0,0 +1,967 @@
+#!/usr/bin/python3
+import sys
+import getopt
+import os
+import csv
+import time
+import tempfile
+import subprocess
+import tracemalloc
+
+import index
+import postings
+
+# Benchmarks for index.py and the search scripts. Every experiment runs the scripts as
+# separate processes, exactly as they are used for the assignment, and prints a small
+# table of timings to stdout.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DATASET = os.path.join(HERE, 'test_sample.csv')
+
+def usage():
+    print("usage: " + sys.argv[0] + " experiment [-i dataset-file] [-r repeat]")
+    print("experiments: " + ' '.join(EXPERIMENTS))
+
+# Generic helpers ########################################################################
+
+def read_rows(dataset_file):
+    csv.field_size_limit(2147483647)
+    with open(dataset_file, 'r', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        return reader.fieldnames, list(reader)
+
+# Write the first `count` rows of `rows` (cycled, with fresh document IDs for every
+# repetition) to a new CSV file, so that corpora larger than the sample can be simulated
+def write_slice(path, fieldnames, rows, count):
+    id_step = max(int(row['document_id']) for row in rows) + 1
+    with open(path, 'w', encoding='utf-8', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(count):
+            row = dict(rows[i % len(rows)])
+            row['document_id'] = str(int(row['document_id']) + (i // len(rows)) * id_step)
+            writer.writerow(row)
+
+# Run a script to completion, returning its wall time and peak RSS in MB
+def run_script_measured(script, *args):
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, script), *args],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _pid, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start_time
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise subprocess.CalledProcessError(os.waitstatus_to_exitcode(status), script)
+    return elapsed, rusage.ru_maxrss / 1024
+
+def run_script(script, *args):
+    return run_script_measured(script, *args)[0]
+
+def run_python(*args):
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=HERE, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+def run_index(workdir, dataset_file, *args):
+    dict_file = os.path.join(workdir, 'dictionary.txt')
+    postings_file = os.path.join(workdir, 'postings.txt')
+    elapsed = run_script('index.py', '-i', dataset_file, '-d', dict_file, '-p', postings_file, *args)
+    return elapsed, dict_file, postings_file
+
+# Experiments ############################################################################
+
+# Indexing time on growing slices of the dataset. With linear-time document length
+# computation the time per document should stay roughly constant.
+def bench_index_scaling(dataset_file, repeat):
+    fieldnames, rows = read_rows(dataset_file)
+    total = len(rows) * repeat
+    print(f"{'docs':>8} {'seconds':>10} {'ms/doc':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for step in range(1, 5):
+            count = max(1, total * step // 4)
+            slice_file = os.path.join(workdir, 'slice.csv')
+            write_slice(slice_file, fieldnames, rows, count)
+            elapsed, _, _ = run_index(workdir, slice_file)
+            print(f"{count:>8} {elapsed:>10.2f} {1000 * elapsed / count:>10.1f}")
+
+# Indexing time with an increasing number of worker processes (-j)
+def bench_index_parallel(dataset_file, repeat):
+    fieldnames, rows = read_rows(dataset_file)
+    print(f"{'jobs':>8} {'seconds':>10} {'speedup':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        serial_time = None
+        jobs = 1
+        while jobs <= os.cpu_count():
+            elapsed, _, _ = run_index(workdir, slice_file, '-j', str(jobs))
+            serial_time = serial_time or elapsed
+            print(f"{jobs:>8} {elapsed:>10.2f} {serial_time / elapsed:>10.2f}")
+            jobs *= 2
+
+# Peak memory of in-memory indexing against SPIMI (-m) with shrinking block budgets
+def bench_index_memory(dataset_file, repeat):
+    fieldnames, rows = read_rows(dataset_file)
+    print(f"{'mode':>10} {'seconds':>10} {'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        for mode, args in (('memory', ()), ('-m 64', ('-m', '64')), ('-m 16', ('-m', '16')), ('-m 4', ('-m', '4'))):
+            elapsed, peak_rss = run_script_measured('index.py', '-i', slice_file,
+                                                    '-d', os.path.join(workdir, 'dictionary.txt'),
+                                                    '-p', os.path.join(workdir, 'postings.txt'), *args)
+            print(f"{mode:>10} {elapsed:>10.2f} {peak_rss:>10.1f}")
+
+# Peak memory of reading, and of reading and tokenizing, a dataset holding one huge
+# judgment (every content of the sample, `repeat` times over): whole rows from
+# csv.DictReader against the streaming reader used by index.py
+def bench_ingest_memory(dataset_file, repeat):
+    import dataset
+    import text_analysis
+
+    fieldnames, rows = read_rows(dataset_file)
+    huge_row = dict(rows[0], content='\n \n'.join(row['content'] for row in rows) * repeat)
+    text_analysis.warm_up()
+
+    def whole_rows(path, tokenize):
+        with open(path, 'r', encoding='utf-8', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                for _term in (text_analysis.analyze(row['content']) if tokenize else ()):
+                    pass
+
+    def streamed(path, tokenize):
+        for _fields, chunks in dataset.read_documents(path):
+            for _term in (text_analysis.analyze_chunks(chunks) if tokenize else chunks):
+                pass
+
+    print(f"content {len(huge_row['content']) / 2**20:.1f} MB")
+    print(f"{'reader':>10} {'stage':>16} {'seconds':>10} {'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        huge_file = os.path.join(workdir, 'huge.csv')
+        with open(huge_file, 'w', encoding='utf-8', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerow(huge_row)
+        del huge_row, rows
+
+        for tokenize in (False, True):
+            for name, ingest in (('csv', whole_rows), ('streaming', streamed)):
+                tracemalloc.start()
+                start_time = time.perf_counter()
+                ingest(huge_file, tokenize)
+                elapsed = time.perf_counter() - start_time
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                stage = 'read + tokenize' if tokenize else 'read'
+                print(f"{name:>10} {stage:>16} {elapsed:>10.2f} {peak / 2**20:>10.1f}")
+
+# Rows that csv.DictReader and dataset.read_rows must read alike: quoting, blank lines, a
+# short row, a row with extra fields and a row ending inside the streamed field
+CONFORMANCE_CSV = ('document_id,title,content,date_posted,court\r\n'
+                   '1,"A ""quoted"" title","multi\nline, content",2001-01-01,High Court\r\n'
+                   '\r\n'
+                   '2,short row\r\n'
+                   '3,t3,c3,2003-03-03,Court of Appeal,extra,fields\n'
+                   '4,t4,c4\n'
+                   '5,t5,,,\n')
+
+# Check that the streaming reader returns the rows csv.DictReader returns on CONFORMANCE_CSV
+# and on the dataset, with fields beyond the header ignored; fails on any difference
+def bench_dataset_conformance(dataset_file, repeat):
+    import dataset
+
+    with tempfile.TemporaryDirectory() as workdir:
+        edge_file = os.path.join(workdir, 'edge.csv')
+        with open(edge_file, 'w', encoding='utf-8', newline='') as csvfile:
+            csvfile.write(CONFORMANCE_CSV)
+        for path in (edge_file, dataset_file):
+            with open(path, 'r', encoding='utf-8', newline='') as csvfile:
+                expected = [{name: value for name, value in row.items() if name is not None}
+                            for row in csv.DictReader(csvfile)]
+            rows = list(dataset.read_rows(path))
+            assert len(rows) == len(expected), f"{path}: {len(rows)} rows, csv.DictReader reads {len(expected)}"
+            for number, (row, expected_row) in enumerate(zip(rows, expected), 1):
+                assert row == expected_row, f"{path} row {number}: {row} != {expected_row}"
+            print(f"{os.path.basename(path)}: {len(rows)} rows identical to csv.DictReader")
+
+# The seek + readline + str.split postings access the search scripts used to do
+def read_postings_by_line(postings_file, dictionary):
+    with open(postings_file, 'r', encoding='utf8') as p_file:
+        total_postings = 0
+        for info in dictionary.values():
+            p_file.seek(info.offset)
+            line = p_file.readline().strip().split()
+            total_postings += len([(int(p.split(':')[0]), int(p.split(':')[1])) for p in line])
+    return total_postings
+
+def read_postings_mapped(postings_file, dictionary):
+    reader = postings.PostingsFile(postings_file)
+    try:
+        return sum(len(reader.postings(info)) for info in dictionary.values())
+    finally:
+        reader.close()
+
+# Size and decode speed of the text postings format against the binary (-b) format, and
+# of the memory-mapped reader against seek + readline
+def bench_postings_format(dataset_file, repeat):
+    fieldnames, rows = read_rows(dataset_file)
+    print(f"{'format':>8} {'reader':>8} {'file KB':>10} {'postings':>10} {'decode ms':>10} {'ns/posting':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        for name, args in (('text', ()), ('binary', ('-b',))):
+            _, dict_file, postings_file = run_index(workdir, slice_file, *args)
+            dictionary = postings.load_dictionary(dict_file)
+            readers = [('readline', read_postings_by_line), ('mmap', read_postings_mapped)]
+            for reader_name, read_all in readers[name == 'binary':]:
+                start_time = time.perf_counter()
+                total_postings = read_all(postings_file, dictionary)
+                elapsed = time.perf_counter() - start_time
+                print(f"{name:>8} {reader_name:>8} {os.path.getsize(postings_file) / 1024:>10.1f} {total_postings:>10}"
+                      f" {1000 * elapsed:>10.1f} {1e9 * elapsed / total_postings:>10.0f}")
+
+# Load time, Python heap and lookup time of the text dictionary against the compact one
+# (index.py -c), for the sample's dictionary and a synthetic one of 200000 x repeat keys
+# made of numbered copies of the sample's keys
+def bench_dictionary(dataset_file, repeat):
+    print(f"{'keys':>9} {'format':>8} {'file KB':>10} {'load ms':>9} {'heap MB':>9} {'lookup us':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        _, dict_file, _ = run_index(workdir, dataset_file)
+        sample = postings.read_dictionary(dict_file)
+        scaled = {}
+        for copy in range(-(-200000 * repeat // len(sample))):
+            scaled.update((f"{key}.{copy}", info) for key, info in sample.items())
+        for dictionary in (sample, scaled):
+            text_file = os.path.join(workdir, 'dictionary.txt')
+            with open(text_file, 'w', encoding='utf8') as d_file:
+                for key, info in dictionary.items():
+                    d_file.write(f"{key} {info.offset} {info.df} {info.length} {info.max_weight}\n")
+            compact_file = os.path.join(workdir, 'dictionary.bin')
+            postings.write_compact_dictionary(compact_file, dictionary)
+            lookup_keys = list(dictionary)[::max(1, len(dictionary) // 10000)]
+            for name, path in (('text', text_file), ('compact', compact_file)):
+                tracemalloc.start()
+                start_time = time.perf_counter()
+                loaded = postings.read_dictionary(path)
+                load_time = time.perf_counter() - start_time
+                heap = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                start_time = time.perf_counter()
+                for key in lookup_keys:
+                    loaded[key]
+                lookup_time = (time.perf_counter() - start_time) / len(lookup_keys)
+                print(f"{len(dictionary):>9} {name:>8} {os.path.getsize(path) / 1024:>10.1f} {1000 * load_time:>9.1f}"
+                      f" {heap / 2**20:>9.2f} {1e6 * lookup_time:>10.2f}")
+                if name == 'compact':
+                    loaded.close()
+                del loaded  # so freeing it is not timed with the next load
+
+# Loading the document lengths from the postings header against mapping the length table,
+# and normalizing the scores of a tenth of the documents, for 100000 x repeat documents
+def bench_doc_lengths(dataset_file, repeat):
+    num_docs = 100000 * repeat
+    lengths = {'LC': {doc_id: 1.0 + doc_id % 97 for doc_id in range(num_docs)},
+               'LT': {doc_id: 1.0 + doc_id % 7 for doc_id in range(num_docs)}}
+    scores = dict.fromkeys(range(0, num_docs, 10), 1.0)
+    print(f"{'source':>8} {'load ms':>9} {'normalize ms':>13}")
+    with tempfile.TemporaryDirectory() as workdir:
+        postings_file = os.path.join(workdir, 'postings.txt')
+        with open(postings_file, 'wb') as p_file:
+            postings.write_header(p_file, lengths['LC'], lengths['LT'], False)
+        for source in ('header', 'table'):
+            if source == 'table':
+                postings.write_doc_length_table(postings_file, postings.read_doc_lengths(postings_file, {}))
+            start_time = time.perf_counter()
+            doc_lengths = postings.load_doc_lengths(postings_file)
+            load_time = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            doc_index = doc_lengths.doc_indices
+            content_lengths = doc_lengths.lengths['content']
+            for doc_id in scores:
+                scores[doc_id] / content_lengths[doc_index[doc_id]]
+            normalize_time = time.perf_counter() - start_time
+            print(f"{source:>8} {1000 * load_time:>9.1f} {1000 * normalize_time:>13.1f}")
+            doc_lengths.close()
+
+# Queries made of high-df terms, where per-posting Python scoring is most expensive
+HIGH_DF_QUERIES = ['court', 'the court', 'the court of appeal', 'in the high court of singapore']
+
+def time_queries(score_query, queries, rounds=5):
+    start_time = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            score_query(query)
+    return (time.perf_counter() - start_time) / (rounds * len(queries))
+
+# Dict-based scoring against the NumPy scorer (search_tfidf_weight.py -n) on high-df terms
+def bench_numpy_scoring(dataset_file, repeat):
+    import search_tfidf_weight
+    from numpy_scoring import NumpyScorer
+
+    fieldnames, rows = read_rows(dataset_file)
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        total_docs = len(doc_lengths)
+        scorer = NumpyScorer(doc_lengths)
+
+        print(f"{'query':>32} {'df':>6} {'dict ms':>10} {'numpy ms':>10} {'speedup':>10}")
+        for query in HIGH_DF_QUERIES:
+            timings = [time_queries(lambda q: search_tfidf_weight.compute_tfidf_scores(
+                           q, dictionary, postings_file, doc_lengths, total_docs, engine), [query])
+                       for engine in (None, scorer)]
+            df = max(dictionary[f"C:{term}"].df for term in query.split() if f"C:{term}" in dictionary)
+            print(f"{query:>32} {df:>6} {1000 * timings[0]:>10.2f} {1000 * timings[1]:>10.2f}"
+                  f" {timings[0] / timings[1]:>10.2f}")
+
+# Long queries of common legal words, where exhaustive scoring touches most documents
+LONG_QUERIES = ['the court held that the appellant was entitled to damages for breach of the contract',
+                'whether the judge erred in law in finding that the defendant had a duty of care']
+
+# Exhaustive ranking against MaxScore top-K (search_tfidf_weight.py -k)
+def bench_top_k(dataset_file, repeat):
+    import search_tfidf_weight
+
+    fieldnames, rows = read_rows(dataset_file)
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        total_docs = len(doc_lengths)
+
+        print(f"{'top-k':>8} {'ms/query':>10}")
+        for top_k in (None, 1000, 100, 10):
+            elapsed = time_queries(lambda q: search_tfidf_weight.compute_tfidf_scores(
+                q, dictionary, postings_file, doc_lengths, total_docs, None, top_k), LONG_QUERIES)
+            print(f"{str(top_k or 'all'):>8} {1000 * elapsed:>10.2f}")
+
+# Scoring from the impact index (index.py -I, search_tfidf_weight.py -I) against scoring
+# from the postings, exhaustive, top-K and top-K with a postings budget (-e), with the
+# overlap of the top documents (at most 10) with those of the exact scores
+def bench_impacts(dataset_file, repeat):
+    import search_tfidf_weight
+
+    fieldnames, rows = read_rows(dataset_file)
+    queries = HIGH_DF_QUERIES + LONG_QUERIES
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b', '-I')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        total_docs = len(doc_lengths)
+        impacts = postings.open_impacts(postings_file)
+        print(f"postings {os.path.getsize(postings_file) / 2**20:.1f} MB,"
+              f" impact index {os.path.getsize(postings.side_file(postings_file, postings.IMPACTS_EXTENSION)) / 2**20:.1f} MB")
+
+        def search(q, top_k, impact_index=None, max_postings=None):
+            return search_tfidf_weight.compute_tfidf_scores(q, dictionary, postings_file, doc_lengths, total_docs,
+                                                            None, top_k, impacts=impact_index, max_postings=max_postings)
+
+        print(f"{'top-k':>8} {'budget':>8} {'postings ms':>12} {'impacts ms':>11} {'speedup':>8} {'overlap':>8}")
+        num_docs = doc_lengths.num_docs
+        for top_k, max_postings in ((None, None), (100, None), (10, None), (10, num_docs), (10, num_docs // 4)):
+            exact = {query: search(query, top_k)[:10] for query in queries}
+            overlaps = [len(set(exact[query]) & set(search(query, top_k, impacts, max_postings)[:10])) / len(exact[query])
+                        for query in queries]
+            timings = [time_queries(lambda q: search(q, top_k), queries),
+                       time_queries(lambda q: search(q, top_k, impacts, max_postings), queries)]
+            print(f"{str(top_k or 'all'):>8} {str(max_postings or '-'):>8} {1000 * timings[0]:>12.2f}"
+                  f" {1000 * timings[1]:>11.2f} {timings[0] / timings[1]:>8.2f} {100 * sum(overlaps) / len(overlaps):>7.1f}%")
+
+# Recall and latency of top-K queries with punctuation tokens left out
+# (search_tfidf_weight.PRUNE_TERMS), then answered from the tiered index (index.py -T),
+# exactly and with -T, against MaxScore over every term. Recall is the share of the top K
+# over every term that each mode returns.
+def bench_tiers(dataset_file, repeat):
+    import search_tfidf_weight
+
+    fieldnames, rows = read_rows(dataset_file)
+    queries = HIGH_DF_QUERIES + LONG_QUERIES + PHRASE_QUERIES
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b', '-T')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        total_docs = len(doc_lengths)
+        tiers = postings.open_tiers(postings_file)
+        print(f"postings {os.path.getsize(postings_file) / 2**20:.1f} MB,"
+              f" tiered index {os.path.getsize(postings.side_file(postings_file, postings.TIERS_EXTENSION)) / 2**20:.1f} MB")
+
+        # Count the queries the tiers answer without the full lists
+        tier_answers = [0, 0]
+        tiered_top_k = search_tfidf_weight.tiered_top_k
+        def counted_tiered_top_k(*args):
+            ranked = tiered_top_k(*args)
+            tier_answers[ranked is not None] += 1
+            return ranked
+        search_tfidf_weight.tiered_top_k = counted_tiered_top_k
+
+        modes = {
+            'all terms': (False, None, False),
+            'pruned': (True, None, False),
+            'pruned+tiers': (True, tiers, False),
+            'pruned+tiers -T': (True, tiers, True),
+        }
+        print(f"{'mode':>16} {'top-k':>6} {'ms/query':>9} {'recall':>7} {'tier 1 only':>12}")
+        for top_k in (10, 100):
+            reference = None
+            for mode, (prune, mode_tiers, approximate) in modes.items():
+                search_tfidf_weight.PRUNE_TERMS = prune
+                def search(q):
+                    return search_tfidf_weight.compute_tfidf_scores(q, dictionary, postings_file, doc_lengths, total_docs,
+                                                                    None, top_k, tiers=mode_tiers, approximate_tiers=approximate)
+                tier_answers[:] = [0, 0]
+                results = {query: search(query) for query in queries}
+                answered = f"{100 * tier_answers[1] / len(queries):.0f}%" if mode_tiers else '-'
+                reference = reference or results
+                recall = (sum(len(set(results[query]) & set(reference[query])) for query in queries)
+                          / sum(len(reference[query]) for query in queries))
+                elapsed = time_queries(search, queries)
+                print(f"{mode:>16} {top_k:>6} {1000 * elapsed:>9.2f} {100 * recall:>6.1f}% {answered:>12}")
+        search_tfidf_weight.tiered_top_k = tiered_top_k
+        search_tfidf_weight.PRUNE_TERMS = False
+
+# Quoted phrases whose words are common, so plain scoring already touches many documents
+PHRASE_QUERIES = ['"high court"', '"court of appeal"', '"breach of contract" damages',
+                  '"the defendant had a duty of care"']
+
+# Size of the positional index (-P) and the latency of phrase queries with it, against the
+# same queries scored as independent words on an index without positions
+def bench_phrase(dataset_file, repeat):
+    import query_eval
+    import search_tfidf_weight
+
+    fieldnames, rows = read_rows(dataset_file)
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        print(f"{'index':>10} {'build s':>8} {'postings KB':>12} {'positions KB':>13}")
+        indexes = {}
+        for name, args in (('plain', ()), ('positional', ('-P',))):
+            index_dir = os.path.join(workdir, name)
+            os.mkdir(index_dir)
+            elapsed, dict_file, postings_file = run_index(index_dir, slice_file, '-b', *args)
+            positions_size = sum(os.path.getsize(postings.side_file(postings_file, extension))
+                                 for extension in (postings.POSITIONS_EXTENSION, postings.POSITIONS_DICTIONARY_EXTENSION)
+                                 if os.path.exists(postings.side_file(postings_file, extension)))
+            print(f"{name:>10} {elapsed:>8.2f} {os.path.getsize(postings_file) / 1024:>12.1f} {positions_size / 1024:>13.1f}")
+            indexes[name] = dict_file, postings_file
+
+        print(f"{'query':>38} {'matches':>8} {'phrase ms':>10} {'plain ms':>9} {'boosted ms':>11}")
+        dictionary, postings_file = indexes['positional']
+        dictionary = postings.load_dictionary(dictionary)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        for query in PHRASE_QUERIES:
+            with postings.PostingsReader(postings_file) as reader:
+                boosts = query_eval.phrase_boosts(query, dictionary, reader, postings_file)
+                phrase_time = time_queries(lambda q: query_eval.phrase_boosts(q, dictionary, reader, postings_file), [query])
+            timings = []
+            for name in ('plain', 'positional'):
+                dict_file, postings_file = indexes[name]
+                index_dictionary = postings.load_dictionary(dict_file)
+                index_lengths = postings.load_doc_lengths(postings_file)
+                timings.append(time_queries(lambda q: search_tfidf_weight.compute_tfidf_scores(
+                    q, index_dictionary, postings_file, index_lengths, len(index_lengths)), [query]))
+            print(f"{query:>38} {len(boosts):>8} {1000 * phrase_time:>10.2f} {1000 * timings[0]:>9.2f}"
+                  f" {1000 * timings[1]:>11.2f}")
+
+# Conjunctive queries, from selective ones to one of only common words
+AND_QUERIES = ['fertility AND treatment', '"criminal law" AND murder', 'negligence AND duty AND care',
+               'court AND appeal AND judge']
+
+# AND queries intersected before scoring against the same words scored as a free-text query
+def bench_boolean(dataset_file, repeat):
+    import query_eval
+    import search_tfidf_weight
+
+    fieldnames, rows = read_rows(dataset_file)
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        total_docs = len(doc_lengths)
+
+        print(f"{'query':>32} {'min df':>7} {'matches':>8} {'union':>6} {'AND ms':>8} {'free ms':>8} {'speedup':>8}")
+        for query in AND_QUERIES:
+            free_query = query.replace(' AND ', ' ')
+            dfs = [sum(dictionary[key].df for key in (f"C:{term}", f"T:{term}") if key in dictionary)
+                   for term in query_eval.conjunctive_terms(query)]
+            matches = search_tfidf_weight.compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_docs)
+            union = search_tfidf_weight.compute_tfidf_scores(free_query, dictionary, postings_file, doc_lengths, total_docs)
+            timings = [time_queries(lambda q: search_tfidf_weight.compute_tfidf_scores(
+                           q, dictionary, postings_file, doc_lengths, total_docs), [q])
+                       for q in (query, free_query)]
+            print(f"{query:>32} {min(dfs):>7} {len(matches):>8} {len(union):>6} {1000 * timings[0]:>8.2f}"
+                  f" {1000 * timings[1]:>8.2f} {timings[1] / timings[0]:>8.2f}")
+
+# A broad query under court and date filters of decreasing selectivity
+FILTERED_QUERY = 'damages for breach of contract'
+QUERY_FILTERS = ['', 'court:"High Court"', 'date:1990..1999', 'court:appeal date:2000..', 'court:district']
+
+# Latency and postings scored with court: and date: filters, against the unfiltered query
+def bench_filters(dataset_file, repeat):
+    import query_eval
+    import search_tfidf_weight
+    import text_analysis
+
+    fieldnames, rows = read_rows(dataset_file)
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b', '-c')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        total_docs = len(doc_lengths)
+        date_index = query_eval.DateIndex(dictionary)
+        terms = set(text_analysis.analyze(FILTERED_QUERY))
+
+        print(f"{'filters':>26} {'allowed':>8} {'scored':>7} {'filter ms':>10} {'query ms':>9}")
+        for query_filters in QUERY_FILTERS:
+            query = f"{FILTERED_QUERY} {query_filters}"
+            _, filters = query_eval.parse_filters(query)
+            with postings.PostingsReader(postings_file) as reader:
+                keys = [key for term in terms for key in (f"C:{term}", f"T:{term}") if key in dictionary]
+                if filters:
+                    allowed = filters.allowed(dictionary, reader, doc_lengths, date_index)
+                    filter_time = time_queries(lambda _q: filters.allowed(dictionary, reader, doc_lengths, date_index), [query])
+                    conjunction = query_eval.ConjunctiveFilter((), dictionary, reader, allowed)
+                    scored = sum(len(conjunction.postings(key, dictionary[key], reader)) for key in keys)
+                else:
+                    allowed = doc_lengths.doc_ids
+                    filter_time = 0.0
+                    scored = sum(dictionary[key].df for key in keys)
+            elapsed = time_queries(lambda q: search_tfidf_weight.compute_tfidf_scores(
+                q, dictionary, postings_file, doc_lengths, total_docs, date_index=date_index), [query])
+            print(f"{query_filters or '(none)':>26} {len(allowed):>8} {scored:>7} {1000 * filter_time:>10.2f}"
+                  f" {1000 * elapsed:>9.2f}")
+
+# PRF expansion by a scan of every content postings list against reading the top docs'
+# forward index vectors (index.py -f), as the index grows
+def bench_prf_expansion(dataset_file, repeat):
+    import search_prf
+
+    fieldnames, rows = read_rows(dataset_file)
+    print(f"{'documents':>10} {'terms':>8} {'scan ms':>10} {'forward ms':>11} {'speedup':>10}")
+    for size in sorted({len(rows), len(rows) * repeat}):
+        with tempfile.TemporaryDirectory() as workdir:
+            slice_file = os.path.join(workdir, 'slice.csv')
+            write_slice(slice_file, fieldnames, rows, size)
+            _, dict_file, postings_file = run_index(workdir, slice_file, '-b', '-f')
+            dictionary = postings.load_dictionary(dict_file)
+            doc_lengths = postings.load_doc_lengths(postings_file)
+            total_docs = doc_lengths.num_docs
+            forward = search_prf.open_forward_index(postings_file, dictionary)
+
+            # Initial retrieval for every query, so only the expansion itself is timed
+            feedback = {}
+            for query in LONG_QUERIES:
+                terms = search_prf.preprocess(query)
+                scores = search_prf.compute_scores(terms, dictionary, postings_file, doc_lengths, total_docs)
+                feedback[query] = (terms, [doc for doc, _ in sorted(scores.items(), key=lambda x: x[1],
+                                                                     reverse=True)[:search_prf.TOP_K_DOCS]])
+
+            timings = [time_queries(lambda q: search_prf.expand_query(*feedback[q], dictionary, postings_file,
+                                                                      doc_lengths, total_docs, engine),
+                                    LONG_QUERIES, rounds=2)
+                       for engine in (None, forward)]
+            forward[0].close()
+            print(f"{size:>10} {len(forward[1]):>8} {1000 * timings[0]:>10.2f} {1000 * timings[1]:>11.2f}"
+                  f" {timings[0] / timings[1]:>10.2f}")
+
+# Tokenizing and stemming the dataset contents through the shared pipeline, with and
+# without the stem cache
+def bench_tokenize(dataset_file, repeat):
+    import text_analysis
+
+    _fieldnames, rows = read_rows(dataset_file)
+    texts = [row['content'] for row in rows] * repeat
+    porter_stem = text_analysis.porter_stem()
+
+    def uncached(text):
+        return [porter_stem(word) for words in text_analysis.sentences(text) for word in words]
+
+    print(f"{'stemming':>10} {'tokens':>10} {'seconds':>10} {'tokens/sec':>12}")
+    text_analysis.stem.cache_clear()
+    for name, analyze in (('uncached', uncached), ('cached', text_analysis.analyze)):
+        start_time = time.perf_counter()
+        num_tokens = sum(sum(1 for _term in analyze(text)) for text in texts)
+        elapsed = time.perf_counter() - start_time
+        print(f"{name:>10} {num_tokens:>10} {elapsed:>10.2f} {num_tokens / elapsed:>12.0f}")
+    print(text_analysis.stem_cache_stats())
+
+# Conformance and speed of the regex tokenizer (index.py -t regex) against the NLTK path,
+# over every text field of the dataset: the share of NLTK tokens the regex tokenizer
+# reproduces in sequence, the most common differences, and tokens/sec of both
+# (tokenizer-conformance is the pass/fail check)
+def bench_tokenizer(dataset_file, repeat):
+    import unicodedata
+    from difflib import SequenceMatcher
+    from collections import Counter
+    import text_analysis
+
+    _fieldnames, rows = read_rows(dataset_file)
+    texts = [unicodedata.normalize('NFKD', row[field]) for row in rows
+             for field in ('content', 'title', 'court') if row[field]]
+    split_sentences, split_words = text_analysis.tokenizers()
+    tokenizers = {
+        'nltk': lambda text: [word for sentence in split_sentences(text) for word in split_words(sentence)],
+        'regex': text_analysis.regex_tokenize,
+    }
+
+    print(f"{'tokenizer':>10} {'tokens':>10} {'seconds':>10} {'tokens/sec':>12}")
+    tokens = {}
+    for name, tokenize in tokenizers.items():
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            tokens[name] = [tokenize(text) for text in texts]
+        elapsed = time.perf_counter() - start_time
+        num_tokens = repeat * sum(map(len, tokens[name]))
+        print(f"{name:>10} {num_tokens:>10} {elapsed:>10.2f} {num_tokens / elapsed:>12.0f}")
+
+    matched = 0
+    differences = Counter()
+    for nltk_tokens, regex_tokens in zip(tokens['nltk'], tokens['regex']):
+        matcher = SequenceMatcher(None, nltk_tokens, regex_tokens, autojunk=False)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == 'equal':
+                matched += i2 - i1
+            else:
+                differences[(' '.join(nltk_tokens[i1:i2]), ' '.join(regex_tokens[j1:j2]))] += 1
+    total = sum(map(len, tokens['nltk']))
+    print(f"conformance: {matched}/{total} NLTK tokens reproduced ({100 * matched / total:.3f}%)")
+    for (nltk_side, regex_side), count in differences.most_common(10):
+        print(f"{count:>6}  nltk: {nltk_side!r:<30} regex: {regex_side!r}")
+
+# The token stream with the final periods of text_analysis.PERIOD_DIFFERENCES split off
+def split_known_periods(tokens):
+    import text_analysis
+    for token in tokens:
+        if token.endswith('.') and token[:-1].lower() in text_analysis.PERIOD_DIFFERENCES:
+            yield token[:-1]
+            yield '.'
+        else:
+            yield token
+
+# Check that the regex tokenizer (index.py -t regex) splits every text field of the dataset
+# as sent_tokenize + word_tokenize do with the English Punkt model, except for the final
+# periods of text_analysis.PERIOD_DIFFERENCES; fails on any other difference, and without
+# the trained model
+def bench_tokenizer_conformance(dataset_file, repeat):
+    import unicodedata
+    from difflib import SequenceMatcher
+    from collections import Counter
+    import text_analysis
+    from nltk.tokenize import PunktTokenizer
+
+    text_analysis.require('punkt_tab')
+    assert PunktTokenizer('english')._params.abbrev_types, \
+        "the installed English punkt_tab model is untrained (no abbreviations), reinstall it with nltk.download('punkt_tab')"
+
+    _fieldnames, rows = read_rows(dataset_file)
+    texts = [unicodedata.normalize('NFKD', row[field]) for row in rows
+             for field in ('content', 'title', 'court') if row[field]]
+    split_sentences, split_words = text_analysis.tokenizers()
+    known = Counter()
+    unexplained = Counter()
+    for text in texts:
+        nltk_tokens = [word for sentence in split_sentences(text) for word in split_words(sentence)]
+        regex_tokens = text_analysis.regex_tokenize(text)
+        matcher = SequenceMatcher(None, nltk_tokens, regex_tokens, autojunk=False)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == 'equal':
+                continue
+            nltk_side, regex_side = nltk_tokens[i1:i2], regex_tokens[j1:j2]
+            if list(split_known_periods(nltk_side)) == list(split_known_periods(regex_side)):
+                for token in nltk_side + regex_side:
+                    if token.endswith('.') and token[:-1].lower() in text_analysis.PERIOD_DIFFERENCES:
+                        known[token.lower()] += 1
+            else:
+                unexplained[(' '.join(nltk_side), ' '.join(regex_side))] += 1
+
+    for token, count in known.most_common():
+        print(f"{count:>6}  {token!r} (period split differently)")
+    assert not unexplained, "regex tokens differ from NLTK:\n" + '\n'.join(
+        f"{count:>6}  nltk: {nltk_side!r:<30} regex: {regex_side!r}"
+        for (nltk_side, regex_side), count in unexplained.most_common(10))
+    print(f"{len(texts)} texts tokenized alike apart from the periods of {sorted(text_analysis.PERIOD_DIFFERENCES)}")
+
+# Throughput of one process per query against a single batch (-b) process
+def bench_batch(dataset_file, repeat):
+    fieldnames, rows = read_rows(dataset_file)
+    queries = (HIGH_DF_QUERIES + LONG_QUERIES) * repeat
+    print(f"{'script':>36} {'mode':>8} {'queries/sec':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        _, dict_file, postings_file = run_index(workdir, dataset_file, '-b')
+        query_file = os.path.join(workdir, 'queries.txt')
+        results_file = os.path.join(workdir, 'results.txt')
+        for script in ('search_tfidf_weight.py', 'search_prf.py'):
+            elapsed = 0
+            for query in queries:
+                with open(query_file, 'w', encoding='utf8') as qfile:
+                    qfile.write(query + '\n')
+                elapsed += run_script(script, '-d', dict_file, '-p', postings_file, '-q', query_file, '-o', results_file)
+            print(f"{script:>36} {'single':>8} {len(queries) / elapsed:>12.1f}")
+
+            with open(query_file, 'w', encoding='utf8') as qfile:
+                qfile.write('\n'.join(queries) + '\n')
+            elapsed = run_script(script, '-d', dict_file, '-p', postings_file, '-q', query_file, '-o', results_file, '-b')
+            print(f"{script:>36} {'batch':>8} {len(queries) / elapsed:>12.1f}")
+
+            # Every query is answered from the result cache file written by the first run
+            cache_file = os.path.join(workdir, 'cache.bin')
+            run_script(script, '-d', dict_file, '-p', postings_file, '-q', query_file, '-o', results_file, '-b',
+                       '-c', cache_file)
+            elapsed = run_script(script, '-d', dict_file, '-p', postings_file, '-q', query_file, '-o', results_file, '-b',
+                                 '-c', cache_file)
+            print(f"{script:>36} {'cached':>8} {len(queries) / elapsed:>12.1f}")
+            os.remove(cache_file)
+
+# Latency of a query scored from scratch against a result cache hit, which still
+# tokenizes and stems the query to build its key
+def bench_result_cache(dataset_file, repeat):
+    import search_tfidf_weight
+    from result_cache import ResultCache, index_files
+
+    fieldnames, rows = read_rows(dataset_file)
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        total_docs = len(doc_lengths)
+        cache = ResultCache(index_files(dict_file, postings_file))
+
+        def search(query):
+            return search_tfidf_weight.compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_docs)
+
+        search(HIGH_DF_QUERIES[0])  # load the tokenizer models first
+        print(f"{'query':>84} {'search ms':>10} {'hit ms':>8}")
+        for query in HIGH_DF_QUERIES + LONG_QUERIES:
+            search_time = time_queries(search, [query])
+            hit_time = time_queries(lambda q: cache.get(search_tfidf_weight.cache_key(q), lambda: search(q)), [query])
+            print(f"{query:>84} {1000 * search_time:>10.2f} {1000 * hit_time:>8.3f}")
+        print(cache.stats())
+
+# A query workload repeating high-df terms, searched with the postings cache disabled and
+# enabled, by the weight script and by PRF (which reads its lists twice per query)
+def bench_postings_cache(dataset_file, repeat):
+    import search_tfidf_weight
+    import search_prf
+
+    fieldnames, rows = read_rows(dataset_file)
+    queries = HIGH_DF_QUERIES + LONG_QUERIES + PHRASE_QUERIES
+    with tempfile.TemporaryDirectory() as workdir:
+        slice_file = os.path.join(workdir, 'slice.csv')
+        write_slice(slice_file, fieldnames, rows, len(rows) * repeat)
+        _, dict_file, postings_file = run_index(workdir, slice_file, '-b')
+        dictionary = postings.load_dictionary(dict_file)
+        doc_lengths = postings.load_doc_lengths(postings_file)
+        scripts = {
+            'search_tfidf_weight.py': lambda q: search_tfidf_weight.compute_tfidf_scores(
+                q, dictionary, postings_file, doc_lengths, len(doc_lengths)),
+            'search_prf.py': lambda q: search_prf.search(q, dictionary, postings_file, doc_lengths, doc_lengths.num_docs),
+        }
+
+        print(f"{'script':>24} {'uncached ms':>12} {'cached ms':>10} {'speedup':>8}")
+        for script, search in scripts.items():
+            search(queries[0])  # load the tokenizer models first
+            timings = []
+            for max_postings in (0, postings.POSTINGS_CACHE_SIZE):
+                postings.postings_cache = postings.PostingsCache(max_postings)
+                timings.append(time_queries(search, queries))
+            print(f"{script:>24} {1000 * timings[0]:>12.2f} {1000 * timings[1]:>10.2f} {timings[0] / timings[1]:>8.2f}")
+        print(postings.postings_cache.stats(dictionary))
+
+# Wait until the background merges after an append are done, so they do not skew timings
+def wait_for_merges(postings_file):
+    while True:
+        with index.index_lock(postings_file, 'merge', blocking=False) as acquired:
+            if acquired and not index.plan_merge(postings.load_manifest(postings_file).segments):
+                return
+        time.sleep(0.1)
+
+# Cost of adding a batch of new documents: a full rebuild against appending a delta
+# segment (-a), and the search time over the base index plus segments against the rebuilt
+# index. "moved" counts the result positions of search_tfidf_weight.py and search_prf.py
+# that differ between the two, which should be none: both hold the same documents, with
+# the same lengths and the dictionary in the same order.
+def bench_append(dataset_file, repeat):
+    fieldnames, rows = read_rows(dataset_file)
+    batch_size = max(1, len(rows) // 10)
+    base_size = len(rows) * repeat
+    queries = HIGH_DF_QUERIES + LONG_QUERIES
+    print(f"{'docs':>8} {'rebuild s':>10} {'append s':>10} {'segments':>9} {'search s':>10} {'rebuilt s':>10}"
+          f" {'moved':>6} {'prf moved':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        all_file = os.path.join(workdir, 'all.csv')
+        write_slice(all_file, fieldnames, rows, base_size + 4 * batch_size)
+        _, all_rows = read_rows(all_file)
+        base_file = os.path.join(workdir, 'base.csv')
+        write_slice(base_file, fieldnames, all_rows, base_size)
+        base_dir = os.path.join(workdir, 'base')
+        os.mkdir(base_dir)
+        _, dict_file, postings_file = run_index(base_dir, base_file)
+
+        query_file = os.path.join(workdir, 'queries.txt')
+        with open(query_file, 'w', encoding='utf8') as qfile:
+            qfile.write('\n'.join(queries) + '\n')
+
+        def search(dict_file, postings_file, results_file, script='search_tfidf_weight.py'):
+            elapsed = run_script(script, '-d', dict_file, '-p', postings_file, '-q', query_file, '-o', results_file, '-b')
+            with open(results_file, encoding='utf8') as rfile:
+                return elapsed, rfile.read().split()
+
+        def moved(results, rebuilt_results):
+            assert len(results) == len(rebuilt_results), "appended and rebuilt indexes return different documents"
+            return sum(doc_id != rebuilt_doc_id for doc_id, rebuilt_doc_id in zip(results, rebuilt_results))
+
+        for batch in range(1, 5):
+            count = base_size + batch * batch_size
+            batch_file = os.path.join(workdir, 'batch.csv')
+            write_slice(batch_file, fieldnames, all_rows[count - batch_size:count], batch_size)
+            append_time = run_script('index.py', '-a', '-i', batch_file, '-d', dict_file, '-p', postings_file)
+            wait_for_merges(postings_file)
+
+            slice_file = os.path.join(workdir, 'slice.csv')
+            write_slice(slice_file, fieldnames, all_rows, count)
+            rebuild_time, rebuilt_dict, rebuilt_postings = run_index(workdir, slice_file)
+            search_time, results = search(dict_file, postings_file, os.path.join(workdir, 'results.txt'))
+            rebuilt_time, rebuilt_results = search(rebuilt_dict, rebuilt_postings, os.path.join(workdir, 'rebuilt.txt'))
+            _, prf_results = search(dict_file, postings_file, os.path.join(workdir, 'prf.txt'), 'search_prf.py')
+            _, prf_rebuilt_results = search(rebuilt_dict, rebuilt_postings, os.path.join(workdir, 'prf_rebuilt.txt'),
+                                            'search_prf.py')
+            num_segments = len(postings.load_manifest(postings_file).segments)
+            print(f"{count:>8} {rebuild_time:>10.2f} {append_time:>10.2f} {num_segments:>9} {search_time:>10.2f}"
+                  f" {rebuilt_time:>10.2f} {moved(results, rebuilt_results):>6}"
+                  f" {moved(prf_results, prf_rebuilt_results):>10}")
+
+SEARCH_SCRIPTS = ['search_tfidf_weight.py', 'search_tfidf_starter.py', 'search_prf.py',
+                  'search_tfidf_weight_wordnet.py', 'search_tfidf_weight_wordnet_cutoff.py']
+
+# Time to first result of every search script: one process answering one query, against
+# the bare interpreter start and the import of the script as a module (NLTK is deferred)
+def bench_startup(dataset_file, repeat):
+    rounds = 5 * repeat
+    print(f"{'script':>38} {'import ms':>10} {'first result ms':>16}")
+    interpreter = min(run_python('-c', 'pass') for _ in range(rounds))
+    print(f"{'(interpreter start)':>38} {1000 * interpreter:>10.1f}")
+    with tempfile.TemporaryDirectory() as workdir:
+        _, dict_file, postings_file = run_index(workdir, dataset_file)
+        query_file = os.path.join(workdir, 'queries.txt')
+        results_file = os.path.join(workdir, 'results.txt')
+        with open(query_file, 'w', encoding='utf8') as qfile:
+            qfile.write(HIGH_DF_QUERIES[-1] + '\n')
+        for script in SEARCH_SCRIPTS:
+            module = script[:-len('.py')]
+            import_time = min(run_python('-c', f"import {module}") for _ in range(rounds))
+            try:
+                first_result = min(run_script(script, '-d', dict_file, '-p', postings_file,
+                                              '-q', query_file, '-o', results_file) for _ in range(rounds))
+                print(f"{script:>38} {1000 * import_time:>10.1f} {1000 * first_result:>16.1f}")
+            except subprocess.CalledProcessError:
+                # e.g. the wordnet scripts without WordNet installed (see text_analysis.py)
+                print(f"{script:>38} {1000 * import_time:>10.1f} {'failed':>16}")
+
+# Time to first result of the WordNet script expanding live and with the precomputed
+# synonym table, and the cost of expanding one query from the table
+def bench_synonyms(dataset_file, repeat):
+    import synonyms
+
+    rounds = 5 * repeat
+    with tempfile.TemporaryDirectory() as workdir:
+        _, dict_file, postings_file = run_index(workdir, dataset_file)
+        query_file = os.path.join(workdir, 'queries.txt')
+        results_file = os.path.join(workdir, 'results.txt')
+        with open(query_file, 'w', encoding='utf8') as qfile:
+            qfile.write(LONG_QUERIES[0] + '\n')
+
+        def first_result():
+            return min(run_script('search_tfidf_weight_wordnet.py', '-d', dict_file, '-p', postings_file,
+                                  '-q', query_file, '-o', results_file) for _ in range(rounds))
+
+        try:
+            live_time = first_result()
+            build_time = run_script('synonyms.py', '-d', dict_file, '-p', postings_file)
+        except subprocess.CalledProcessError:
+            print("WordNet is not installed (see text_analysis.py)")
+            return
+        table_time = first_result()
+        table_size = sum(os.path.getsize(postings.side_file(postings_file, extension))
+                         for extension in (postings.SYNONYMS_EXTENSION, postings.SYNONYMS_DICTIONARY_EXTENSION))
+
+        words = LONG_QUERIES[0].split()
+        table = postings.open_synonyms(postings_file)
+        synonyms.expand_terms(table, words, synonyms.MAX_SENSES)
+        start_time = time.perf_counter()
+        for _ in range(1000):
+            synonyms.expand_terms(table, words, synonyms.MAX_SENSES)
+        expand_time = (time.perf_counter() - start_time) / 1000
+        table.close()
+
+        print(f"table build {build_time:.2f} s, {table_size / 1024:.1f} KB")
+        print(f"{'expansion':>10} {'first result ms':>16}")
+        print(f"{'live':>10} {1000 * live_time:>16.1f}")
+        print(f"{'table':>10} {1000 * table_time:>16.1f}")
+        print(f"table expansion of a {len(words)}-word query: {1e6 * expand_time:.1f} us")
+
+EXPERIMENTS = {
+    'index-scaling': bench_index_scaling,
+    'index-parallel': bench_index_parallel,
+    'index-memory': bench_index_memory,
+    'ingest-memory': bench_ingest_memory,
+    'dataset-conformance': bench_dataset_conformance,
+    'postings-format': bench_postings_format,
+    'dictionary': bench_dictionary,
+    'doc-lengths': bench_doc_lengths,
+    'numpy-scoring': bench_numpy_scoring,
+    'top-k': bench_top_k,
+    'impacts': bench_impacts,
+    'tiers': bench_tiers,
+    'phrase': bench_phrase,
+    'boolean': bench_boolean,
+    'filters': bench_filters,
+    'prf-expansion': bench_prf_expansion,
+    'tokenize': bench_tokenize,
+    'tokenizer': bench_tokenizer,
+    'tokenizer-conformance': bench_tokenizer_conformance,
+    'batch': bench_batch,
+    'result-cache': bench_result_cache,
+    'postings-cache': bench_postings_cache,
+    'startup': bench_startup,
+    'synonyms': bench_synonyms,
+    'append': bench_append,
+}
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in EXPERIMENTS:
+        usage()
+        sys.exit(2)
+    experiment = sys.argv[1]
+
+    dataset_file = SAMPLE_DATASET
+    repeat = 1
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], 'i:r:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o == '-i':
+            dataset_file = a
+        elif o == '-r':
+            repeat = int(a)
+
+    EXPERIMENTS[experiment](dataset_file, repeat)
+
+if __name__ == '__main__':
+    main()
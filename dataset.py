@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+import re
+
+# Streaming reader for the CSV dataset, used by index.py.
+#
+# csv.DictReader holds a whole row, with every field as one string, before it returns it.
+# A judgment's content can be megabytes long, so instead the file is parsed in blocks of
+# READ_SIZE characters and the content field is handed out as an iterator of text chunks
+# while it is being read. Only the small fields of a row are kept as strings. Quoting
+# follows the csv module's default (excel) dialect.
+
+READ_SIZE = 1 << 16
+
+FIELD_END = re.compile(r'[,\r\n]')
+
+class CsvStream:
+    """ Field-by-field parser over a text file opened with newline='' """
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.pos = 0
+        self.row_ended = False  # whether the last field read ended its row
+
+    # Append the next block of the file to the unread part of the buffer
+    def read_more(self):
+        data = self.file.read(READ_SIZE)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    # The character `offset` characters ahead of the read position, '' at the end of file
+    def peek(self, offset=0):
+        while self.pos + offset >= len(self.buffer):
+            if not self.read_more():
+                return ''
+        return self.buffer[self.pos + offset]
+
+    def at_end(self):
+        return self.peek() == ''
+
+    def field_chunks(self):
+        """
+        Yield the next field's text in chunks of at most about READ_SIZE characters.
+        Afterwards `row_ended` tells whether the field was the last of its row.
+        """
+        if self.peek() == '"':
+            self.pos += 1
+            while True:
+                end = self.buffer.find('"', self.pos)
+                if end < 0:
+                    if self.pos < len(self.buffer):
+                        yield self.buffer[self.pos:]
+                        self.pos = len(self.buffer)
+                    if not self.read_more():
+                        raise ValueError("unexpected end of file inside a quoted field")
+                    continue
+                if end > self.pos:
+                    yield self.buffer[self.pos:end]
+                self.pos = end
+                if self.peek(1) == '"':  # escaped quote
+                    yield '"'
+                    self.pos += 2
+                    continue
+                self.pos += 1
+                break
+
+        # Unquoted field, or whatever follows the closing quote up to the delimiter
+        while True:
+            match = FIELD_END.search(self.buffer, self.pos)
+            if match is None:
+                if self.pos < len(self.buffer):
+                    yield self.buffer[self.pos:]
+                    self.pos = len(self.buffer)
+                if not self.read_more():
+                    self.row_ended = True
+                    return
+                continue
+            if match.start() > self.pos:
+                yield self.buffer[self.pos:match.start()]
+            self.pos = match.end()
+            self.row_ended = match.group() != ','
+            if match.group() == '\r' and self.peek() == '\n':
+                self.pos += 1
+            return
+
+    def read_field(self):
+        return ''.join(self.field_chunks())
+
+    def read_row(self):
+        row = [self.read_field()]
+        while not self.row_ended:
+            row.append(self.read_field())
+        return row
+
+    # Skip empty lines between rows, as csv.reader does
+    def skip_blank_lines(self):
+        while self.peek() in ('\r', '\n'):
+            self.pos += 1
+
+def read_documents(dataset_file, streamed_field='content'):
+    """
+    Yield (fields, chunks) for every row of the dataset: `chunks` iterates over the text of
+    `streamed_field` in pieces, and `fields` maps the other column names to their values.
+    Columns after the streamed one are only added to `fields` once `chunks` is exhausted.
+    As with csv.DictReader, the columns missing from a short row are None (a missing
+    streamed field yields no chunks and is None in `fields`), and fields beyond the header
+    are ignored.
+    """
+    with open(dataset_file, 'r', encoding='utf-8', newline='') as file:
+        reader = CsvStream(file)
+        header = reader.read_row()
+        streamed_index = header.index(streamed_field)
+
+        def rest_of_row(fields, row_ended):
+            if row_ended:
+                fields[streamed_field] = None
+            else:
+                yield from reader.field_chunks()
+            for name in header[streamed_index + 1:]:
+                fields[name] = None if reader.row_ended else reader.read_field()
+            while not reader.row_ended:  # fields beyond the header are ignored
+                reader.read_field()
+
+        reader.skip_blank_lines()
+        while not reader.at_end():
+            fields = {}
+            row_ended = False
+            for name in header[:streamed_index]:
+                fields[name] = None if row_ended else reader.read_field()
+                row_ended = reader.row_ended
+            chunks = rest_of_row(fields, row_ended)
+            yield fields, chunks
+            # Finish the row if the caller did not read all of it
+            for _chunk in chunks:
+                pass
+            reader.skip_blank_lines()
+
+# Read every row as a dict, with the streamed field joined into one string
+def read_rows(dataset_file, streamed_field='content'):
+    for fields, chunks in read_documents(dataset_file, streamed_field):
+        content = ''.join(chunks)
+        fields.setdefault(streamed_field, content)
+        yield fields
@@ -1,22 +1,42 @@
 #!/usr/bin/python3
 import re
-import nltk
 import sys
 import getopt
 import os
 import math
-import csv
-import unicodedata
-from nltk.stem import PorterStemmer
-from nltk.tokenize import sent_tokenize, word_tokenize
 from collections import defaultdict
+import text_analysis
+from text_analysis import analyze, analyze_chunks, stem_cache_stats, set_tokenizer, DEFAULT_TOKENIZER
+from dataset import read_documents, read_rows
+from postings import (write_header, write_postings, write_forward_index, side_file, FORWARD_EXTENSION,
+                      write_positions_index, POSITIONS_EXTENSION, POSITIONS_DICTIONARY_EXTENSION,
+                      write_impact_index, IMPACTS_EXTENSION, IMPACTS_DICTIONARY_EXTENSION, IMPACT_ZONES,
+                      write_tiered_index, TIERS_EXTENSION, TIERS_DICTIONARY_EXTENSION, TIER_FRACTION,
+                      load_dictionary, PostingsReader,
+                      load_manifest, write_manifest, segment_files, read_dictionary, read_doc_lengths,
+                      load_doc_lengths, load_tokenizer, is_binary, PostingsFile, is_compact_dictionary,
+                      write_compact_dictionary, write_doc_length_table, KEY_ZONES, key_order)
 import time
-import sys as csv_sys
-
-stemmer = PorterStemmer()
+import multiprocessing
+from functools import partial
+import heapq
+import shutil
+import tempfile
+import tracemalloc
+import fcntl
+import subprocess
+from contextlib import contextmanager
 
 def usage():
-    print("usage: " + sys.argv[0] + " -i dataset-file -d dictionary-file -p postings-file")
+    print("usage: " + sys.argv[0] + " -i dataset-file -d dictionary-file -p postings-file [-j jobs | -m memory-mb] [-b] [-c] [-f] [-P] [-I] [-T] [-t nltk|regex]")
+    print("       " + sys.argv[0] + " -a -i dataset-file -d dictionary-file -p postings-file [-j jobs]")
+    print("       " + sys.argv[0] + " -M | -C [-D] -d dictionary-file -p postings-file")
+
+# Verbose mode (-v)
+debug = False
+
+# Number of CSV rows handed to a worker process at a time in parallel (-j) mode
+SHARD_SIZE = 16
 
 # Dictionary to store term frequencies - separate dicts for each zone/field
 content_index = defaultdict(lambda: defaultdict(int))
@@ -24,126 +44,579 @@ title_index = defaultdict(lambda: defaultdict(int))
 court_index = defaultdict(lambda: defaultdict(int))
 date_index = defaultdict(lambda: defaultdict(int))
 
+# Term positions of the content and title zones, only recorded with -P
+content_positions = defaultdict(lambda: defaultdict(list))
+title_positions = defaultdict(lambda: defaultdict(list))
+
 # Store document lengths for each zone
 content_doc_lengths = {}
 title_doc_lengths = {}
 
-# Clean text to handle problematic Unicode characters
-def clean_text(text):
-    if not text:
-        return text
-    
-    # Normalize Unicode (NFD splits ligatures into component characters)
-    text = unicodedata.normalize('NFKD', text)    
-    return text
+# Count the terms of a field, and record their positions if `positions` is given
+def record_terms(terms, doc_id, field_index, positions=None):
+    if positions is None:
+        for term in terms:
+            field_index[term][doc_id] += 1
+        return
+    for position, term in enumerate(terms):
+        field_index[term][doc_id] += 1
+        positions[term][doc_id].append(position)
 
 # Process text for a specific field
-def process_text(text, doc_id, field_index):
-    if not text:  # Handle empty text
-        return
-    
-    # Clean text before processing
-    text = clean_text(text)
-        
-    sentences = sent_tokenize(text)
-    for sentence in sentences:
-        words = word_tokenize(sentence)
-        for word in words:
-            stemmed_word = stemmer.stem(word.lower())
-            field_index[stemmed_word][doc_id] += 1
-
-# Read and process CSV dataset
-def process_dataset(dataset_file):
+def process_text(text, doc_id, field_index, positions=None):
+    record_terms(analyze(text), doc_id, field_index, positions)
+
+# Process a field streamed in chunks, tokenizing it piece by piece
+def process_chunks(chunks, doc_id, field_index, positions=None):
+    record_terms(analyze_chunks(chunks), doc_id, field_index, positions)
+
+# Tokenizer to record in the postings header, None for the default one
+def index_tokenizer():
+    return None if text_analysis.tokenizer == DEFAULT_TOKENIZER else text_analysis.tokenizer
+
+# Compute the log-tf vector length of every document in a single sweep over the postings,
+# O(total postings) instead of O(documents x vocabulary). Each document's squares are
+# summed in sorted term order, so a document gets bit-for-bit the same length whatever
+# else is indexed with it: in a full build, a -j build or a delta segment (-a).
+def compute_doc_lengths(field_index, doc_ids):
+    sum_squares = dict.fromkeys(doc_ids, 0)
+    for term in sorted(field_index):
+        for doc_id, tf in field_index[term].items():
+            sum_squares[doc_id] += (1 + math.log10(tf))**2
+    return {doc_id: math.sqrt(sum_squares[doc_id]) for doc_id in doc_ids}
+
+# Index a single CSV row into the given zone indexes
+def index_row(row, content, title, court, date, positions=None):
+    return index_document(row, (row['content'],), content, title, court, date, positions)
+
+# Index a document whose content streams in as chunks (see dataset.read_documents).
+# The content goes first: the fields after it are only complete once it has been read.
+# `positions` is None, or the (content, title) position indexes to record into.
+def index_document(fields, content_chunks, content, title, court, date, positions=None):
+    doc_id = int(fields['document_id'])
+    content_positions, title_positions = positions or (None, None)
+
+    # Process each field separately for zone indexing
+    process_chunks(content_chunks, doc_id, content, content_positions)
+    process_text(fields['title'], doc_id, title, title_positions)
+    process_text(fields['court'], doc_id, court)
+
+    # Store date as is (for range queries)
+    if 'date_posted' in fields and fields['date_posted']:
+        date_posted = fields['date_posted'].split()[0]  # Extract just the date part
+        date[date_posted][doc_id] = 1
+
+    return doc_id
+
+# Index one shard of rows in a worker process (-j mode), with positions if `positional`.
+# Returns plain dicts, since the defaultdict factories cannot be pickled.
+def index_shard(rows, positional=False):
+    shard_indexes = [defaultdict(lambda: defaultdict(int)) for _ in range(4)]
+    shard_positions = [defaultdict(lambda: defaultdict(list)) for _ in range(2)] if positional else None
+    doc_ids = [index_row(row, *shard_indexes, shard_positions) for row in rows]
+    return doc_ids, [{term: dict(postings) for term, postings in field_index.items()}
+                     for field_index in shard_indexes + (shard_positions or [])]
+
+# Merge a shard's partial index into a global one. Shards are merged in dataset order,
+# so terms and postings end up in the same insertion order as in a serial run.
+def merge_shard_index(field_index, shard_index):
+    for term, postings in shard_index.items():
+        merged_postings = field_index[term]
+        for doc_id, tf in postings.items():
+            merged_postings[doc_id] += tf
+
+# Split the dataset rows into contiguous shards of at most `shard_size` rows
+def shard_rows(reader, shard_size):
+    shard = []
+    for row in reader:
+        shard.append(row)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+# Stream the documents of the dataset to `index_document(fields, content_chunks)`.
+# In verbose mode (-v) the peak memory allocated while indexing each document is reported.
+def index_documents(dataset_file, index_document):
+    doc_ids = []
+    if debug:
+        # Load NLTK first, so its one-time cost is not charged to the first document
+        text_analysis.warm_up()
+        tracemalloc.start()
+        largest = (0, None)
+    for fields, content_chunks in read_documents(dataset_file):
+        if debug:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        doc_id = index_document(fields, content_chunks)
+        doc_ids.append(doc_id)
+        if debug:
+            peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+            largest = max(largest, (peak_memory, doc_id))
+            print(f"Document {doc_id}: peak memory {peak_memory / 1024:.0f} KB")
+    if debug:
+        tracemalloc.stop()
+        print(f"Largest peak memory: {largest[0] / 1024:.0f} KB (document {largest[1]})")
+    return doc_ids
+
+# Read and process CSV dataset, recording term positions too if `positional`
+def process_dataset(dataset_file, jobs=1, positional=False):
     print(f"Processing dataset: {dataset_file}")
     
-    # Increase CSV field size limit to handle large content fields
-    csv_sys.maxsize = 2147483647  # Set to maximum allowed integer
-    csv.field_size_limit(min(csv_sys.maxsize, 2147483647))
-    
     doc_ids = []
+    positions = (content_positions, title_positions) if positional else None
     
-    with open(dataset_file, 'r', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            doc_id = int(row['document_id'])
-            doc_ids.append(doc_id)
-            
-            # Process each field separately for zone indexing
-            process_text(row['content'], doc_id, content_index)
-            process_text(row['title'], doc_id, title_index)
-            process_text(row['court'], doc_id, court_index)
-            
-            # Store date as is (for range queries)
-            if 'date_posted' in row and row['date_posted']:
-                date = row['date_posted'].split()[0]  # Extract just the date part
-                date_index[date][doc_id] = 1
+    if jobs > 1:
+        # Rows are sent to the workers whole, so only the serial build streams the content
+        rows = read_rows(dataset_file)
+        with multiprocessing.Pool(jobs, initializer=set_tokenizer, initargs=(text_analysis.tokenizer,)) as pool:
+            for shard_doc_ids, shard_indexes in pool.imap(partial(index_shard, positional=positional),
+                                                          shard_rows(rows, SHARD_SIZE)):
+                doc_ids.extend(shard_doc_ids)
+                for field_index, shard_index in zip((content_index, title_index, court_index),
+                                                    shard_indexes):
+                    merge_shard_index(field_index, shard_index)
+                for date, postings in shard_indexes[3].items():
+                    date_index[date].update(postings)
+                # Shards hold disjoint documents, so their position lists are taken as they are
+                for field_positions, shard_positions in zip(positions or (), shard_indexes[4:]):
+                    for term, doc_positions in shard_positions.items():
+                        field_positions[term].update(doc_positions)
+    else:
+        doc_ids = index_documents(dataset_file, lambda fields, content_chunks: index_document(
+            fields, content_chunks, content_index, title_index, court_index, date_index, positions))
     
     # Compute document lengths for content (used for cosine similarity in VSM)
-    for doc_id in doc_ids:
-        content_doc_lengths[doc_id] = math.sqrt(sum(
-            (1 + math.log10(tf))**2 
-            for word in content_index 
-            for tf in [content_index[word].get(doc_id, 0)] 
-            if tf > 0
-        ))
-        
-        # Also compute document lengths for title
-        title_doc_lengths[doc_id] = math.sqrt(sum(
-            (1 + math.log10(tf))**2 
-            for word in title_index 
-            for tf in [title_index[word].get(doc_id, 0)] 
-            if tf > 0
-        ))
+    content_doc_lengths.update(compute_doc_lengths(content_index, doc_ids))
+
+    # Also compute document lengths for title
+    title_doc_lengths.update(compute_doc_lengths(title_index, doc_ids))
     
     return doc_ids
 
 # Write the inverted index to files
-def write_index(dict_file, postings_file):
+def write_index(dict_file, postings_file, binary=False):
     """ Writes dictionary, postings files, and document lengths with zone information """
-    postings_meta = {}
-    
     # Specify UTF-8 encoding for output files
-    with open(dict_file, 'w', encoding='utf-8') as d_file, open(postings_file, 'w', encoding='utf-8') as p_file:
+    with open(dict_file, 'w', encoding='utf-8') as d_file, open(postings_file, 'wb') as p_file:
         # Store doc lengths
-        for doc_id, length in content_doc_lengths.items():
-            p_file.write(f"LC {doc_id} {length}\n")
-        
-        for doc_id, length in title_doc_lengths.items():
-            p_file.write(f"LT {doc_id} {length}\n")
+        write_header(p_file, content_doc_lengths, title_doc_lengths, binary, index_tokenizer())
         
         # Write content index with zone marker "C:"
         sorted_content_terms = sorted(content_index.keys())
         for term in sorted_content_terms:
-            postings_meta[f"C:{term}"] = p_file.tell()
             postings = [(doc_id, content_index[term][doc_id]) for doc_id in sorted(content_index[term].keys())]
-            p_file.write(' '.join(f"{doc_id}:{tf}" for doc_id, tf in postings) + "\n")
-            d_file.write(f"C:{term} {postings_meta[f'C:{term}']} {len(postings)}\n")
+            write_postings(d_file, p_file, f"C:{term}", postings, binary, content_doc_lengths)
         
         # Write title index with zone marker "T:"
         sorted_title_terms = sorted(title_index.keys())
         for term in sorted_title_terms:
-            postings_meta[f"T:{term}"] = p_file.tell()
             postings = [(doc_id, title_index[term][doc_id]) for doc_id in sorted(title_index[term].keys())]
-            p_file.write(' '.join(f"{doc_id}:{tf}" for doc_id, tf in postings) + "\n")
-            d_file.write(f"T:{term} {postings_meta[f'T:{term}']} {len(postings)}\n")
+            write_postings(d_file, p_file, f"T:{term}", postings, binary, title_doc_lengths)
         
         # Write court index with zone marker "COURT:"
         sorted_court_terms = sorted(court_index.keys())
         for term in sorted_court_terms:
-            postings_meta[f"COURT:{term}"] = p_file.tell()
             postings = [(doc_id, 1) for doc_id in sorted(court_index[term].keys())]
-            p_file.write(' '.join(f"{doc_id}:1" for doc_id, _ in postings) + "\n")
-            d_file.write(f"COURT:{term} {postings_meta[f'COURT:{term}']} {len(postings)}\n")
+            write_postings(d_file, p_file, f"COURT:{term}", postings, binary)
         
         # Write date index with zone marker "DATE:"
         sorted_dates = sorted(date_index.keys())
         for date in sorted_dates:
-            postings_meta[f"DATE:{date}"] = p_file.tell()
             postings = [(doc_id, 1) for doc_id in sorted(date_index[date].keys())]
-            p_file.write(' '.join(f"{doc_id}:1" for doc_id, _ in postings) + "\n")
-            d_file.write(f"DATE:{date} {postings_meta[f'DATE:{date}']} {len(postings)}\n")
+            write_postings(d_file, p_file, f"DATE:{date}", postings, binary)
+
+# Write the forward index (-f) of the content zone, or remove a stale one of an earlier
+# index so the search scripts never pair it with this one
+def write_forward(forward_file, forward):
+    if not forward:
+        if os.path.exists(forward_file):
+            os.remove(forward_file)
+        return
+    doc_vectors = defaultdict(list)
+    for term_id, term in enumerate(sorted(content_index.keys())):
+        for doc_id, tf in content_index[term].items():
+            doc_vectors[doc_id].append((term_id, tf))
+    write_forward_index(forward_file, doc_vectors)
+
+# Write the forward index of the content zone from the C: postings of the written index,
+# which -C compaction has to do without the in-memory content index
+def write_forward_from_index(dict_file, postings_file):
+    dictionary = load_dictionary(dict_file, postings_file)
+    content_terms = sorted(key.split(':', 1)[1] for key in dictionary if key.startswith('C:'))
+    doc_vectors = defaultdict(list)
+    with PostingsReader(postings_file) as reader:
+        for term_id, term in enumerate(content_terms):
+            for doc_id, tf in reader.postings(dictionary[f"C:{term}"]):
+                doc_vectors[doc_id].append((term_id, tf))
+    write_forward_index(side_file(postings_file, FORWARD_EXTENSION), doc_vectors)
+
+# Write the positional index (-P) of the content and title zones, or remove a stale one of
+# an earlier index
+def write_positions(postings_file, positional):
+    if not positional:
+        remove_side_files(postings_file, (POSITIONS_EXTENSION, POSITIONS_DICTIONARY_EXTENSION))
+        return
+    def key_positions():
+        for zone, field_positions in (('C', content_positions), ('T', title_positions)):
+            for term in sorted(field_positions.keys()):
+                doc_positions = field_positions[term]
+                yield f"{zone}:{term}", [doc_positions[doc_id] for doc_id in sorted(doc_positions.keys())]
+    write_positions_index(postings_file, key_positions())
+
+# (key, postings, weights) of every C:/T: key of the written index, with the length-
+# normalized weight (1 + log10(tf)) / zone_length of each posting
+def key_weights(dictionary, doc_lengths, reader):
+    doc_indices = doc_lengths.doc_indices
+    zone_lengths = {'C': doc_lengths.lengths['content'], 'T': doc_lengths.lengths['title']}
+    for key in dictionary:
+        if key.split(':', 1)[0] in zone_lengths:
+            lengths = zone_lengths[key[0]]
+            postings = reader.postings(dictionary[key])
+            yield key, postings, [(1 + math.log10(tf)) / lengths[doc_indices[doc_id]] for doc_id, tf in postings]
+
+# Remove the side files with `extensions` of an earlier index
+def remove_side_files(postings_file, extensions):
+    for extension in extensions:
+        if os.path.exists(side_file(postings_file, extension)):
+            os.remove(side_file(postings_file, extension))
+
+# Write the impact index (-I) of the content and title zones from the written index, or
+# remove a stale one of an earlier index
+def write_impacts(dict_file, postings_file, impacts):
+    if not impacts:
+        remove_side_files(postings_file, (IMPACTS_EXTENSION, IMPACTS_DICTIONARY_EXTENSION))
+        return
+    dictionary = load_dictionary(dict_file, postings_file)
+    doc_lengths = load_doc_lengths(postings_file)
+    with PostingsReader(postings_file) as reader:
+        # The weights are read twice, first for their range in each zone
+        weight_ranges = {zone: (math.inf, 0.0) for zone in IMPACT_ZONES}
+        for key, _postings, weights in key_weights(dictionary, doc_lengths, reader):
+            lowest, highest = weight_ranges[key[0]]
+            weight_ranges[key[0]] = (min(lowest, min(weights)), max(highest, max(weights)))
+        weight_ranges = {zone: (1.0, 1.0) if lowest == math.inf else (lowest, highest)
+                         for zone, (lowest, highest) in weight_ranges.items()}
+        write_impact_index(postings_file, key_weights(dictionary, doc_lengths, reader), weight_ranges)
+    doc_lengths.close()
+
+# Write the tiered index (-T) of the content and title zones from the written index, or
+# remove a stale one of an earlier index
+def write_tiers(dict_file, postings_file, tiers, fraction=TIER_FRACTION):
+    if not tiers:
+        remove_side_files(postings_file, (TIERS_EXTENSION, TIERS_DICTIONARY_EXTENSION))
+        return
+    dictionary = load_dictionary(dict_file, postings_file)
+    doc_lengths = load_doc_lengths(postings_file)
+    with PostingsReader(postings_file) as reader:
+        write_tiered_index(postings_file, key_weights(dictionary, doc_lengths, reader), fraction)
+    doc_lengths.close()
+
+# SPIMI indexing (-m) ####################################################################
+# Single-pass in-memory indexing: postings are collected in a block until the memory
+# budget is used up, then the block is written to disk as a run sorted by (zone, term).
+# At the end all runs are k-way merged into the usual dictionary and postings files.
+
+# Rough in-memory cost of one (term, doc_id) entry in the nested dicts, in bytes
+SPIMI_BYTES_PER_POSTING = 120
+
+# Zones in the order they appear in the postings file
+ZONES = KEY_ZONES
+
+# Write one block of zone indexes to a run file, sorted by (zone, term)
+def write_run(run_file, block):
+    with open(run_file, 'w', encoding='utf-8') as r_file:
+        for zone, field_index in zip(ZONES, block):
+            for term in sorted(field_index.keys()):
+                postings = field_index[term]
+                r_file.write(f"{zone}:{term} " + ' '.join(f"{doc_id}:{tf}" for doc_id, tf in postings.items()) + "\n")
+
+# Iterate over a run file as ((zone rank, term), zone, postings) in sorted order
+def read_run(run_file):
+    with open(run_file, 'r', encoding='utf-8') as r_file:
+        for line in r_file:
+            key, postings = line.rstrip('\n').split(' ', 1)
+            zone, term = key.split(':', 1)
+            yield (ZONES.index(zone), term), zone, postings
+
+# k-way merge the sorted runs into the final dictionary and postings files
+def merge_runs(run_files, dict_file, postings_file, doc_lengths, binary):
+    term_counts = dict.fromkeys(ZONES, 0)
+    runs = [read_run(run_file) for run_file in run_files]
+
+    with open(dict_file, 'w', encoding='utf-8') as d_file, open(postings_file, 'wb') as p_file:
+        # Store doc lengths
+        write_header(p_file, doc_lengths['LC'], doc_lengths['LT'], binary, index_tokenizer())
 
-def build_index(dataset_file, out_dict, out_postings):
+        current_key = current_zone = None
+        merged_postings = defaultdict(int)
+        for key, zone, postings in heapq.merge(*runs, key=lambda run_entry: run_entry[0]):
+            if key != current_key:
+                if current_key is not None:
+                    write_merged_postings(d_file, p_file, current_zone, current_key[1], merged_postings,
+                                          binary, doc_lengths)
+                    term_counts[current_zone] += 1
+                current_key, current_zone = key, zone
+                merged_postings = defaultdict(int)
+            for posting in postings.split():
+                doc_id, tf = posting.split(':')
+                merged_postings[int(doc_id)] += int(tf)
+        if current_key is not None:
+            write_merged_postings(d_file, p_file, current_zone, current_key[1], merged_postings,
+                                  binary, doc_lengths)
+            term_counts[current_zone] += 1
+
+    return term_counts
+
+def write_merged_postings(d_file, p_file, zone, term, merged_postings, binary, doc_lengths):
+    doc_ids = sorted(merged_postings.keys())
+    if zone in ('C', 'T'):
+        postings = [(doc_id, merged_postings[doc_id]) for doc_id in doc_ids]
+        zone_lengths = doc_lengths['LC' if zone == 'C' else 'LT']
+    else:
+        postings = [(doc_id, 1) for doc_id in doc_ids]
+        zone_lengths = None
+    write_postings(d_file, p_file, f"{zone}:{term}", postings, binary, zone_lengths)
+
+def spimi_index(dataset_file, dict_file, postings_file, memory_budget, binary=False):
+    """
+    Build the index block by block within `memory_budget` bytes of postings,
+    then merge the blocks into the dictionary file and postings file
+    """
+    print(f"Processing dataset: {dataset_file} (SPIMI, {memory_budget // 2**20} MB blocks)")
+
+    doc_lengths = {'LC': {}, 'LT': {}}
+    run_dir = tempfile.mkdtemp(prefix='spimi-', dir=os.path.dirname(os.path.abspath(postings_file)))
+    run_files = []
+
+    def new_block():
+        return [defaultdict(lambda: defaultdict(int)) for _ in ZONES]
+
+    block = new_block()
+    block_postings = 0
+
+    def spimi_document(fields, content_chunks):
+        nonlocal block, block_postings
+        # Index the document on its own first, so that its vector lengths can be
+        # computed without looking at the rest of the collection
+        doc_indexes = new_block()
+        doc_id = index_document(fields, content_chunks, *doc_indexes)
+        for field, field_index in (('LC', doc_indexes[0]), ('LT', doc_indexes[1])):
+            doc_lengths[field][doc_id] = compute_doc_lengths(field_index, [doc_id])[doc_id]
+
+        for field_index, doc_index in zip(block, doc_indexes):
+            merge_shard_index(field_index, doc_index)
+            block_postings += len(doc_index)
+
+        if block_postings * SPIMI_BYTES_PER_POSTING >= memory_budget:
+            run_files.append(os.path.join(run_dir, f"run{len(run_files)}.txt"))
+            write_run(run_files[-1], block)
+            block = new_block()
+            block_postings = 0
+        return doc_id
+
+    try:
+        doc_ids = index_documents(dataset_file, spimi_document)
+
+        if block_postings:
+            run_files.append(os.path.join(run_dir, f"run{len(run_files)}.txt"))
+            write_run(run_files[-1], block)
+        del block
+
+        print(f"Merging {len(run_files)} runs")
+        term_counts = merge_runs(run_files, dict_file, postings_file, doc_lengths, binary)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    return doc_ids, term_counts
+
+# Incremental segments (-a, -M, -C) ######################################################
+# -a indexes a dataset of new documents into a delta segment of an existing index (see
+# postings.py) instead of rebuilding it. Segments are merged by a size-tiered policy: a
+# segment of n documents is on level floor(log_MERGE_FANOUT(n)), and once MERGE_FANOUT
+# consecutive segments are on the same level they are merged into one on a higher level,
+# so every document is rewritten O(log n) times. After an append, the merges run in a
+# detached background process (-M). -C merges the base index and every segment into a new
+# base index; it replaces files that searchers may have open, so run it offline.
+
+MERGE_FANOUT = 4
+
+# Whether the open lock file is still the one at `lock_path`, not removed by its last holder
+def is_current_lock(lock_file, lock_path):
+    try:
+        return os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path))
+    except FileNotFoundError:
+        return False
+
+# Hold an exclusive lock named `name` on the index. With `blocking` False, yields whether
+# the lock was acquired instead of waiting for it. The lock file is removed when the lock
+# is released, so a process that was waiting on the removed file locks a new one instead.
+@contextmanager
+def index_lock(postings_file, name, blocking=True):
+    lock_path = side_file(postings_file, f".{name}.lock")
+    while True:
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                if not is_current_lock(lock_file, lock_path):
+                    continue
+                try:
+                    yield True
+                finally:
+                    os.remove(lock_path)
+                return
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def append_segment(dataset_file, dict_file, postings_file, jobs=1):
+    """
+    Index the documents of the dataset file into a new segment of the index,
+    with the tokenizer and postings format of the base index
+    """
+    set_tokenizer(load_tokenizer(postings_file))
+    # Reject documents already in the index before indexing any: only the fields of the
+    # dataset are read, its content is skipped
+    indexed_docs = load_doc_lengths(postings_file).doc_indices
+    duplicates = {int(fields['document_id']) for fields, _content_chunks in read_documents(dataset_file)
+                  if int(fields['document_id']) in indexed_docs}
+    if duplicates:
+        raise ValueError(f"{len(duplicates)} documents are already indexed, e.g. {min(duplicates)}")
+    doc_ids = process_dataset(dataset_file, jobs)
+
+    with index_lock(postings_file, 'manifest'):
+        manifest = load_manifest(postings_file)
+        number = manifest.next_number
+        write_index(*segment_files(postings_file, number), is_binary(postings_file))
+        manifest.segments.append((number, len(doc_ids)))
+        write_manifest(postings_file, manifest._replace(next_number=number + 1))
+    print(f"Added segment {number}")
+    return doc_ids
+
+# Start merging the segments of the index in a detached process
+def merge_in_background(dict_file, postings_file):
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), '-M', '-d', dict_file, '-p', postings_file],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+def segment_level(num_docs):
+    level = 0
+    while num_docs >= MERGE_FANOUT:
+        num_docs //= MERGE_FANOUT
+        level += 1
+    return level
+
+# The first MERGE_FANOUT consecutive (number, num_docs) segments on the same level, or None
+def plan_merge(segments):
+    levels = [segment_level(num_docs) for _number, num_docs in segments]
+    for start in range(len(segments) - MERGE_FANOUT + 1):
+        if len(set(levels[start:start + MERGE_FANOUT])) == 1:
+            return segments[start:start + MERGE_FANOUT]
+    return None
+
+# Merge indexes of disjoint sets of documents, given as (dictionary, postings) file pairs
+def merge_index_files(inputs, dict_file, postings_file, binary, tokenizer):
+    dictionaries = [read_dictionary(input_dict) for input_dict, _input_postings in inputs]
+    doc_lengths = {'LC': {}, 'LT': {}}
+    for _input_dict, input_postings in inputs:
+        for (doc_id, zone), length in read_doc_lengths(input_postings, {}).items():
+            doc_lengths['LC' if zone == 'content' else 'LT'][doc_id] = length
+    zone_lengths = {'C': doc_lengths['LC'], 'T': doc_lengths['LT']}
+
+    readers = [PostingsFile(input_postings) for _input_dict, input_postings in inputs]
+    try:
+        with open(dict_file, 'w', encoding='utf-8') as d_file, open(postings_file, 'wb') as p_file:
+            write_header(p_file, doc_lengths['LC'], doc_lengths['LT'], binary, tokenizer)
+            for key in sorted(set().union(*dictionaries), key=key_order):
+                postings = list(heapq.merge(*(reader.postings(dictionary[key])
+                                              for reader, dictionary in zip(readers, dictionaries)
+                                              if key in dictionary)))
+                write_postings(d_file, p_file, key, postings, binary, zone_lengths.get(key.split(':', 1)[0]))
+    finally:
+        for reader in readers:
+            reader.close()
+
+# Delete the files of the segments that earlier merges made obsolete
+def delete_obsolete_segments(postings_file):
+    with index_lock(postings_file, 'manifest'):
+        manifest = load_manifest(postings_file)
+        for number in manifest.obsolete:
+            for segment_file in segment_files(postings_file, number):
+                if os.path.exists(segment_file):
+                    os.remove(segment_file)
+        write_manifest(postings_file, manifest._replace(obsolete=[]))
+
+def merge_segments(dict_file, postings_file, compact=False):
+    """
+    Merge segments of the index until the merge policy is satisfied, or with `compact`
+    merge the base index and all segments into a new base index. Compaction rebuilds the
+    forward, impact and tiered indexes the base index had from the merged postings, and
+    drops its positional index, which needs the dataset
+    """
+    with index_lock(postings_file, 'merge', blocking=False) as acquired:
+        if not acquired:
+            print("Another merge is running")  # it picks up the new segments as well
+            return
+        # The previous merge's searchers have had time to reload the manifest
+        delete_obsolete_segments(postings_file)
+        binary = is_binary(postings_file)
+        tokenizer = load_tokenizer(postings_file)
+        # Side files of the base index that compaction rebuilds
+        forward, impacts, tiers = (os.path.exists(side_file(postings_file, extension))
+                                   for extension in (FORWARD_EXTENSION, IMPACTS_EXTENSION, TIERS_EXTENSION))
+
+        while True:
+            manifest = load_manifest(postings_file)
+            group = manifest.segments if compact else plan_merge(manifest.segments)
+            if not group:
+                break
+            with index_lock(postings_file, 'manifest'):
+                manifest = load_manifest(postings_file)
+                number = manifest.next_number
+                write_manifest(postings_file, manifest._replace(next_number=number + 1))
+
+            # Segments are only ever appended to the manifest while this runs, so `group`
+            # is still in it, in the same place
+            inputs = [segment_files(postings_file, segment) for segment, _num_docs in group]
+            if compact:
+                inputs.insert(0, (dict_file, postings_file))
+            print(f"Merging {len(inputs)} {'indexes' if compact else 'segments'} into segment {number}")
+            merge_index_files(inputs, *segment_files(postings_file, number), binary, tokenizer)
+
+            with index_lock(postings_file, 'manifest'):
+                manifest = load_manifest(postings_file)
+                position = manifest.segments.index(group[0])
+                segments = [segment for segment in manifest.segments if segment not in group]
+                if compact:
+                    merged_dict, merged_postings = segment_files(postings_file, number)
+                    if is_compact_dictionary(dict_file):
+                        write_compact_dictionary(merged_dict, read_dictionary(merged_dict))
+                    os.replace(merged_dict, dict_file)
+                    os.replace(merged_postings, postings_file)
+                    write_doc_length_table(postings_file, read_doc_lengths(postings_file, {}))
+                    write_forward(side_file(postings_file, FORWARD_EXTENSION), False)
+                    write_positions(postings_file, False)
+                    write_impacts(dict_file, postings_file, False)
+                    write_tiers(dict_file, postings_file, False)
+                else:
+                    segments.insert(position, (number, sum(num_docs for _segment, num_docs in group)))
+                obsolete = manifest.obsolete + [segment for segment, _num_docs in group]
+                write_manifest(postings_file, manifest._replace(segments=segments, obsolete=obsolete))
+            if compact:
+                delete_obsolete_segments(postings_file)
+                if forward:
+                    write_forward_from_index(dict_file, postings_file)
+                write_impacts(dict_file, postings_file, impacts)
+                write_tiers(dict_file, postings_file, tiers)
+                break
+
+def build_index(dataset_file, out_dict, out_postings, jobs=1, memory_budget=None, binary=False, forward=False,
+                append=False, compact_dictionary=False, positional=False, impacts=False,
+                tiers=False):
     """
     Build index from the dataset file,
     then output the dictionary file and postings file
@@ -151,42 +624,139 @@ def build_index(dataset_file, out_dict, out_postings):
     print('indexing...')
     start_time = time.time()
     
-    doc_ids = process_dataset(dataset_file)
-    write_index(out_dict, out_postings)
+    if append:
+        doc_ids = append_segment(dataset_file, out_dict, out_postings, jobs)
+        term_counts = dict(zip(ZONES, map(len, (content_index, title_index, court_index, date_index))))
+    elif memory_budget:
+        doc_ids, term_counts = spimi_index(dataset_file, out_dict, out_postings, memory_budget, binary)
+    else:
+        doc_ids = process_dataset(dataset_file, jobs, positional)
+        write_index(out_dict, out_postings, binary)
+        term_counts = dict(zip(ZONES, map(len, (content_index, title_index, court_index, date_index))))
+    if not append:
+        write_forward(side_file(out_postings, FORWARD_EXTENSION), forward)
+        write_positions(out_postings, positional)
+        write_doc_length_table(out_postings, read_doc_lengths(out_postings, {}))
+    if compact_dictionary:
+        write_compact_dictionary(out_dict, read_dictionary(out_dict))
+    if not append:
+        write_impacts(out_dict, out_postings, impacts)
+        write_tiers(out_dict, out_postings, tiers)
     
     print("Total documents indexed:", len(doc_ids))
-    print("Total unique terms (content):", len(content_index))
-    print("Total unique terms (title):", len(title_index))
-    print("Total unique courts:", len(court_index))
-    print("Total unique dates:", len(date_index))
+    print("Total unique terms (content):", term_counts['C'])
+    print("Total unique terms (title):", term_counts['T'])
+    print("Total unique courts:", term_counts['COURT'])
+    print("Total unique dates:", term_counts['DATE'])
+    if jobs == 1:  # with -j the stemming happens in the worker processes
+        print(stem_cache_stats())
     print("Done")
     
     end_time = time.time()
     print(f"Indexing completed in {end_time - start_time:.2f} seconds")
 
-dataset_file = output_file_dictionary = output_file_postings = None
-debug = False
+    if append:
+        merge_in_background(out_dict, out_postings)
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:v')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i': # dataset file
-        dataset_file = a
-    elif o == '-d': # dictionary file
-        output_file_dictionary = a
-    elif o == '-p': # postings file
-        output_file_postings = a
-    elif o == '-v': # verbose mode
-        debug = True
-    else:
-        assert False, "unhandled option"
+if __name__ == '__main__':
+    dataset_file = output_file_dictionary = output_file_postings = None
+    debug = False
+    jobs = 1
+    memory_budget = None
+    binary = False
+    forward = False
+    tokenizer = DEFAULT_TOKENIZER
+    append = merge = compact = False
+    drop_positions = False
+    compact_dictionary = False
+    positional = False
+    impacts = False
+    tiers = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:j:m:bcfPITt:vaMCD')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i': # dataset file
+            dataset_file = a
+        elif o == '-d': # dictionary file
+            output_file_dictionary = a
+        elif o == '-p': # postings file
+            output_file_postings = a
+        elif o == '-j': # number of worker processes
+            jobs = int(a)
+        elif o == '-m': # SPIMI memory budget in MB
+            memory_budget = int(a) * 2**20
+        elif o == '-b': # binary (variable-byte) postings
+            binary = True
+        elif o == '-c': # compact binary dictionary
+            compact_dictionary = True
+        elif o == '-f': # forward index for search_prf.py
+            forward = True
+        elif o == '-P': # positional index for phrase queries
+            positional = True
+        elif o == '-I': # impact-ordered index of precomputed weights
+            impacts = True
+        elif o == '-T': # tiered index for top-K queries
+            tiers = True
+        elif o == '-t': # tokenizer: nltk (default) or regex
+            tokenizer = a
+        elif o == '-v': # verbose mode
+            debug = True
+        elif o == '-a': # append the dataset to the index as a new segment
+            append = True
+        elif o == '-M': # merge segments by the merge policy
+            merge = True
+        elif o == '-C': # merge all segments into the base index
+            compact = True
+        elif o == '-D': # let -C drop the positional index
+            drop_positions = True
+        else:
+            assert False, "unhandled option"
+
+    if output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+
+    if compact and not drop_positions and os.path.exists(side_file(output_file_postings, POSITIONS_EXTENSION)):
+        print("-C cannot rebuild the positional index (-P) without the dataset: rebuild the index with -P,"
+              " or pass -D to compact and drop it")
+        sys.exit(2)
+    if compact and os.path.exists(side_file(output_file_postings, POSITIONS_EXTENSION)):
+        print("Dropping the positional index (-P), which -C cannot rebuild")
+
+    if merge or compact:
+        merge_segments(output_file_dictionary, output_file_postings, compact)
+        sys.exit(0)
+
+    if dataset_file == None:
+        usage()
+        sys.exit(2)
+
+    if append and (memory_budget or binary or compact_dictionary or forward or positional or impacts
+                   or tiers or tokenizer != DEFAULT_TOKENIZER):
+        print("-a takes the format and tokenizer of the existing index and cannot be combined with -m, -b, -c, -f, -P, -I, -T or -t")
+        usage()
+        sys.exit(2)
+
+    if jobs > 1 and memory_budget:
+        print("-j and -m cannot be combined")
+        usage()
+        sys.exit(2)
+
+    if tokenizer not in text_analysis.TOKENIZERS:
+        print(f"unknown tokenizer '{tokenizer}'")
+        usage()
+        sys.exit(2)
+    set_tokenizer(tokenizer)
 
-if dataset_file == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
+    if (forward or positional) and memory_budget:
+        print("-f and -P cannot be combined with -m")
+        usage()
+        sys.exit(2)
 
-build_index(dataset_file, output_file_dictionary, output_file_postings)
\ No newline at end of file
+    build_index(dataset_file, output_file_dictionary, output_file_postings, jobs, memory_budget, binary, forward,
+                append, compact_dictionary, positional, impacts, tiers)
\ No newline at end of file
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+import math
+from itertools import chain
+import numpy as np
+
+# Vectorized tf-idf scoring with NumPy (search_tfidf_weight.py -n).
+#
+# Postings are turned into arrays of dense document indices and term frequencies, the
+# log-tf weights of a whole postings list are computed at once and scatter-added into dense
+# per-zone score accumulators, and normalization divides by precomputed length arrays.
+#
+# Rankings are identical to the dict-based scoring: every document receives the same
+# floating point operations in the same order, log-tf weights come from a table filled
+# with math.log10, and ties are broken by the order in which documents were first scored.
+
+class NumpyScorer:
+
+    def __init__(self, doc_lengths):
+        # The DocLengthTable arrays are already dense and in doc ID order, so they are used
+        # in place (mapped from the length table file when there is one)
+        self.doc_ids = np.frombuffer(doc_lengths.doc_ids, dtype=np.int64)
+        self.lengths = {zone: np.frombuffer(doc_lengths.lengths[zone], dtype=np.float64)
+                        for zone in ('content', 'title')}
+        self.log_tf = np.zeros(1)
+
+    # 1 + log10(tf) for every tf in `tfs`, looked up in a table computed with math.log10
+    def log_tf_weights(self, tfs):
+        max_tf = int(tfs.max())
+        if max_tf >= len(self.log_tf):
+            self.log_tf = np.array([0.0] + [1 + math.log10(tf) for tf in range(1, 2 * max_tf + 1)])
+        return self.log_tf[tfs]
+
+    def rank(self, zone_postings, title_weight, boosts=None):
+        """
+        Rank documents given (zone, query_weight, postings, max_weight) for every query term
+        and zone, in the order the terms were scored, with scores multiplied by the
+        doc_id -> multiplier `boosts`
+        """
+        num_docs = len(self.doc_ids)
+        scores = {zone: np.zeros(num_docs) for zone in ('content', 'title')}
+        # Order in which each document was first scored in each zone, -1 if never
+        first_scored = {zone: np.full(num_docs, -1, dtype=np.int64) for zone in ('content', 'title')}
+        num_scored = dict.fromkeys(('content', 'title'), 0)
+
+        for zone, query_weight, postings, _max_weight in zone_postings:
+            if not postings:
+                continue
+            postings = np.fromiter(chain.from_iterable(postings), dtype=np.int64,
+                                   count=2 * len(postings)).reshape(-1, 2)
+            doc_indices = np.searchsorted(self.doc_ids, postings[:, 0])
+            # Postings hold each document at most once, so this scatter-add never collides
+            scores[zone][doc_indices] += query_weight * self.log_tf_weights(postings[:, 1])
+
+            new_indices = doc_indices[first_scored[zone][doc_indices] < 0]
+            first_scored[zone][new_indices] = num_scored[zone] + np.arange(len(new_indices))
+            num_scored[zone] += len(new_indices)
+
+        # Normalize scores using document length, title zone first as in the dict-based path
+        total_scores = np.zeros(num_docs)
+        in_title = first_scored['title'] >= 0
+        in_content = first_scored['content'] >= 0
+        total_scores[in_title] = scores['title'][in_title] / self.lengths['title'][in_title] * title_weight
+        total_scores[in_content] += scores['content'][in_content] / self.lengths['content'][in_content]
+        if boosts:
+            boosted = np.searchsorted(self.doc_ids, np.fromiter(boosts.keys(), dtype=np.int64, count=len(boosts)))
+            total_scores[boosted] *= np.fromiter(boosts.values(), dtype=np.float64, count=len(boosts))
+
+        # Documents scored in the title zone come first in a tie, then content-only ones
+        tie_order = np.where(in_title, first_scored['title'], num_docs + first_scored['content'])
+        matched = np.flatnonzero(in_title | in_content)
+        order = np.lexsort((tie_order[matched], -total_scores[matched]))
+        return self.doc_ids[matched[order]].tolist()
@@ -0,0 +1,1180 @@
+#!/usr/bin/python3
+import os
+import math
+import mmap
+import heapq
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict, defaultdict
+from collections.abc import Mapping
+from itertools import accumulate
+from functools import cached_property
+
+# Shared reading and writing of the index files, used by index.py and all search scripts.
+#
+# The postings file comes in two formats:
+#   text:   LC/LT document length lines, then one line per term: doc_id:tf doc_id:tf
+#   binary: a "VBYTE" magic line, a "SKIPS" line, the same LC/LT lines and an "END" line,
+#           then one block per term: (doc_id gap, tf) pairs, each number variable-byte
+#           encoded, followed by the list's skip entries (see POSTINGS_SKIP)
+# An index built with a non-default tokenizer (index.py -t) names it in a "TOKENIZER" line
+# before the LC/LT lines, so the search scripts analyze queries the same way.
+#
+# Dictionary lines are "zone:term offset df length max_weight", where length is the byte
+# length of the term's postings and max_weight is the largest length-normalized document
+# weight (1 + log10(tf)) / zone_length over the postings, an upper bound used for top-K
+# pruning. Dictionaries written before these columns existed still load. index.py -c
+# writes the same entries in a compact binary format instead (see CompactDictionary).
+#
+# Optional side files sit next to the postings file and share its name, with their own
+# extension (see side_file), so the search scripts find them without extra options.
+
+BINARY_MAGIC = b"VBYTE\n"
+BINARY_HEADER_END = b"END\n"
+FORWARD_MAGIC = b"FORWARD\n"
+TOKENIZER_PREFIX = b"TOKENIZER "
+
+# Every POSTINGS_SKIP postings of a binary list start a block, and the skip entries after
+# the list give the first doc ID of every block but the first as 8-byte integers, then
+# the byte offsets of those blocks in the list as 4-byte integers. The length in the
+# dictionary does not count them, and their number follows from the df. A lookup of a
+# few doc IDs (ConjunctiveFilter) decodes only the blocks that can hold them. Binary files
+# written before the entries existed have no SKIPS line and are read in full.
+POSTINGS_SKIP = 32
+SKIPS_LINE = f"SKIPS {POSTINGS_SKIP}\n".encode('ascii')
+
+# Location, document frequency and score upper bound of a term's postings, and for terms
+# found in index segments, the entry of every segment (see add_segment_part)
+TermInfo = namedtuple('TermInfo', ['offset', 'df', 'length', 'max_weight', 'parts'], defaults=[None, None, None])
+
+# Variable-byte encoding ##################################################################
+
+# Append `number` to `out`, 7 bits per byte, high bit set on the last byte
+def vb_encode_number(number, out):
+    chunk = [(number & 0x7f) | 0x80]
+    number >>= 7
+    while number:
+        chunk.append(number & 0x7f)
+        number >>= 7
+    out.extend(reversed(chunk))
+
+def vb_decode(data):
+    numbers = []
+    number = 0
+    for byte in data:
+        if byte < 0x80:
+            number = (number << 7) | byte
+        else:
+            numbers.append((number << 7) | (byte & 0x7f))
+            number = 0
+    return numbers
+
+# Decode `count` numbers starting at `offset` of `data`, returning them and the offset
+# after the last one
+def vb_decode_from(data, offset, count):
+    numbers = []
+    number = 0
+    while len(numbers) < count:
+        byte = data[offset]
+        offset += 1
+        if byte < 0x80:
+            number = (number << 7) | byte
+        else:
+            numbers.append((number << 7) | (byte & 0x7f))
+            number = 0
+    return numbers, offset
+
+# Index of the first doc ID >= doc_id in the sorted doc_ids, starting at `start`: steps
+# of doubling length find a range holding it, then a binary search inside that range
+def gallop(doc_ids, doc_id, start):
+    end = len(doc_ids)
+    if start >= end or doc_ids[start] >= doc_id:
+        return start
+    step = 1
+    while start + step < end and doc_ids[start + step] < doc_id:
+        start += step
+        step *= 2
+    return bisect_left(doc_ids, doc_id, start + 1, min(start + step, end))
+
+# Postings encoding #######################################################################
+
+def format_postings(postings):
+    return (' '.join(f"{doc_id}:{tf}" for doc_id, tf in postings) + "\n").encode('utf-8')
+
+# Encode postings sorted by doc_id as variable-byte (doc_id gap, tf) pairs, and if `skips`
+# is given, append the first doc ID and offset of every block after the first to it
+def encode_postings(postings, skips=None):
+    out = bytearray()
+    prev_doc_id = 0
+    for i, (doc_id, tf) in enumerate(postings):
+        if skips is not None and i and i % POSTINGS_SKIP == 0:
+            skips.append((doc_id, len(out)))
+        vb_encode_number(doc_id - prev_doc_id, out)
+        vb_encode_number(tf, out)
+        prev_doc_id = doc_id
+    return bytes(out)
+
+# Parse a text postings line without decoding it or splitting every posting separately
+def parse_postings(data):
+    numbers = list(map(int, data.replace(b':', b' ').split()))
+    return list(zip(numbers[0::2], numbers[1::2]))
+
+def decode_postings(data):
+    numbers = vb_decode(data)
+    return list(zip(accumulate(numbers[0::2]), numbers[1::2]))
+
+# Write the postings file header: the format and skip markers (binary only), the tokenizer
+# (if not the default one) and document lengths
+def write_header(p_file, content_lengths, title_lengths, binary, tokenizer=None):
+    if binary:
+        p_file.write(BINARY_MAGIC + SKIPS_LINE)
+    if tokenizer:
+        p_file.write(TOKENIZER_PREFIX + tokenizer.encode('utf-8') + b"\n")
+    for doc_id, length in content_lengths.items():
+        p_file.write(f"LC {doc_id} {length}\n".encode('utf-8'))
+    for doc_id, length in title_lengths.items():
+        p_file.write(f"LT {doc_id} {length}\n".encode('utf-8'))
+    if binary:
+        p_file.write(BINARY_HEADER_END)
+
+# Largest (1 + log10(tf)) / length over the postings, for zones with document lengths
+def max_doc_weight(postings, doc_lengths=None):
+    if doc_lengths is None:
+        return max(1 + math.log10(tf) for _doc_id, tf in postings)
+    return max((1 + math.log10(tf)) / doc_lengths[doc_id] for doc_id, tf in postings)
+
+# Skip entries of a binary list, as written after it (see POSTINGS_SKIP)
+def encode_skips(skips):
+    return (array('q', [doc_id for doc_id, _offset in skips]).tobytes() +
+            array('I', [offset for _doc_id, offset in skips]).tobytes())
+
+# Write one term's postings, with skip entries if binary, and its dictionary line
+def write_postings(d_file, p_file, key, postings, binary, doc_lengths=None):
+    offset = p_file.tell()
+    if binary:
+        skips = []
+        data = encode_postings(postings, skips)
+        p_file.write(data)
+        p_file.write(encode_skips(skips))
+    else:
+        data = format_postings(postings)
+        p_file.write(data)
+    d_file.write(f"{key} {offset} {len(postings)} {len(data)} {max_doc_weight(postings, doc_lengths)}\n")
+
+# Path of the side file with extension `extension` that belongs to a postings file
+def side_file(postings_file, extension):
+    return os.path.splitext(postings_file)[0] + extension
+
+# (size, modification time in ns) of the postings file, recorded in the length table and
+# the synonym, impact and tiered indexes to tell whether they were written for it
+def postings_stamp(postings_file):
+    stat = os.stat(postings_file)
+    return stat.st_size, stat.st_mtime_ns
+
+# Forward index ###########################################################################
+#
+# Per-document content vectors, written by index.py -f to the ".fwd" side file:
+#   a "FORWARD" magic line, then one block per document of variable-byte (term_id gap, tf)
+#   pairs, then the sorted doc IDs and the block offsets (one more than there are
+#   documents) as 8-byte integers, then the position of those two arrays and the number
+#   of documents. Term ids number the content terms in sorted order, which is also the
+#   order of the C: lines in the dictionary.
+
+FORWARD_EXTENSION = '.fwd'
+FORWARD_TRAILER = struct.Struct('<qq')
+
+def write_forward_index(forward_file, doc_vectors):
+    """ Write `doc_vectors`, doc_id -> [(term_id, tf)] sorted by term_id, as a forward index """
+    doc_ids = array('q', sorted(doc_vectors))
+    offsets = array('q')
+    with open(forward_file, 'wb') as f_file:
+        f_file.write(FORWARD_MAGIC)
+        for doc_id in doc_ids:
+            offsets.append(f_file.tell())
+            f_file.write(encode_postings(doc_vectors[doc_id]))
+        offsets.append(f_file.tell())
+        # Align the arrays so the reader can map them as 8-byte integers in place
+        f_file.write(bytes(-f_file.tell() % 8))
+        table_offset = f_file.tell()
+        f_file.write(doc_ids.tobytes())
+        f_file.write(offsets.tobytes())
+        f_file.write(FORWARD_TRAILER.pack(table_offset, len(doc_ids)))
+
+class ForwardIndexReader:
+    """
+    Reads document vectors out of a memory-mapped forward index. A document is found by
+    binary search over the mapped doc ID array, and only its own block is decoded.
+    """
+
+    def __init__(self, forward_file):
+        with open(forward_file, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(FORWARD_MAGIC)] != FORWARD_MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{forward_file} is not a forward index")
+        self.view = memoryview(self.buffer)
+        table_offset, num_docs = FORWARD_TRAILER.unpack_from(self.buffer, len(self.buffer) - FORWARD_TRAILER.size)
+        table = self.view[table_offset:len(self.buffer) - FORWARD_TRAILER.size].cast('q')
+        self.doc_ids = table[:num_docs]
+        self.offsets = table[num_docs:]
+
+    # [(term_id, tf)] of the document, sorted by term_id; empty for unknown documents
+    def vector(self, doc_id):
+        i = bisect_left(self.doc_ids, doc_id)
+        if i == len(self.doc_ids) or self.doc_ids[i] != doc_id:
+            return []
+        return decode_postings(self.view[self.offsets[i]:self.offsets[i + 1]])
+
+    def close(self):
+        self.doc_ids.release()
+        self.offsets.release()
+        self.view.release()
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Compact dictionary ######################################################################
+#
+# index.py -c writes the dictionary in a binary format that the search scripts map into
+# memory instead of parsing:
+#   a "DICTBIN" magic line, the number of keys, the byte length of the key blob and the
+#   number of hash slots, then one array of 8-byte numbers per column: the key offsets
+#   into the blob (one more than there are keys), the postings offsets, dfs, postings byte
+#   lengths (-1 if unknown) and max weights (NaN if unknown, as doubles), then the hash
+#   slots, then the blob of all UTF-8 keys, sorted.
+# The hash slots are an open-addressing table: a key's CRC-32 picks its first slot, and
+# slots are probed in turn until one holds the key's position + 1 or is empty (0). There
+# are at least twice as many slots as keys, so a lookup compares one or two keys.
+# A key costs its bytes plus 56 to 72 bytes on disk and in the page cache, against well
+# over 150 bytes of Python objects per entry in a dict, and loading does no work per key.
+
+DICTIONARY_MAGIC = b"DICTBIN\n"
+DICTIONARY_HEADER = struct.Struct('<qqq')
+
+def is_compact_dictionary(dict_file):
+    with open(dict_file, 'rb') as file:
+        return file.read(len(DICTIONARY_MAGIC)) == DICTIONARY_MAGIC
+
+def write_compact_dictionary(dict_file, dictionary):
+    """ Write `dictionary`, key -> TermInfo, in the compact format """
+    keys = sorted(dictionary, key=lambda key: key.encode('utf-8'))
+    encoded_keys = [key.encode('utf-8') for key in keys]
+    infos = [dictionary[key] for key in keys]
+    num_slots = 1 << (2 * len(keys)).bit_length()
+    slots = array('q', bytes(8 * num_slots))
+    for i, encoded in enumerate(encoded_keys):
+        slot = zlib.crc32(encoded) & (num_slots - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (num_slots - 1)
+        slots[slot] = i + 1
+    columns = [
+        array('q', accumulate(map(len, encoded_keys), initial=0)),
+        array('q', (info.offset for info in infos)),
+        array('q', (info.df for info in infos)),
+        array('q', (-1 if info.length is None else info.length for info in infos)),
+        array('d', (math.nan if info.max_weight is None else info.max_weight for info in infos)),
+        slots,
+    ]
+    with open(dict_file, 'wb') as file:
+        file.write(DICTIONARY_MAGIC)
+        file.write(DICTIONARY_HEADER.pack(len(keys), columns[0][-1], num_slots))
+        for column in columns:
+            file.write(column.tobytes())
+        file.write(b''.join(encoded_keys))
+
+class CompactDictionary(Mapping):
+    """
+    Read-only key -> TermInfo mapping over a memory-mapped compact dictionary. Lookups go
+    through the hash slots; iteration follows the sorted key order.
+    """
+
+    def __init__(self, dict_file):
+        with open(dict_file, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(DICTIONARY_MAGIC)] != DICTIONARY_MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{dict_file} is not a compact dictionary")
+        num_keys, _blob_length, num_slots = DICTIONARY_HEADER.unpack_from(self.buffer, len(DICTIONARY_MAGIC))
+        self.view = memoryview(self.buffer)
+        start = len(DICTIONARY_MAGIC) + DICTIONARY_HEADER.size
+        columns = []
+        for typecode, length in (('q', num_keys + 1), ('q', num_keys), ('q', num_keys), ('q', num_keys),
+                                 ('d', num_keys), ('q', num_slots)):
+            columns.append(self.view[start:start + 8 * length].cast(typecode))
+            start += 8 * length
+        self.key_offsets, self.offsets, self.dfs, self.lengths, self.max_weights, self.slots = columns
+        self.slot_mask = num_slots - 1
+        self.blob_start = start
+        self.num_keys = num_keys
+
+    # The encoded key at position i of the sorted order
+    def key_bytes(self, i):
+        return self.buffer[self.blob_start + self.key_offsets[i]:self.blob_start + self.key_offsets[i + 1]]
+
+    # Position of the key in the sorted order, None if it is missing
+    def position(self, key):
+        encoded = key.encode('utf-8')
+        slot = zlib.crc32(encoded) & self.slot_mask
+        while self.slots[slot]:
+            i = self.slots[slot] - 1
+            if self.key_bytes(i) == encoded:
+                return i
+            slot = (slot + 1) & self.slot_mask
+        return None
+
+    def info(self, i):
+        length = self.lengths[i]
+        max_weight = self.max_weights[i]
+        return TermInfo(self.offsets[i], self.dfs[i], None if length < 0 else length,
+                        None if math.isnan(max_weight) else max_weight)
+
+    def __getitem__(self, key):
+        i = self.position(key)
+        if i is None:
+            raise KeyError(key)
+        return self.info(i)
+
+    def __contains__(self, key):
+        return self.position(key) is not None
+
+    def __len__(self):
+        return self.num_keys
+
+    def __iter__(self):
+        for i in range(self.num_keys):
+            yield self.key_bytes(i).decode('utf-8')
+
+    # Scans without a lookup per key
+    def values(self):
+        for i in range(self.num_keys):
+            yield self.info(i)
+
+    def items(self):
+        for i in range(self.num_keys):
+            yield self.key_bytes(i).decode('utf-8'), self.info(i)
+
+    def close(self):
+        for column in (self.key_offsets, self.offsets, self.dfs, self.lengths, self.max_weights, self.slots):
+            column.release()
+        self.view.release()
+        self.buffer.close()
+
+# Document length table ###################################################################
+#
+# index.py also writes the document lengths of the LC/LT header lines to a ".lengths" side
+# file that the search scripts memory-map instead of parsing the header:
+#   a "LENGTHS" magic line, the number of documents and the size and modification time of
+#   the postings file it was written for (see postings_stamp), then the sorted doc IDs as
+#   8-byte integers and one array of doubles per zone (content, then title), in the same
+#   order.
+# A document's position in the doc ID array is its dense doc index; the scoring code maps
+# doc IDs to it through a dict of plain ints, built on first use, and normalizes by
+# indexing the zone's length array. The table is ignored when the postings file no longer
+# has the recorded size or modification time, or when the index has segments.
+
+LENGTHS_EXTENSION = '.lengths'
+LENGTHS_MAGIC = b"LENGTHS\n"
+LENGTHS_HEADER = struct.Struct('<qqq')  # number of documents, postings stamp
+LENGTH_ZONES = ('content', 'title')
+
+def write_doc_length_table(postings_file, doc_lengths):
+    """ Write `doc_lengths`, (doc_id, zone) -> length, to the table of `postings_file` """
+    table = DocLengthTable.from_dict(doc_lengths)
+    with open(side_file(postings_file, LENGTHS_EXTENSION), 'wb') as file:
+        file.write(LENGTHS_MAGIC)
+        file.write(LENGTHS_HEADER.pack(table.num_docs, *postings_stamp(postings_file)))
+        file.write(table.doc_ids.tobytes())
+        for zone in LENGTH_ZONES:
+            file.write(table.lengths[zone].tobytes())
+
+class DocLengthTable(Mapping):
+    """
+    Document lengths as dense arrays: `doc_ids` holds the sorted doc IDs and
+    `lengths[zone]` the zone lengths in the same order, so normalizing a score is
+    `lengths[zone][doc_indices[doc_id]]`. Also a read-only (doc_id, zone) -> length mapping
+    with the same entries as the dict read from the postings header.
+    """
+
+    def __init__(self, doc_ids, lengths, buffer=None):
+        self.doc_ids = doc_ids
+        self.lengths = lengths
+        self.num_docs = len(doc_ids)
+        self.buffer = buffer
+
+    @classmethod
+    def from_file(cls, table_file):
+        """ Map a length table written by write_doc_length_table, without parsing it """
+        with open(table_file, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(LENGTHS_MAGIC)] != LENGTHS_MAGIC:
+            buffer.close()
+            raise ValueError(f"{table_file} is not a document length table")
+        num_docs, *stamp = LENGTHS_HEADER.unpack_from(buffer, len(LENGTHS_MAGIC))
+        view = memoryview(buffer)
+        start = len(LENGTHS_MAGIC) + LENGTHS_HEADER.size
+        doc_ids = view[start:start + 8 * num_docs].cast('q')
+        lengths = {}
+        for zone in LENGTH_ZONES:
+            start += 8 * num_docs
+            lengths[zone] = view[start:start + 8 * num_docs].cast('d')
+        table = cls(doc_ids, lengths, buffer)
+        table.postings_stamp = tuple(stamp)
+        return table
+
+    @classmethod
+    def from_dict(cls, doc_lengths):
+        doc_ids = array('q', sorted({doc_id for doc_id, _zone in doc_lengths}))
+        return cls(doc_ids, {zone: array('d', (doc_lengths[(doc_id, zone)] for doc_id in doc_ids))
+                             for zone in LENGTH_ZONES})
+
+    # doc_id -> dense doc index, built from the doc IDs on the first lookup
+    @cached_property
+    def doc_indices(self):
+        return dict(zip(self.doc_ids.tolist(), range(self.num_docs)))
+
+    def __getitem__(self, key):
+        doc_id, zone = key
+        return self.lengths[zone][self.doc_indices[doc_id]]
+
+    def __contains__(self, key):
+        doc_id, zone = key
+        return zone in self.lengths and doc_id in self.doc_indices
+
+    def __len__(self):
+        return len(LENGTH_ZONES) * self.num_docs
+
+    def __iter__(self):
+        for zone in LENGTH_ZONES:
+            for doc_id in self.doc_ids:
+                yield doc_id, zone
+
+    def close(self):
+        if self.buffer is not None:
+            for column in (self.doc_ids, *self.lengths.values()):
+                column.release()
+            self.buffer.close()
+
+# Positional index ########################################################################
+#
+# index.py -P also records where every content and title term occurs, as token offsets
+# from the start of the zone's text, in the ".pos" side file:
+#   a "POSITIONS" magic line, then one block per C:/T: key with one entry per posting, in
+#   postings order: the first position and the gaps between the following ones, variable-
+#   byte encoded, preceded by their byte length. A block starts with the byte offsets (as
+#   4-byte integers, counted from the end of these offsets) of every POSITIONS_SKIP-th
+#   entry, so one posting's positions are reached by skipping at most POSITIONS_SKIP - 1
+#   other entries, reading only their lengths, and then decoding its own.
+# Blocks are located through a compact dictionary (see CompactDictionary) in the ".posdict"
+# side file, with the same keys as the main dictionary and the block offset, df and length.
+
+POSITIONS_EXTENSION = '.pos'
+POSITIONS_DICTIONARY_EXTENSION = '.posdict'
+POSITIONS_MAGIC = b"POSITIONS\n"
+POSITIONS_SKIP = 16
+SKIP_OFFSET = struct.Struct('<I')
+
+def write_positions_index(postings_file, key_positions):
+    """
+    Write the positional index of `postings_file` from (key, position lists) pairs, with
+    one sorted position list per posting of the key, in postings order
+    """
+    entries = {}
+    with open(side_file(postings_file, POSITIONS_EXTENSION), 'wb') as pos_file:
+        pos_file.write(POSITIONS_MAGIC)
+        for key, position_lists in key_positions:
+            skips = array('I')
+            data = bytearray()
+            for i, positions in enumerate(position_lists):
+                if i % POSITIONS_SKIP == 0:
+                    skips.append(len(data))
+                gaps = bytearray()
+                previous = 0
+                for position in positions:
+                    vb_encode_number(position - previous, gaps)
+                    previous = position
+                vb_encode_number(len(gaps), data)
+                data += gaps
+            offset = pos_file.tell()
+            pos_file.write(b''.join(SKIP_OFFSET.pack(skip) for skip in skips))
+            pos_file.write(data)
+            entries[key] = TermInfo(offset, len(position_lists), pos_file.tell() - offset)
+    write_compact_dictionary(side_file(postings_file, POSITIONS_DICTIONARY_EXTENSION), entries)
+
+class PositionsReader:
+    """ Reads the positions of single postings out of a memory-mapped positional index """
+
+    def __init__(self, postings_file):
+        with open(side_file(postings_file, POSITIONS_EXTENSION), 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(POSITIONS_MAGIC)] != POSITIONS_MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{postings_file} has no positional index")
+        self.dictionary = CompactDictionary(side_file(postings_file, POSITIONS_DICTIONARY_EXTENSION))
+
+    # Sorted positions of posting `i` of the key with positional dictionary entry `info`
+    def positions(self, info, i):
+        num_skips = -(-info.df // POSITIONS_SKIP)
+        skip_offset = info.offset + SKIP_OFFSET.size * (i // POSITIONS_SKIP)
+        offset = info.offset + SKIP_OFFSET.size * num_skips + SKIP_OFFSET.unpack_from(self.buffer, skip_offset)[0]
+        for _ in range(i % POSITIONS_SKIP):
+            (length,), offset = vb_decode_from(self.buffer, offset, 1)
+            offset += length
+        (length,), offset = vb_decode_from(self.buffer, offset, 1)
+        return list(accumulate(vb_decode(self.buffer[offset:offset + length])))
+
+    def close(self):
+        self.dictionary.close()
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# The positional index of `postings_file`, or None if it has none or has segments, which
+# the positional index does not cover
+def open_positions(postings_file):
+    if not os.path.exists(side_file(postings_file, POSITIONS_EXTENSION)) or load_manifest(postings_file).segments:
+        return None
+    return PositionsReader(postings_file)
+
+# Synonym table ###########################################################################
+#
+# `python synonyms.py` precomputes the WordNet expansions of the WordNet search scripts
+# into a ".syn" side file, so they need neither WordNet nor its load time:
+#   a "SYNONYMS" magic line and the size and modification time of the postings file it was
+#   written for (see postings_stamp), then one UTF-8 entry per stemmed term: the
+#   expansion terms of each WordNet sense, in sense order, separated by spaces within a
+#   sense and by tabs between senses.
+# Entries are located through a compact dictionary in the ".syndict" side file, whose
+# TermInfo holds the entry's offset, number of senses and byte length. The synonym table is
+# ignored when the postings file no longer has the recorded size or modification time, or
+# when the index has segments.
+
+SYNONYMS_EXTENSION = '.syn'
+SYNONYMS_DICTIONARY_EXTENSION = '.syndict'
+SYNONYMS_MAGIC = b"SYNONYMS\n"
+SYNONYMS_HEADER = struct.Struct('<qq')  # postings stamp
+
+def write_synonym_table(postings_file, table):
+    """ Write `table`, stemmed term -> list of senses (lists of expansion terms) """
+    entries = {}
+    with open(side_file(postings_file, SYNONYMS_EXTENSION), 'wb') as file:
+        file.write(SYNONYMS_MAGIC)
+        file.write(SYNONYMS_HEADER.pack(*postings_stamp(postings_file)))
+        offset = len(SYNONYMS_MAGIC) + SYNONYMS_HEADER.size
+        for term in sorted(table):
+            senses = table[term]
+            data = '\t'.join(' '.join(sense) for sense in senses).encode('utf-8')
+            file.write(data)
+            entries[term] = TermInfo(offset, len(senses), len(data))
+            offset += len(data)
+    write_compact_dictionary(side_file(postings_file, SYNONYMS_DICTIONARY_EXTENSION), entries)
+
+class SynonymTable:
+    """ Reads the senses of single terms out of a memory-mapped synonym table """
+
+    def __init__(self, postings_file):
+        with open(side_file(postings_file, SYNONYMS_EXTENSION), 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(SYNONYMS_MAGIC)] != SYNONYMS_MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{postings_file} has no synonym table")
+        self.postings_stamp = SYNONYMS_HEADER.unpack_from(self.buffer, len(SYNONYMS_MAGIC))
+        self.dictionary = CompactDictionary(side_file(postings_file, SYNONYMS_DICTIONARY_EXTENSION))
+
+    # Expansion terms of every sense of the stemmed term, [] if it has none
+    def senses(self, term):
+        i = self.dictionary.position(term)
+        if i is None:
+            return []
+        start = self.dictionary.offsets[i]
+        data = self.buffer[start:start + self.dictionary.lengths[i]].decode('utf-8')
+        return [sense.split() for sense in data.split('\t')]
+
+    def close(self):
+        self.dictionary.close()
+        self.buffer.close()
+
+def open_synonyms(postings_file):
+    """ The synonym table of the index, or None if it has none that is up to date """
+    if not os.path.exists(side_file(postings_file, SYNONYMS_EXTENSION)) or load_manifest(postings_file).segments:
+        return None
+    table = SynonymTable(postings_file)
+    if table.postings_stamp != postings_stamp(postings_file):
+        table.close()
+        return None
+    return table
+
+# Impact-ordered index ####################################################################
+#
+# index.py -I precomputes the document weight of every C: and T: posting, the length-
+# normalized (1 + log10(tf)) / zone_length that scoring multiplies the query weight by,
+# into a ".imp" side file, so the scripts can score without a log10 or division per
+# posting (search_tfidf_weight.py -I):
+#   an "IMPACTS" magic line, the size and modification time of the postings file it was
+#   written for and the quantization of each zone (see below), then one block per key: the postings grouped
+#   by quantized weight, highest first, each group as its level, its number of postings
+#   and the doc ID gaps of its postings in doc ID order, all variable-byte encoded.
+# Weights are quantized to IMPACT_LEVELS levels spread evenly over the logarithm of the
+# zone's weights, from the lowest to the highest weight of the zone, so a weight moves by
+# at most half the ratio between neighbouring levels (0.4% on the sample). The best
+# postings of a key come first, in groups that share one weight, which score-at-a-time
+# ranking (see query_eval.py) relies on.
+# Blocks are located through a compact dictionary in the ".impdict" side file, whose
+# TermInfo holds the block's offset, df, byte length and highest weight. Like the synonym
+# table, the impact index is ignored when the postings file no longer has the recorded
+# size or modification time, or when the index has segments.
+
+IMPACTS_EXTENSION = '.imp'
+IMPACTS_DICTIONARY_EXTENSION = '.impdict'
+IMPACTS_MAGIC = b"IMPACTS\n"
+IMPACTS_HEADER = struct.Struct('<qqdddd')  # postings stamp, (log of lowest weight, log step) of C: and T:
+IMPACT_LEVELS = 256
+IMPACT_ZONES = ('C', 'T')
+
+# (log of the lowest weight, log step between levels) spreading the levels over the
+# weights from `lowest` to `highest`
+def impact_scale(lowest, highest):
+    low = math.log(lowest)
+    return low, (math.log(highest) - low) / (IMPACT_LEVELS - 1) or 1.0
+
+def write_impact_index(postings_file, key_postings, weight_ranges):
+    """
+    Write the impact index of `postings_file` from (key, postings, weights) triples of C:
+    and T: keys, with weights[i] the weight of postings[i] and weight_ranges[zone] the
+    (lowest, highest) weight of the zone
+    """
+    scales = {zone: impact_scale(*weight_ranges[zone]) for zone in IMPACT_ZONES}
+    entries = {}
+    with open(side_file(postings_file, IMPACTS_EXTENSION), 'wb') as file:
+        file.write(IMPACTS_MAGIC)
+        file.write(IMPACTS_HEADER.pack(*postings_stamp(postings_file), *scales['C'], *scales['T']))
+        offset = len(IMPACTS_MAGIC) + IMPACTS_HEADER.size
+        for key, postings, weights in key_postings:
+            low, step = scales[key[0]]
+            levels = defaultdict(list)
+            for (doc_id, _tf), weight in zip(postings, weights):
+                levels[round((math.log(weight) - low) / step)].append(doc_id)
+            data = bytearray()
+            for level in sorted(levels, reverse=True):
+                vb_encode_number(level, data)
+                vb_encode_number(len(levels[level]), data)
+                previous = 0
+                for doc_id in sorted(levels[level]):
+                    vb_encode_number(doc_id - previous, data)
+                    previous = doc_id
+            file.write(data)
+            entries[key] = TermInfo(offset, len(weights), len(data), math.exp(low + max(levels) * step))
+            offset += len(data)
+    write_compact_dictionary(side_file(postings_file, IMPACTS_DICTIONARY_EXTENSION), entries)
+
+class ImpactIndex:
+    """
+    Reads the weight groups of keys out of a memory-mapped impact index. Decoded groups go
+    through `postings_cache` like postings lists, so they are shared and must not be modified.
+    """
+
+    def __init__(self, postings_file):
+        impacts_file = side_file(postings_file, IMPACTS_EXTENSION)
+        with open(impacts_file, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(IMPACTS_MAGIC)] != IMPACTS_MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{postings_file} has no impact index")
+        self.view = memoryview(self.buffer)
+        header = IMPACTS_HEADER.unpack_from(self.buffer, len(IMPACTS_MAGIC))
+        self.postings_stamp, scales = header[:2], header[2:]
+        # Weight of every level, per zone
+        self.weights = {zone: [math.exp(low + level * step) for level in range(IMPACT_LEVELS)]
+                        for zone, low, step in zip(IMPACT_ZONES, scales[0::2], scales[1::2])}
+        self.dictionary = CompactDictionary(side_file(postings_file, IMPACTS_DICTIONARY_EXTENSION))
+        stat = os.stat(impacts_file)
+        self.identity = (os.path.abspath(impacts_file), stat.st_size, stat.st_mtime_ns)
+
+    def groups(self, key):
+        """ (weight, sorted doc IDs) of every weight of the key, highest first; [] if it has none """
+        info = self.dictionary.get(key)
+        if info is None:
+            return []
+        return postings_cache.get((self.identity, info), lambda: self.read(key[0], info),
+                                  lambda groups: info.df, f"{key} (impacts)")
+
+    def read(self, zone, info):
+        numbers = vb_decode(self.view[info.offset:info.offset + info.length])
+        weights = self.weights[zone]
+        groups = []
+        i = 0
+        while i < len(numbers):
+            level, count = numbers[i], numbers[i + 1]
+            groups.append((weights[level], list(accumulate(numbers[i + 2:i + 2 + count]))))
+            i += 2 + count
+        return groups, info.length
+
+    def close(self):
+        self.dictionary.close()
+        self.view.release()
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_impacts(postings_file):
+    """ The impact index of the index, or None if it has none that is up to date """
+    if not os.path.exists(side_file(postings_file, IMPACTS_EXTENSION)) or load_manifest(postings_file).segments:
+        return None
+    impacts = ImpactIndex(postings_file)
+    if impacts.postings_stamp != postings_stamp(postings_file):
+        impacts.close()
+        return None
+    return impacts
+
+# Tiered index ############################################################################
+#
+# index.py -T splits every C: and T: postings list into two tiers, by the length-normalized
+# weight (1 + log10(tf)) / zone_length of its postings, in a ".tier" side file:
+#   a "TIERS" magic line and the size and modification time of the postings file it was
+#   written for, then one block per key: the number of tail postings (8 bytes), the tier-1
+#   postings (the TIER_FRACTION best-weighted ones, at least TIER_MIN_POSTINGS) as in the
+#   binary postings format, and the tail postings (all the others) as an array of doc IDs,
+#   8-byte integers aligned to 8 bytes, and an array of their tfs, 4-byte integers, so
+#   single tail postings are found by binary search without decoding the tail.
+# Blocks are located through a compact dictionary in the ".tierdict" side file, whose
+# TermInfo holds the block's offset, the number of tier-1 postings, their byte length and
+# the largest weight in the tail, which bounds what the tail adds to any document. Like the
+# impact index, the tiered index is ignored when the postings file no longer has the
+# recorded size or modification time, or when the index has segments.
+
+TIERS_EXTENSION = '.tier'
+TIERS_DICTIONARY_EXTENSION = '.tierdict'
+TIERS_MAGIC = b"TIERS\n"
+TIERS_HEADER = struct.Struct('<qq')  # postings stamp
+TAIL_HEADER = struct.Struct('<q')
+TIER_FRACTION = 0.1
+TIER_MIN_POSTINGS = 64
+
+def write_tiered_index(postings_file, key_postings, fraction=TIER_FRACTION):
+    """
+    Write the tiered index of `postings_file` from (key, postings, weights) triples of C:
+    and T: keys, with weights[i] the weight of postings[i]
+    """
+    entries = {}
+    with open(side_file(postings_file, TIERS_EXTENSION), 'wb') as file:
+        file.write(TIERS_MAGIC)
+        file.write(TIERS_HEADER.pack(*postings_stamp(postings_file)))
+        offset = len(TIERS_MAGIC) + TIERS_HEADER.size
+        for key, postings, weights in key_postings:
+            order = sorted(range(len(postings)), key=lambda i: weights[i], reverse=True)
+            tier_size = max(TIER_MIN_POSTINGS, math.ceil(fraction * len(postings)))
+            tier = encode_postings([postings[i] for i in sorted(order[:tier_size])])
+            tail = sorted(order[tier_size:])
+            # Align the tail arrays so the reader can map them as integers in place
+            padding = bytes(-(offset + TAIL_HEADER.size + len(tier)) % 8)
+            data = (TAIL_HEADER.pack(len(tail)) + tier + padding + array('q', (postings[i][0] for i in tail)).tobytes()
+                    + array('i', (postings[i][1] for i in tail)).tobytes())
+            file.write(data)
+            tail_bound = max((weights[i] for i in tail), default=0.0)
+            entries[key] = TermInfo(offset, min(tier_size, len(postings)), len(tier), tail_bound)
+            offset += len(data)
+    write_compact_dictionary(side_file(postings_file, TIERS_DICTIONARY_EXTENSION), entries)
+
+class TieredIndex:
+    """
+    Reads the tiers of keys out of a memory-mapped tiered index. Decoded tier-1 postings go
+    through `postings_cache` like postings lists, so they are shared and must not be modified.
+    """
+
+    def __init__(self, postings_file):
+        tiers_file = side_file(postings_file, TIERS_EXTENSION)
+        with open(tiers_file, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(TIERS_MAGIC)] != TIERS_MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{postings_file} has no tiered index")
+        self.view = memoryview(self.buffer)
+        self.postings_stamp = TIERS_HEADER.unpack_from(self.buffer, len(TIERS_MAGIC))
+        self.dictionary = CompactDictionary(side_file(postings_file, TIERS_DICTIONARY_EXTENSION))
+        stat = os.stat(tiers_file)
+        self.identity = (os.path.abspath(tiers_file), stat.st_size, stat.st_mtime_ns)
+
+    def tier(self, key):
+        """ The key's tier-1 postings and the largest weight of its tail postings """
+        info = self.dictionary[key]
+        start = info.offset + TAIL_HEADER.size
+        postings = postings_cache.get((self.identity, info), lambda: (
+            decode_postings(self.view[start:start + info.length]), info.length), label=f"{key} (tier 1)")
+        return postings, info.max_weight
+
+    def tail(self, key):
+        """ Sorted doc IDs and tfs of the key's tail postings, as integer sequences """
+        info = self.dictionary[key]
+        num_tail, = TAIL_HEADER.unpack_from(self.buffer, info.offset)
+        start = info.offset + TAIL_HEADER.size + info.length
+        start += -start % 8
+        doc_ids = self.view[start:start + 8 * num_tail].cast('q')
+        tfs = self.view[start + 8 * num_tail:start + 12 * num_tail].cast('i')
+        return doc_ids, tfs
+
+    def close(self):
+        self.dictionary.close()
+        self.view.release()
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_tiers(postings_file):
+    """ The tiered index of the index, or None if it has none that is up to date """
+    if not os.path.exists(side_file(postings_file, TIERS_EXTENSION)) or load_manifest(postings_file).segments:
+        return None
+    tiers = TieredIndex(postings_file)
+    if tiers.postings_stamp != postings_stamp(postings_file):
+        tiers.close()
+        return None
+    return tiers
+
+# Index segments ##########################################################################
+#
+# index.py -a adds new documents as a delta segment instead of rebuilding the index: a
+# dictionary and postings file of its own next to the base postings file (postings.seg3.dict
+# and postings.seg3.post for postings.txt), listed oldest first in the ".segments" manifest.
+# Segments hold disjoint sets of documents. load_dictionary, load_doc_lengths and
+# PostingsReader combine the base with every listed segment: a term's df is the sum of its
+# segment dfs and its postings the merge of its segment postings, and the document lengths
+# are the union, so idf and length normalization are those of a single index of everything.
+#
+# Manifest lines are "next N" (the next unused segment number), "segment N num_docs" and
+# "obsolete N" for a segment merged away. Obsolete segment files are only deleted by the
+# next merge, so a searcher that loaded the manifest before a merge can still read them.
+
+SEGMENTS_EXTENSION = '.segments'
+
+Manifest = namedtuple('Manifest', ['next_number', 'segments', 'obsolete'])
+
+# Dictionary and postings file of segment `number`
+def segment_files(postings_file, number):
+    return side_file(postings_file, f".seg{number}.dict"), side_file(postings_file, f".seg{number}.post")
+
+def load_manifest(postings_file):
+    manifest = Manifest(1, [], [])
+    manifest_file = side_file(postings_file, SEGMENTS_EXTENSION)
+    if not os.path.exists(manifest_file):
+        return manifest
+    with open(manifest_file, 'r', encoding="utf8") as file:
+        for line in file:
+            kind, *fields = line.split()
+            if kind == 'next':
+                manifest = manifest._replace(next_number=int(fields[0]))
+            elif kind == 'segment':
+                manifest.segments.append((int(fields[0]), int(fields[1])))
+            elif kind == 'obsolete':
+                manifest.obsolete.append(int(fields[0]))
+    return manifest
+
+# Replace the manifest in one rename, so a reader never sees it half written
+def write_manifest(postings_file, manifest):
+    manifest_file = side_file(postings_file, SEGMENTS_EXTENSION)
+    with open(manifest_file + '.tmp', 'w', encoding="utf8") as file:
+        file.write(f"next {manifest.next_number}\n")
+        for number, num_docs in manifest.segments:
+            file.write(f"segment {number} {num_docs}\n")
+        for number in manifest.obsolete:
+            file.write(f"obsolete {number}\n")
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+# Combine a term's dictionary entry (None if the term is new) with its entry in segment
+# `number`. Combined entries list their per-segment entries in `parts`, 0 being the base.
+def add_segment_part(info, number, segment_info):
+    if info is None:
+        return TermInfo(None, segment_info.df, None, segment_info.max_weight, ((number, segment_info),))
+    max_weight = None
+    if info.max_weight is not None and segment_info.max_weight is not None:
+        max_weight = max(info.max_weight, segment_info.max_weight)
+    parts = info.parts or ((0, info),)
+    return TermInfo(None, info.df + segment_info.df, None, max_weight, parts + ((number, segment_info),))
+
+# Loading #################################################################################
+
+# Read one dictionary file, as a CompactDictionary if it is in the compact format
+def read_dictionary(dict_file):
+    if is_compact_dictionary(dict_file):
+        return CompactDictionary(dict_file)
+    dictionary = {}
+    with open(dict_file, 'r', encoding="utf8") as file:
+        for line in file:
+            term, *fields = line.split()
+            dictionary[term] = TermInfo(*(int(field) for field in fields[:3]), *map(float, fields[3:]))
+    return dictionary
+
+# Zones of the dictionary keys, in the order index.py writes them
+KEY_ZONES = ('C', 'T', 'COURT', 'DATE')
+
+# Sort key of a dictionary key in a full build's dictionary: by zone, then by term
+def key_order(key):
+    zone, term = key.split(':', 1)
+    return KEY_ZONES.index(zone), term
+
+# Load dictionary, combined with the segments of the index of `postings_file` if given.
+# A combined dictionary is put back in key_order, so terms new in a segment do not come
+# last and the scripts that break ties by dictionary order rank as on a full rebuild.
+def load_dictionary(dict_file, postings_file=None):
+    dictionary = read_dictionary(dict_file)
+    segments = load_manifest(postings_file).segments if postings_file is not None else []
+    if not segments:
+        return dictionary
+    dictionary = dict(dictionary.items())  # combined entries cannot be stored in place
+    for number, _num_docs in segments:
+        for term, info in read_dictionary(segment_files(postings_file, number)[0]).items():
+            dictionary[term] = add_segment_part(dictionary.get(term), number, info)
+    return {term: dictionary[term] for term in sorted(dictionary, key=key_order)}
+
+# Read the document lengths in the header of one postings file into `doc_lengths`
+def read_doc_lengths(postings_file, doc_lengths):
+    with open(postings_file, 'rb') as file:
+        for line in file:
+            if line.startswith(b"LC "):
+                _field, docID, length = line.split()
+                doc_lengths[(int(docID), 'content')] = float(length)
+            elif line.startswith(b"LT "):
+                _field, docID, length = line.split()
+                doc_lengths[(int(docID), 'title')] = float(length)
+            elif line not in (BINARY_MAGIC, SKIPS_LINE) and not line.startswith(TOKENIZER_PREFIX):
+                break
+    return doc_lengths
+
+# Load document lengths of the index and all its segments as a DocLengthTable, mapped from
+# the length table file if it is usable, else read from the postings headers
+def load_doc_lengths(postings_file):
+    table_file = side_file(postings_file, LENGTHS_EXTENSION)
+    segments = load_manifest(postings_file).segments
+    if os.path.exists(table_file) and not segments:
+        table = DocLengthTable.from_file(table_file)
+        if table.postings_stamp == postings_stamp(postings_file):
+            return table
+        table.close()
+    doc_lengths = read_doc_lengths(postings_file, {})
+    for number, _num_docs in segments:
+        read_doc_lengths(segment_files(postings_file, number)[1], doc_lengths)
+    return DocLengthTable.from_dict(doc_lengths)
+
+def is_binary(postings_file):
+    with open(postings_file, 'rb') as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+# Tokenizer the index was built with, None for the default one
+def load_tokenizer(postings_file):
+    with open(postings_file, 'rb') as file:
+        for line in (file.readline(), file.readline(), file.readline()):
+            if line.startswith(TOKENIZER_PREFIX):
+                return line[len(TOKENIZER_PREFIX):].decode('utf-8').strip()
+    return None
+
+# Postings cache ##########################################################################
+#
+# Queries keep reading the same high-df lists (C:court, C:the, C:.), and search_prf.py
+# reads each of its lists twice per query, so PostingsReader keeps decoded lists in one
+# process-wide LRU cache. Its size is bounded by the total number of postings held rather
+# than the number of lists, so one huge list evicts many small ones, and a list larger
+# than the whole budget is not cached. Keys include the size and modification time of the
+# postings file, so a rebuilt index never sees stale lists. Every cached list's hits,
+# misses and the bytes it did not have to read and decode again are counted, and dropped
+# with it when it is evicted; stats() names the lists through a dictionary of the index.
+# Scans over the whole vocabulary read their lists with PostingsReader.read, around the
+# cache, so they do not evict the lists queries keep coming back to.
+
+# Number of postings (about 70 bytes each) the cache holds
+POSTINGS_CACHE_SIZE = 1 << 20
+
+class PostingsCache:
+    """ LRU cache of decoded postings lists, bounded by their total number of postings """
+
+    def __init__(self, max_postings=POSTINGS_CACHE_SIZE):
+        self.max_postings = max_postings
+        self.entries = OrderedDict()  # (postings file identity, TermInfo) -> (postings, bytes, size)
+        self.num_postings = 0
+        self.hits = self.misses = self.evictions = self.bytes_saved = 0
+        self.list_stats = {}  # key of a cached list -> [hits, misses, bytes saved, label]
+
+    def get(self, key, read, size=len, label=None):
+        """
+        The postings list of `key`, from read() -> (postings, bytes) on a miss, holding
+        size(postings) postings. `label` names lists that are not postings of the dictionary
+        in stats()
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += entry[1]
+            stats = self.list_stats[key]
+            stats[0] += 1
+            stats[2] += entry[1]
+            return entry[0]
+
+        self.misses += 1
+        postings, num_bytes = read()
+        num_postings = size(postings)
+        if num_postings <= self.max_postings:
+            self.entries[key] = (postings, num_bytes, num_postings)
+            self.list_stats[key] = [0, 1, 0, label]
+            self.num_postings += num_postings
+            while self.num_postings > self.max_postings:
+                evicted_key, (_evicted, _bytes, evicted_postings) = self.entries.popitem(last=False)
+                del self.list_stats[evicted_key]
+                self.num_postings -= evicted_postings
+                self.evictions += 1
+        return postings
+
+    def clear(self):
+        self.entries.clear()
+        self.list_stats.clear()
+        self.num_postings = 0
+
+    def stats(self, dictionary=None, top=10):
+        """
+        Overall counts, and with the index's dictionary those of the `top` lists saving the
+        most bytes, leaving out lists that saved none
+        """
+        lookups = self.hits + self.misses
+        lines = [f"postings cache: {self.hits} hits, {self.misses} misses"
+                 f" ({100 * self.hits / lookups if lookups else 0:.1f}% hit rate), {len(self.entries)} lists"
+                 f" and {self.num_postings} postings cached, {self.evictions} evicted,"
+                 f" {self.bytes_saved / 1024:.1f} KB not read again"]
+        if dictionary is not None:
+            keys = {info: key for key, info in dictionary.items()}
+            busiest = sorted((item for item in self.list_stats.items() if item[1][2]),
+                             key=lambda item: item[1][2], reverse=True)[:top]
+            for (_identity, info), (hits, misses, bytes_saved, label) in busiest:
+                lines.append(f"  {label or keys.get(info, '?')}: {hits} hits, {misses} misses"
+                             f" ({100 * hits / (hits + misses):.1f}%), {bytes_saved / 1024:.1f} KB saved")
+        return '\n'.join(lines)
+
+postings_cache = PostingsCache()
+
+class PostingsFile:
+    """
+    Reads postings lists of either format straight out of a memory-mapped postings file.
+    Term postings are sliced using the offset and byte length from the dictionary, so no
+    seeking, line reading or text decoding is needed.
+    """
+
+    def __init__(self, postings_file):
+        with open(postings_file, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.buffer)
+        self.binary = self.buffer[:len(BINARY_MAGIC)] == BINARY_MAGIC
+        self.skips = self.binary and self.buffer[len(BINARY_MAGIC):len(BINARY_MAGIC) + len(SKIPS_LINE)] == SKIPS_LINE
+
+    # Byte range of the term's postings
+    def span(self, info):
+        start = info.offset
+        if info.length is None:
+            return start, self.buffer.find(b"\n", start) + 1
+        return start, start + info.length
+
+    def postings(self, info):
+        start, end = self.span(info)
+        if self.binary:
+            # Decode straight from the mapped bytes, without copying them first
+            return decode_postings(self.view[start:end])
+        return parse_postings(self.buffer[start:end])
+
+    # The term's postings whose doc IDs are among the sorted `candidates`, decoding only the
+    # blocks the skip entries locate them in (files with skip entries only)
+    def find(self, info, candidates):
+        num_skips = (info.df - 1) // POSTINGS_SKIP
+        table = info.offset + info.length
+        first_ids = self.view[table:table + 8 * num_skips].cast('q')
+        block_offsets = self.view[table + 8 * num_skips:table + 12 * num_skips].cast('I')
+        found = []
+        block = None
+        cursor = 0
+        for doc_id in candidates:
+            # Blocks before `next_block` start at or before doc_id; it is in the last of them
+            next_block = gallop(first_ids, doc_id + 1, block or 0)
+            if next_block != block:
+                block = next_block
+                start = info.offset + (block_offsets[block - 1] if block else 0)
+                end = info.offset + block_offsets[block] if block < num_skips else table
+                numbers = vb_decode(self.view[start:end])
+                base = first_ids[block - 1] - numbers[0] if block else 0
+                doc_ids = list(accumulate(numbers[0::2], initial=base))[1:]
+                tfs = numbers[1::2]
+                cursor = 0
+            cursor = gallop(doc_ids, doc_id, cursor)
+            if cursor < len(doc_ids) and doc_ids[cursor] == doc_id:
+                found.append((doc_id, tfs[cursor]))
+        return found
+
+    def close(self):
+        self.view.release()
+        self.buffer.close()
+
+class PostingsReader:
+    """
+    Reads postings lists of an index: from its postings file, or for terms with entries in
+    several segments, from each segment's file merged in doc ID order. Segment files are
+    opened the first time one of their postings lists is read. Decoded lists go through
+    `postings_cache`, so they are shared and must not be modified.
+    """
+
+    def __init__(self, postings_file):
+        self.postings_file = postings_file
+        self.files = {0: PostingsFile(postings_file)}
+        stat = os.stat(postings_file)
+        self.identity = (os.path.abspath(postings_file), stat.st_size, stat.st_mtime_ns)
+
+    def segment(self, number):
+        if number not in self.files:
+            self.files[number] = PostingsFile(segment_files(self.postings_file, number)[1])
+        return self.files[number]
+
+    def postings(self, info):
+        return postings_cache.get((self.identity, info), lambda: self.read(info))
+
+    # The term's decoded postings and the number of bytes they were decoded from
+    def read(self, info):
+        if info.parts is None:
+            start, end = self.files[0].span(info)
+            return self.files[0].postings(info), end - start
+        num_bytes = sum(end - start for start, end in
+                        (self.segment(number).span(part) for number, part in info.parts))
+        if len(info.parts) == 1:
+            number, part = info.parts[0]
+            return self.segment(number).postings(part), num_bytes
+        return list(heapq.merge(*(self.segment(number).postings(part) for number, part in info.parts))), num_bytes
+
+    # The term's postings among the sorted doc IDs `candidates`, found through the skip
+    # entries (see PostingsFile.find), or None if its list has none to find them with
+    def find(self, info, candidates):
+        if info.parts is None:
+            postings_file, part = self.files[0], info
+        elif len(info.parts) == 1:
+            number, part = info.parts[0]
+            postings_file = self.segment(number)
+        else:
+            return None
+        return postings_file.find(part, candidates) if postings_file.skips else None
+
+    def close(self):
+        for postings_file in self.files.values():
+            postings_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,594 @@
+#!/usr/bin/python3
+import re
+import math
+import heapq
+from collections import namedtuple, defaultdict
+from bisect import bisect_left, bisect_right
+from itertools import compress
+from text_analysis import analyze
+from postings import open_positions, CompactDictionary, gallop, POSTINGS_SKIP
+
+# Query evaluation strategies shared by the search scripts.
+
+# Top-K retrieval with MaxScore ##########################################################
+#
+# A document's score is a sum of one contribution per (query term, zone) postings list:
+#   query_weight * (1 + log10(tf)) / zone_length * zone_weight
+# and the dictionary stores, for every term, the largest (1 + log10(tf)) / zone_length over
+# its postings. That gives an upper bound on what each list can add to any document.
+#
+# Lists are sorted by upper bound. Once the heap holds K documents, the lists whose bounds
+# add up to at most the K-th best score are "non-essential": a document found only in them
+# cannot enter the top K. Candidates are therefore only taken from the essential lists, and
+# the non-essential lists are only probed (by binary search) while the candidate can still
+# beat the K-th best score.
+
+# Relative slack on the pruning test, so float rounding never prunes a qualifying document
+PRUNING_SLACK = 1e-9
+
+class ScoredList:
+    """ One (query term, zone) postings list with its cursor and score upper bound """
+
+    def __init__(self, position, zone, query_weight, postings, upper_bound, zone_weight, zone_lengths):
+        self.position = position  # index of the list in scoring order
+        self.zone = zone
+        self.zone_lengths = zone_lengths  # zone length by dense doc index
+        self.query_weight = query_weight
+        self.weight = query_weight * zone_weight
+        self.doc_ids = [doc_id for doc_id, _tf in postings]
+        self.tfs = [tf for _doc_id, tf in postings]
+        self.upper_bound = upper_bound
+        self.cursor = 0
+        self.current = self.doc_ids[0]
+
+    def advance(self):
+        self.cursor += 1
+        self.current = self.doc_ids[self.cursor] if self.cursor < len(self.doc_ids) else math.inf
+
+    # Move the cursor to the first posting >= doc_id and return its tf if it is doc_id
+    def seek(self, doc_id):
+        self.cursor = bisect_left(self.doc_ids, doc_id, self.cursor)
+        if self.cursor < len(self.doc_ids):
+            self.current = self.doc_ids[self.cursor]
+            if self.current == doc_id:
+                return self.tfs[self.cursor]
+        else:
+            self.current = math.inf
+        return None
+
+    # Normalized contribution of a posting of this list to the score of the document with
+    # dense index `doc_index`
+    def contribution(self, tf, doc_index):
+        return self.weight * (1 + math.log10(tf)) / self.zone_lengths[doc_index]
+
+def maxscore_top_k(zone_postings, doc_lengths, title_weight, k, boosts=None):
+    """
+    Return the top `k` documents for (zone, query_weight, postings, max_weight) lists given
+    in scoring order, best first. Scores are identical to exhaustive scoring, including the
+    doc_id -> multiplier `boosts`; documents with equal scores are ordered by doc ID.
+    """
+    boosts = boosts or {}
+    max_boost = max(boosts.values(), default=1.0)
+    zone_weights = {'content': 1.0, 'title': title_weight}
+    doc_indices = doc_lengths.doc_indices
+    lists = []
+    for position, (zone, query_weight, postings, max_weight) in enumerate(zone_postings):
+        if not postings:
+            continue
+        zone_lengths = doc_lengths.lengths[zone]
+        if max_weight is None:
+            max_weight = max((1 + math.log10(tf)) / zone_lengths[doc_indices[doc_id]] for doc_id, tf in postings)
+        upper_bound = query_weight * max_weight * zone_weights[zone] * (1 + PRUNING_SLACK)
+        lists.append(ScoredList(position, zone, query_weight, postings, upper_bound, zone_weights[zone], zone_lengths))
+    lists.sort(key=lambda scored_list: scored_list.upper_bound)
+
+    # bound_prefix[i]: sum of the upper bounds of lists[0..i], times the largest boost
+    bound_prefix = []
+    for scored_list in lists:
+        bound_prefix.append((bound_prefix[-1] if bound_prefix else 0) + scored_list.upper_bound * max_boost)
+
+    heap = []  # (score, -doc_id) of the best documents so far
+    threshold = -math.inf
+    first_essential = 0
+    essential = lists
+
+    while True:
+        doc_id = min((scored_list.current for scored_list in essential), default=math.inf)
+        if doc_id == math.inf:
+            break
+
+        # Score from the essential lists, then probe the non-essential lists from the
+        # largest bound down while the document can still make it into the top K
+        matches = []  # (list, tf) of the lists containing doc_id
+        doc_index = doc_indices[doc_id]
+        boost = boosts.get(doc_id, 1.0)
+        estimate = 0.0
+        for scored_list in essential:
+            if scored_list.current == doc_id:
+                tf = scored_list.tfs[scored_list.cursor]
+                matches.append((scored_list, tf))
+                estimate += scored_list.contribution(tf, doc_index) * boost
+                scored_list.advance()
+
+        pruned = False
+        for i in range(first_essential - 1, -1, -1):
+            if (estimate + bound_prefix[i]) * (1 + PRUNING_SLACK) <= threshold:
+                pruned = True
+                break
+            tf = lists[i].seek(doc_id)
+            if tf is not None:
+                matches.append((lists[i], tf))
+                estimate += lists[i].contribution(tf, doc_index) * boost
+        if pruned or estimate * (1 + PRUNING_SLACK) < threshold:
+            continue
+
+        score = exact_score(matches, doc_index, doc_lengths, title_weight) * boost
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -doc_id))
+        elif (score, -doc_id) > heap[0]:
+            heapq.heapreplace(heap, (score, -doc_id))
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while first_essential < len(lists) and bound_prefix[first_essential] <= threshold:
+                first_essential += 1
+            essential = lists[first_essential:]
+
+    return [-neg_doc_id for _score, neg_doc_id in sorted(heap, reverse=True)]
+
+# Score a document exactly as exhaustive scoring does: per-zone dot products summed in
+# scoring order, normalized by zone length, title zone added first
+def exact_score(matches, doc_index, doc_lengths, title_weight):
+    dot_products = {}
+    for scored_list, tf in sorted(matches, key=lambda match: match[0].position):
+        dot_products[scored_list.zone] = (dot_products.get(scored_list.zone, 0.0)
+                                          + scored_list.query_weight * (1 + math.log10(tf)))
+    score = 0.0
+    if 'title' in dot_products:
+        score += dot_products['title'] / doc_lengths.lengths['title'][doc_index] * title_weight
+    if 'content' in dot_products:
+        score += dot_products['content'] / doc_lengths.lengths['content'][doc_index]
+    return score
+
+# Phrase queries ##########################################################################
+#
+# A quoted phrase matches a zone of a document that holds its terms at consecutive
+# positions (see the positional index in postings.py). The postings lists of the phrase's
+# terms are intersected from the shortest up: each document of the shortest list is
+# searched for in the longer lists by galloping forward from the previous match, so the
+# work follows the rarest term, and positions are only decoded for documents found in every
+# list. Documents matching a phrase have their score multiplied by 1 + PHRASE_BOOST for
+# every matched phrase.
+
+PHRASE_BOOST = 0.5
+
+QUOTED_PHRASE = re.compile(r'"([^"]*)"')
+
+def phrase_frequencies(terms, zone, dictionary, reader, positions):
+    """
+    Number of occurrences of the phrase of analyzed `terms` in the zone ('C' or 'T') of
+    every document holding it
+    """
+    keys = [f"{zone}:{term}" for term in terms]
+    if any(key not in dictionary or key not in positions.dictionary for key in keys):
+        return {}
+    doc_lists = [[doc_id for doc_id, _tf in reader.postings(dictionary[key])] for key in keys]
+    position_infos = [positions.dictionary[key] for key in keys]
+    order = sorted(range(len(keys)), key=lambda j: len(doc_lists[j]))
+    shortest, others = order[0], order[1:]
+    cursors = [0] * len(keys)
+
+    frequencies = {}
+    for i, doc_id in enumerate(doc_lists[shortest]):
+        cursors[shortest] = i
+        for j in others:
+            cursors[j] = gallop(doc_lists[j], doc_id, cursors[j])
+            if cursors[j] == len(doc_lists[j]):
+                return frequencies  # no later document can hold the whole phrase
+            if doc_lists[j][cursors[j]] != doc_id:
+                break
+        else:
+            # Phrase start positions that every term agrees with, rarest term first
+            starts = None
+            for j in order:
+                shifted = {position - j for position in positions.positions(position_infos[j], cursors[j])}
+                starts = shifted if starts is None else starts & shifted
+                if not starts:
+                    break
+            if starts:
+                frequencies[doc_id] = len(starts)
+    return frequencies
+
+def phrase_boosts(query, dictionary, reader, postings_file):
+    """
+    Score multiplier of every document matching a quoted phrase of the raw query in its
+    content or title. Empty without phrases, or if the index has no positional index.
+    """
+    phrases = [terms for terms in (list(analyze(phrase)) for phrase in QUOTED_PHRASE.findall(query))
+               if len(terms) > 1]
+    positions = open_positions(postings_file) if phrases else None
+    if positions is None:
+        return {}
+    boosts = {}
+    with positions:
+        for terms in phrases:
+            matches = set(phrase_frequencies(terms, 'C', dictionary, reader, positions))
+            matches.update(phrase_frequencies(terms, 'T', dictionary, reader, positions))
+            for doc_id in matches:
+                boosts[doc_id] = boosts.get(doc_id, 1.0) + PHRASE_BOOST
+    return boosts
+
+# Conjunctive queries #####################################################################
+#
+# A query with AND between its parts only matches the documents holding every term of
+# every part, in their content or title. The terms are intersected smallest df first: the
+# documents of the rarest term are the candidates, and every other term's lists are
+# searched for them. A list much longer than the candidates is probed through the skip
+# entries of binary postings (see POSTINGS_SKIP in postings.py), decoding only the blocks
+# that can hold a candidate, so the cost follows the rarest term rather than the sum of
+# the dfs. Other lists, and text ones, are decoded in full and searched by galloping
+# forward from the previous match. Lists are only read while candidates remain, so a query
+# without matches stops after its rarest terms. A gallop is a few Python steps per
+# candidate, so against a list less than GALLOP_RATIO times longer than the candidates a
+# set of the list is looked up instead.
+
+AND_OPERATOR = re.compile(r'\s+AND\s+')
+
+GALLOP_RATIO = 16
+
+def conjunctive_terms(query):
+    """ Analyzed terms of the raw query every result must hold, or None if it has no AND """
+    parts = AND_OPERATOR.split(query)
+    if len(parts) < 2:
+        return None
+    return {term for part in parts for term in analyze(part.replace('"', ''))}
+
+# Indices in the sorted doc_ids of the doc IDs that are among the sorted candidates
+def found_indices(candidates, doc_ids):
+    if len(candidates) * GALLOP_RATIO >= len(doc_ids):
+        candidate_set = set(candidates)
+        return [i for i, doc_id in enumerate(doc_ids) if doc_id in candidate_set]
+    found = []
+    cursor = 0
+    for doc_id in candidates:
+        cursor = gallop(doc_ids, doc_id, cursor)
+        if cursor == len(doc_ids):
+            break
+        if doc_ids[cursor] == doc_id:
+            found.append(cursor)
+    return found
+
+def intersect(term_lists):
+    """
+    Sorted doc IDs found in every entry of `term_lists`, each a (size, match) pair of one
+    term: match(candidates) returns the sorted doc IDs among the candidates that hold the
+    term, or all of them for None. Terms are matched smallest size first, and only while
+    candidates remain
+    """
+    candidates = None
+    for _size, match in sorted(term_lists, key=lambda entry: entry[0]):
+        candidates = match(candidates)
+        if not candidates:
+            break
+    return candidates or []
+
+class ConjunctiveFilter:
+    """
+    The documents matching an AND query, and among the sorted doc IDs `allowed` if given,
+    with the postings read to find them kept so the scoring loop does not read them twice
+    """
+
+    def __init__(self, terms, dictionary, reader, allowed=None):
+        self.decoded = {}  # key -> (postings, doc IDs)
+        self.found = {}  # key -> postings among the candidates it was matched against
+        term_lists = []
+        for term in terms:
+            keys = [key for key in (f"C:{term}", f"T:{term}") if key in dictionary]
+            size = sum(dictionary[key].df for key in keys)
+            term_lists.append((size, lambda candidates, keys=keys: self.match_term(keys, dictionary, reader, candidates)))
+        if allowed is not None:
+            term_lists.append((len(allowed), lambda candidates: allowed if candidates is None else
+                               [allowed[i] for i in found_indices(candidates, allowed)]))
+        self.doc_ids = intersect(term_lists)
+
+    # Sorted doc IDs among the candidates (all for None) in any of the keys' lists
+    def match_term(self, keys, dictionary, reader, candidates):
+        if candidates is None:
+            return sorted(set().union(*(self.decode(key, dictionary[key], reader)[1] for key in keys)))
+        found = []
+        for key in keys:
+            self.found[key] = self.match(key, dictionary[key], reader, candidates)
+            found.append([doc_id for doc_id, _tf in self.found[key]])
+        return found[0] if len(found) == 1 else sorted(set().union(*found))
+
+    # Postings and sorted doc IDs of `key`, decoded once
+    def decode(self, key, info, reader):
+        if key not in self.decoded:
+            postings = reader.postings(info)
+            self.decoded[key] = (postings, [doc_id for doc_id, _tf in postings])
+        return self.decoded[key]
+
+    # The postings of `key` among the sorted candidates: probed through the skip entries if
+    # a candidate per block costs less than decoding the list, else from the whole list
+    def match(self, key, info, reader, candidates):
+        if key not in self.decoded and len(candidates) * POSTINGS_SKIP < info.df:
+            found = reader.find(info, candidates)
+            if found is not None:
+                return found
+        postings, doc_ids = self.decode(key, info, reader)
+        return [postings[i] for i in found_indices(candidates, doc_ids)]
+
+    # The postings of `key` restricted to the matching documents
+    def postings(self, key, info, reader):
+        if key not in self.found:
+            return self.match(key, info, reader, self.doc_ids)
+        found = self.found[key]
+        return [found[i] for i in found_indices(self.doc_ids, [doc_id for doc_id, _tf in found])]
+
+# Court and date filters ##################################################################
+#
+# A query can be restricted to judgments of some courts and dates:
+#   court:appeal  court:"High Court"             court names, matched by their terms
+#   date:2014  date:2010-01..2012-06-30  date:..1999  date:2015..   dates or date ranges
+# A court filter matches the documents holding every term of the name in their COURT:
+# postings, a date filter the documents of any DATE: key in the range. Filters of the same
+# kind are alternatives, and a document has to pass both kinds when both are given.
+#
+# The dates are ISO strings, so they sort chronologically, and a date range is a range
+# scan over the sorted DATE: keys (DateIndex) with a bound given as a prefix covering all
+# the dates starting with it. Each filter is a bitmap over the dense doc indices of the
+# length table, combined bitwise, and the result becomes the sorted doc IDs that every
+# postings list is intersected with (ConjunctiveFilter) before scoring.
+
+FILTER = re.compile(r'\b(court|date):(?:"([^"]*)"|(\S+))', re.I)
+DATE_RANGE = re.compile(r'([\d-]*)\.\.([\d-]*)')
+
+# Sorts after any character of a date, so prefix + DATE_UPPER bounds all dates with it
+DATE_UPPER = '\uffff'
+
+class DateIndex:
+    """ The dates of a dictionary's DATE: keys in sorted order, for range scans """
+
+    PREFIX = 'DATE:'
+
+    def __init__(self, dictionary):
+        if isinstance(dictionary, CompactDictionary):
+            # The keys are stored sorted, so the DATE: keys are one block found by bisection
+            prefix = self.PREFIX.encode('utf-8')
+            positions = range(len(dictionary))
+            start = bisect_left(positions, prefix, key=dictionary.key_bytes)
+            end = bisect_left(positions, prefix[:-1] + bytes([prefix[-1] + 1]), key=dictionary.key_bytes)
+            self.dates = [dictionary.key_bytes(i)[len(prefix):].decode('utf-8') for i in range(start, end)]
+        else:
+            self.dates = sorted(key[len(self.PREFIX):] for key in dictionary if key.startswith(self.PREFIX))
+
+    # DATE: keys of the dates from `first` to `last`, either a prefix of a date or None
+    def keys(self, first=None, last=None):
+        start = bisect_left(self.dates, first) if first else 0
+        end = bisect_right(self.dates, last + DATE_UPPER) if last else len(self.dates)
+        return [self.PREFIX + date for date in self.dates[start:end]]
+
+class QueryFilters:
+    """ Court names and (first, last) date ranges a query is restricted to """
+
+    def __init__(self, courts=(), date_ranges=()):
+        self.courts = list(courts)
+        self.date_ranges = list(date_ranges)
+
+    def __bool__(self):
+        return bool(self.courts or self.date_ranges)
+
+    def allowed(self, dictionary, reader, doc_lengths, date_index=None):
+        """ Sorted doc IDs of the documents passing the filters """
+        doc_indices = doc_lengths.doc_indices
+        num_docs = doc_lengths.num_docs
+
+        # Bitmap of the documents of the postings lists of `keys`
+        def bitmap(keys):
+            bits = bytearray(num_docs)
+            for key in keys:
+                if key in dictionary:
+                    for doc_id, _tf in reader.postings(dictionary[key]):
+                        bits[doc_indices[doc_id]] = 1
+            return int.from_bytes(bits, 'little')
+
+        passing = -1  # every document
+        if self.courts:
+            courts = 0
+            for court in self.courts:
+                matches = -1
+                for term in set(analyze(court)):
+                    matches &= bitmap([f"COURT:{term}"])
+                courts |= matches if matches != -1 else 0
+            passing &= courts
+        if self.date_ranges:
+            date_index = date_index or DateIndex(dictionary)
+            passing &= bitmap(key for first, last in self.date_ranges for key in date_index.keys(first, last))
+        if passing == -1:
+            return list(doc_lengths.doc_ids)
+        return list(compress(doc_lengths.doc_ids, passing.to_bytes(num_docs, 'little')))
+
+def parse_filters(query):
+    """ Split the court: and date: filters off the raw query: (rest of the query, QueryFilters) """
+    filters = QueryFilters()
+    for match in FILTER.finditer(query):
+        kind, value = match.group(1).lower(), match.group(2) or match.group(3)
+        if kind == 'court':
+            filters.courts.append(value)
+        elif date_range := DATE_RANGE.fullmatch(value):
+            filters.date_ranges.append((date_range.group(1) or None, date_range.group(2) or None))
+        else:
+            filters.date_ranges.append((value, value))
+    return FILTER.sub(' ', query).strip(), filters
+
+# Score-at-a-time ranking #################################################################
+#
+# With an impact index (index.py -I), a posting's contribution is the query weight of its
+# (term, zone) list times the precomputed weight of its group, the same for every posting
+# of the group, so scoring is one addition per posting. Groups of all lists are processed
+# by decreasing contribution, best first. What the unprocessed groups can still add to any
+# document is at most the sum of the contributions of each list's next group; for the top
+# K, traversal stops once that bound cannot lift any other document above the K-th best
+# score. The K documents are then scored with the rest of the groups, looked up for them
+# only, and ranked by their full scores, so the results are those of a full traversal.
+# Checking the stop condition takes a pass over the accumulated scores, so it is only
+# checked after as many postings as there are scores have been added since the last check.
+# Many documents have close scores, so the bound rarely gets below the gap between the
+# K-th and the next score before most postings are added. A postings budget instead stops
+# traversal after that many postings, wherever it is: the top K are then the best
+# documents of the best-weighted postings, ranked by their full scores, but may differ
+# from the exact top K.
+
+def score_at_a_time(lists, k=None, boosts=None, allowed=None, max_postings=None):
+    """
+    Rank documents from (query weight, weight groups) lists of an impact index, best
+    first: all of them, or with `k` the top k, documents with equal scores ordered by doc
+    ID. Scores are multiplied by the doc_id -> multiplier `boosts`, and only documents in
+    the set `allowed`, if given, are scored. With `k`, traversal stops early after
+    `max_postings` postings if given.
+    """
+    boosts = boosts or {}
+    max_boost = max(boosts.values(), default=1.0)
+    scores = {}
+    # (-contribution, list, group) of the next group of every list
+    queue = [(-query_weight * groups[0][0], i, 0) for i, (query_weight, groups) in enumerate(lists) if groups]
+    heapq.heapify(queue)
+    remaining = -sum(contribution for contribution, _i, _j in queue)
+    next_check = 0
+    added = 0
+    while queue:
+        contribution, i, j = heapq.heappop(queue)
+        contribution = -contribution
+        query_weight, groups = lists[i]
+        doc_ids = groups[j][1] if allowed is None else allowed.intersection(groups[j][1])
+        for doc_id in doc_ids:
+            scores[doc_id] = scores.get(doc_id, 0.0) + contribution
+        added += len(doc_ids)
+        remaining -= contribution
+        if j + 1 < len(groups):
+            heapq.heappush(queue, (-query_weight * groups[j + 1][0], i, j + 1))
+            remaining += query_weight * groups[j + 1][0]
+
+        if k and max_postings and added >= max_postings:
+            break
+        if k and queue and added >= next_check:
+            next_check = added + len(scores)
+            boosted = (score * boosts.get(doc_id, 1.0) for doc_id, score in scores.items()) if boosts else scores.values()
+            best = heapq.nlargest(k + 1, boosted)
+            if len(best) > k and best[k - 1] > (best[k] + remaining * max_boost) * (1 + PRUNING_SLACK):
+                break
+
+    if k and queue:
+        # Finish the scores of the top k only
+        top = set(heapq.nlargest(k, scores, key=lambda doc_id: scores[doc_id] * boosts.get(doc_id, 1.0))
+                  if boosts else heapq.nlargest(k, scores, key=scores.get))
+        for _contribution, i, j in queue:
+            query_weight, groups = lists[i]
+            for weight, doc_ids in groups[j:]:
+                for doc_id in top.intersection(doc_ids):
+                    scores[doc_id] += query_weight * weight
+        scores = {doc_id: scores[doc_id] for doc_id in top}
+
+    for doc_id, boost in boosts.items():
+        if doc_id in scores:
+            scores[doc_id] *= boost
+    if k:
+        # Documents tied with the k-th best score are ordered by doc ID
+        kth_score = min(heapq.nlargest(k, scores.values()), default=0.0)
+        best = sorted(doc_id for doc_id, score in scores.items() if score >= kth_score)
+        return sorted(best, key=scores.get, reverse=True)[:k]
+    return sorted(scores, key=scores.get, reverse=True)
+
+# Term pruning ############################################################################
+#
+# Punctuation tokens (C:, C:. C:( ...) and terms found in every document have the longest
+# postings lists of the index and add little or nothing to a ranking: a term in every one
+# of the documents the idf counts has an idf of log10(N / N) = 0. With PRUNE_TERMS set, the
+# search scripts leave both out of scoring, unless the query has nothing else. A term is
+# only left out as a whole, when it is noise in every zone it is found in, and `total_docs`
+# must be the document count the script's idf uses.
+
+def is_noise_term(term, dictionary, total_docs, zones=('C', 'T')):
+    """ Whether a query term is punctuation, or in all `total_docs` documents in each of its zones """
+    if not any(char.isalnum() for char in term):
+        return True
+    infos = [dictionary[f"{zone}:{term}"] for zone in zones if f"{zone}:{term}" in dictionary]
+    return bool(infos) and all(info.df >= total_docs for info in infos)
+
+def prune_terms(terms, dictionary, total_docs, zones=('C', 'T')):
+    """ The query terms that are not noise, or all of them if every one is """
+    return [term for term in terms if not is_noise_term(term, dictionary, total_docs, zones)] or list(terms)
+
+# Tiered top-K ############################################################################
+#
+# With a tiered index (index.py -T), a top-K query is first scored from the tier-1 postings
+# of its lists alone, the best-weighted ones. A list's tail can add at most its query
+# weight times the largest weight in the tail to any document, so a document found in no
+# tier-1 list scores at most the sum of these tail bounds. If the K-th best tier-1 score is
+# above it, the top K are among the documents found in tier 1 whose tier-1 score plus the
+# tail bounds reaches the K-th best tier-1 score: only those candidates are looked up in
+# the tails, by binary search, and ranked by their exact scores. Otherwise, or when there
+# are more than TIER_CANDIDATES * K candidates, the tiers cannot answer cheaply and the
+# query is scored from the full postings lists.
+# The sum of the tail bounds is rarely below the K-th score of a query with several common
+# terms, so tier 1 alone answers few of them. `approximate` instead trusts tier 1 whenever
+# it holds K documents: the TIER_CANDIDATES * K best of them by tier-1 score are looked up
+# in the tails and ranked, so documents that only score well in the tails can be missed.
+
+TIER_CANDIDATES = 8
+
+# A (term, zone) list, as exact_score reads it
+TierList = namedtuple('TierList', ['position', 'zone', 'query_weight'])
+
+def tiered_top_k(tier_lists, doc_lengths, title_weight, k, boosts=None, approximate=False):
+    """
+    The top `k` documents for (zone, query_weight, tier-1 postings, tail bound, tail) lists
+    given in scoring order, or None if they need the full lists. Scores are identical to
+    exhaustive scoring, including the doc_id -> multiplier `boosts`; documents with equal
+    scores are ordered by doc ID. With `approximate`, the documents may differ.
+    """
+    boosts = boosts or {}
+    max_boost = max(boosts.values(), default=1.0)
+    zone_weights = {'content': 1.0, 'title': title_weight}
+    doc_indices = doc_lengths.doc_indices
+    matches = defaultdict(list)  # doc_id -> [(TierList, tf)] of the tier-1 postings
+    estimates = defaultdict(float)
+    tails = []  # (TierList, tail doc IDs, tail tfs) of the lists with a tail
+    tail_bound = 0.0
+    for position, (zone, query_weight, postings, max_tail_weight, tail) in enumerate(tier_lists):
+        tier_list = TierList(position, zone, query_weight)
+        weight = query_weight * zone_weights[zone]
+        zone_lengths = doc_lengths.lengths[zone]
+        for doc_id, tf in postings:
+            matches[doc_id].append((tier_list, tf))
+            estimates[doc_id] += weight * (1 + math.log10(tf)) / zone_lengths[doc_indices[doc_id]]
+        if len(tail[0]):
+            tails.append((tier_list, *tail))
+            tail_bound += weight * max_tail_weight
+    tail_bound *= max_boost * (1 + PRUNING_SLACK)
+
+    for doc_id, boost in boosts.items():
+        if doc_id in estimates:
+            estimates[doc_id] *= boost
+    if not tails:
+        candidates = estimates
+    else:
+        best = heapq.nlargest(k, estimates.values())
+        if len(best) < k or (best[-1] <= tail_bound and not approximate):
+            return None
+        if approximate:
+            candidates = heapq.nlargest(TIER_CANDIDATES * k, estimates, key=estimates.get)
+        else:
+            threshold = best[-1] * (1 - PRUNING_SLACK) - tail_bound
+            candidates = [doc_id for doc_id, estimate in estimates.items() if estimate >= threshold]
+            if len(candidates) > TIER_CANDIDATES * k:
+                return None
+
+    scores = {}
+    for doc_id in candidates:
+        doc_matches = matches[doc_id]
+        for tier_list, doc_ids, tfs in tails:
+            i = bisect_left(doc_ids, doc_id)
+            if i < len(doc_ids) and doc_ids[i] == doc_id:
+                doc_matches.append((tier_list, tfs[i]))
+        scores[doc_id] = exact_score(doc_matches, doc_indices[doc_id], doc_lengths, title_weight) * boosts.get(doc_id, 1.0)
+    return heapq.nsmallest(k, scores, key=lambda doc_id: (-scores[doc_id], doc_id))
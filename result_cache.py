@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+import os
+import pickle
+from collections import OrderedDict
+from postings import (side_file, SEGMENTS_EXTENSION, POSITIONS_EXTENSION, SYNONYMS_EXTENSION, IMPACTS_EXTENSION,
+                      TIERS_EXTENSION)
+
+# Cache of ranked results shared by the search scripts, for batches and servers that see
+# the same queries again.
+#
+# Entries are keyed by the query as the script's ranking sees it, built by each script:
+# its scoring settings (title weight, output cutoff, expansion mode, ...) and the multiset
+# of stemmed query terms, with the phrases, ANDs and filters the script applies, so
+# queries that only differ in case, spacing, word order or inflection share an entry. The
+# least recently used entry is evicted once RESULT_CACHE_SIZE entries are held.
+#
+# Results are only valid for the index they were computed on, so the cache records the
+# size and modification time of the index files (dictionary, postings, segments manifest
+# and the side files that change rankings) and empties itself when any of them changes.
+# With a cache file (-c in the scripts), the entries are read at start, if they were
+# computed on the same index, and written back when the script ends.
+
+RESULT_CACHE_SIZE = 1024
+
+# Side files of the postings file whose changes alter rankings
+INDEX_EXTENSIONS = (SEGMENTS_EXTENSION, POSITIONS_EXTENSION, SYNONYMS_EXTENSION, IMPACTS_EXTENSION, TIERS_EXTENSION)
+
+def index_files(dict_file, postings_file):
+    return [dict_file, postings_file] + [side_file(postings_file, extension) for extension in INDEX_EXTENSIONS]
+
+class ResultCache:
+    """ LRU cache of ranked results, emptied when the index files change """
+
+    def __init__(self, files, max_size=RESULT_CACHE_SIZE, cache_file=None):
+        self.files = files
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self.fingerprint = self.index_fingerprint()
+        if cache_file and os.path.exists(cache_file):
+            self.load()
+
+    # (size, modification time) of every index file, None for missing ones
+    def index_fingerprint(self):
+        fingerprint = []
+        for path in self.files:
+            try:
+                stat = os.stat(path)
+                fingerprint.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    # Drop every entry if the index changed since they were computed
+    def check_index(self):
+        fingerprint = self.index_fingerprint()
+        if fingerprint != self.fingerprint:
+            if self.entries:
+                self.invalidations += 1
+                self.entries.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, key, search):
+        """ Cached results of the query with `key`, computed by search() on a miss """
+        self.check_index()
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        results = search()
+        self.entries[key] = results
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return results
+
+    def load(self):
+        with open(self.cache_file, 'rb') as file:
+            fingerprint, entries = pickle.load(file)
+        if fingerprint == self.fingerprint:
+            self.entries = OrderedDict(list(entries.items())[-self.max_size:])
+
+    def save(self):
+        """ Write the entries to the cache file, if there is one """
+        if not self.cache_file:
+            return
+        self.check_index()
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'wb') as file:
+            pickle.dump((self.fingerprint, self.entries), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, self.cache_file)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return (f"result cache: {self.hits} hits, {self.misses} misses"
+                f" ({100 * self.hits / lookups if lookups else 0:.1f}% hit rate), {len(self.entries)} queries cached,"
+                f" {self.evictions} evicted, {self.invalidations} invalidations")
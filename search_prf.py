@@ -1,15 +1,16 @@
 #!/usr/bin/python3
 import re
-import nltk
+import os
 import sys
 import getopt
 import math
-import unicodedata
 from collections import defaultdict, Counter
+from postings import load_dictionary, load_doc_lengths, load_tokenizer, PostingsReader, ForwardIndexReader, load_manifest, side_file, FORWARD_EXTENSION, postings_cache
+from batch import run_batch
+from query_eval import prune_terms
+from result_cache import ResultCache, index_files
 
-from nltk.stem import PorterStemmer
-from nltk.tokenize import sent_tokenize, word_tokenize
-stemmer = PorterStemmer()
+from text_analysis import analyze, set_tokenizer
 
 # Settings (Number of)
 
@@ -19,92 +20,109 @@ EXPAND_TERMS = 10    # expansion terms to add
 
 TITLE_WT = 5.0       # Title weighting factor
 
+PRUNE_TERMS = False  # leave punctuation and terms of every document out of scoring
+
 def usage():
-    print("usage: {} -d dictionary-file -p postings-file -q file-of-query -o output-file".format(sys.argv[0]))
-
-def load_dictionary(dict_file):
-    dictionary = {}
-    with open(dict_file, 'r', encoding="utf8") as file:
-        for line in file:
-            term, offset, df = line.strip().split()
-            dictionary[term] = (int(offset), int(df))
-    return dictionary
-
-def load_doc_lengths(postings_file):
-    doc_lengths = {}
-    with open(postings_file, 'r', encoding="utf8") as file:
-        for line in file:
-            parts = line.strip().split()
-            if parts[0] in ('LC', 'LT'):
-                field = 'content' if parts[0]=='LC' else 'title'
-                docID, length = int(parts[1]), float(parts[2])
-                doc_lengths[(docID, field)] = length
-            else:
-                break
-    return doc_lengths
-
-def get_postings_list(p_file, offset):
-    p_file.seek(offset)
-    postings = p_file.readline().strip().split()
-    return [(int(p.split(':')[0]), int(p.split(':')[1])) for p in postings]
+    print("usage: {} -d dictionary-file -p postings-file -q file-of-query -o output-file [-b] [-c cache-file]".format(sys.argv[0]))
 
 def preprocess(query):
     query = query.replace('"','').replace(' AND ', ' ')
-    query = unicodedata.normalize('NFKD', query)
-    tokens = []
-    for sent in sent_tokenize(query):
-        tokens.extend([stemmer.stem(t.lower()) for t in word_tokenize(sent)])
-    return tokens
+    return list(analyze(query))
 
 def compute_scores(query_terms, dictionary, postings_file, doc_lengths, total_docs):
     tf_q = Counter(query_terms)
     # term weights in query
-    wq = {t: (1+math.log10(tf_q[t])) * math.log10(total_docs/dictionary[f"C:{t}"][1])
+    wq = {t: (1+math.log10(tf_q[t])) * math.log10(total_docs/dictionary[f"C:{t}"].df)
           for t in tf_q if f"C:{t}" in dictionary}
 
     content_scores = defaultdict(float)
     title_scores = defaultdict(float)
-    with open(postings_file,'r',encoding="utf8") as pf:
+    with PostingsReader(postings_file) as reader:
         for term, qw in wq.items():
             for zone in ('C', 'T'):
                 key = f"{zone}:{term}"
                 if key not in dictionary: continue
-                offset, df = dictionary[key]
-                postings = get_postings_list(pf, offset)
-                idf = math.log10(total_docs/df)
+                info = dictionary[key]
+                postings = reader.postings(info)
+                idf = math.log10(total_docs/info.df)
                 for docID, tf in postings:
                     wt = (1+math.log10(tf))*idf
                     if zone=='C': content_scores[docID] += wq[term]*wt
                     else: title_scores[docID] += wq[term]*wt
     scores = {}
+    doc_index = doc_lengths.doc_indices
+    content_lengths, title_lengths = doc_lengths.lengths['content'], doc_lengths.lengths['title']
     for d, sc in content_scores.items():
-        scores[d] = sc / doc_lengths[(d,'content')]
+        scores[d] = sc / content_lengths[doc_index[d]]
     for d, st in title_scores.items():
-        scores[d] = scores.get(d,0) + (st/ doc_lengths[(d,'title')])*TITLE_WT
+        scores[d] = scores.get(d,0) + (st/ title_lengths[doc_index[d]])*TITLE_WT
     return scores
 
-def expand_query(orig_terms, top_docs, dictionary, postings_file, doc_lengths, total_docs):
-    term_scores = defaultdict(float)
-    # for each doc in top k, accumulate term*idf
-    with open(postings_file,'r',encoding="utf8") as pf:
-        for key,(offset,df) in dictionary.items():
-            if not key.startswith('C:'): continue
-            term = key.split(':',1)[1]
-            postings = get_postings_list(pf, offset)
-            idf = math.log10(total_docs/df)
-            for docID, tf in postings:
-                if docID in top_docs:
-                    term_scores[term] += tf * idf
+def expand_query(orig_terms, top_docs, dictionary, postings_file, doc_lengths, total_docs, forward=None):
+    if forward:
+        term_scores = forward_term_scores(top_docs, dictionary, total_docs, *forward)
+    else:
+        term_scores = defaultdict(float)
+        # for each doc in top k, accumulate term*idf (read around the postings cache, so
+        # the scan does not evict the query terms' lists)
+        with PostingsReader(postings_file) as reader:
+            for key,info in dictionary.items():
+                if not key.startswith('C:'): continue
+                term = key.split(':',1)[1]
+                postings, _bytes = reader.read(info)
+                idf = math.log10(total_docs/info.df)
+                for docID, tf in postings:
+                    if docID in top_docs:
+                        term_scores[term] += tf * idf
 
     for t in orig_terms:
         term_scores.pop(t, None)
     expanded = [t for t,_ in sorted(term_scores.items(), key=lambda x: x[1], reverse=True)[:EXPAND_TERMS]]
     return orig_terms + expanded
 
+# Same term scores as the dictionary scan, read from the top docs' forward index vectors.
+# Docs are visited in doc ID order and terms returned in term id (= dictionary) order,
+# so every sum and every tie comes out as in the scan.
+def forward_term_scores(top_docs, dictionary, total_docs, forward_index, content_terms):
+    term_scores = defaultdict(float)
+    for docID in sorted(top_docs):
+        for term_id, tf in forward_index.vector(docID):
+            idf = math.log10(total_docs/dictionary[f"C:{content_terms[term_id]}"].df)
+            term_scores[term_id] += tf * idf
+    return {content_terms[term_id]: term_scores[term_id] for term_id in sorted(term_scores)}
+
+# Forward index written by index.py -f next to the postings file, with the content term
+# of every term id, or None if there is none. It only covers the base index, so it is not
+# used once segments have been added (index.py -a).
+def open_forward_index(postings_file, dictionary):
+    forward_file = side_file(postings_file, FORWARD_EXTENSION)
+    if not os.path.exists(forward_file) or load_manifest(postings_file).segments:
+        return None
+    content_terms = sorted(key.split(':',1)[1] for key in dictionary if key.startswith('C:'))
+    return ForwardIndexReader(forward_file), content_terms
+
+# Result cache key of the query: the settings and the stemmed query terms
+def cache_key(query):
+    return (TITLE_WT, PRUNE_TERMS, TOP_K_DOCS, EXPAND_TERMS, tuple(sorted(Counter(preprocess(query)).items())))
+
+def search(query, dictionary, postings_file, doc_lengths, total_docs, forward=None):
+    orig_terms = preprocess(query)
+    if PRUNE_TERMS:
+        orig_terms = prune_terms(orig_terms, dictionary, total_docs)
+    initial_scores = compute_scores(orig_terms, dictionary, postings_file, doc_lengths, total_docs)
+    top_docs = [doc for doc,_ in sorted(initial_scores.items(), key=lambda x:x[1], reverse=True)[:TOP_K_DOCS]]
+
+    all_terms = expand_query(orig_terms, top_docs, dictionary, postings_file, doc_lengths, total_docs, forward)
+    final_scores = compute_scores(all_terms, dictionary, postings_file, doc_lengths, total_docs)
+
+    return [doc for doc,_ in sorted(final_scores.items(), key=lambda x:x[1], reverse=True)]
+
 def main():
     dict_file=postings_file=query_file=out_file=None
+    batch=False
+    cache_file=None
     try:
-        opts,_ = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
+        opts,_ = getopt.getopt(sys.argv[1:], 'd:p:q:o:bc:')
     except:
         usage(); sys.exit(2)
     for o,a in opts:
@@ -112,24 +130,33 @@ def main():
         elif o=='-p': postings_file=a
         elif o=='-q': query_file=a
         elif o=='-o': out_file=a
+        elif o=='-b': batch=True   # one query per line
+        elif o=='-c': cache_file=a # keep the result cache in this file
     if not (dict_file and postings_file and query_file and out_file): usage(); sys.exit(2)
 
-    dictionary = load_dictionary(dict_file)
+    dictionary = load_dictionary(dict_file, postings_file)
     doc_lengths = load_doc_lengths(postings_file)
-    total_docs = len({d for d,_ in doc_lengths if _=='content'})
+    set_tokenizer(load_tokenizer(postings_file))
+    total_docs = doc_lengths.num_docs
+    forward = open_forward_index(postings_file, dictionary)
+
+    cache = ResultCache(index_files(dict_file, postings_file), cache_file=cache_file)
+    def cached_search(query):
+        return cache.get(cache_key(query),
+                         lambda: search(query, dictionary, postings_file, doc_lengths, total_docs, forward))
+
+    if batch:
+        run_batch(query_file, out_file, cached_search)
+        cache.save()
+        print(cache.stats(), file=sys.stderr)
+        print(postings_cache.stats(dictionary), file=sys.stderr)
+        return
 
-    nltk.download('punkt', quiet=True)
     with open(query_file,'r',encoding='utf8') as qf:
         query = qf.readline().strip()
 
-    orig_terms = preprocess(query)
-    initial_scores = compute_scores(orig_terms, dictionary, postings_file, doc_lengths, total_docs)
-    top_docs = [doc for doc,_ in sorted(initial_scores.items(), key=lambda x:x[1], reverse=True)[:TOP_K_DOCS]]
-
-    all_terms = expand_query(orig_terms, top_docs, dictionary, postings_file, doc_lengths, total_docs)
-    final_scores = compute_scores(all_terms, dictionary, postings_file, doc_lengths, total_docs)
-
-    ranked = [doc for doc,_ in sorted(final_scores.items(), key=lambda x:x[1], reverse=True)]
+    ranked = cached_search(query)
+    cache.save()
     with open(out_file,'w',encoding='utf8') as outf:
         outf.write(' '.join(map(str,ranked)) + '\n')
 
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+import sys
+import getopt
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from postings import load_dictionary, load_doc_lengths, load_tokenizer, open_impacts, open_tiers
+from search_tfidf_weight import compute_tfidf_scores, cache_key
+from result_cache import ResultCache, index_files
+from query_eval import DateIndex
+from text_analysis import set_tokenizer
+
+# Long-running search daemon for search_tfidf_weight.py rankings.
+#
+# The index is loaded once in every worker process, so queries skip the interpreter, NLTK
+# and index loading cost of a cold start. Clients connect over TCP (or a Unix socket with
+# -u) and send one query per line; the server answers each with one line of ranked doc IDs.
+# Connections are handled concurrently by asyncio, and scoring runs in a process pool.
+# A worker loads the index again before the first query after its files change (index.py
+# -a and its background merges), so results never come from a stale dictionary.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-H host] [-P port | -u socket-file]"
+          " [-w workers] [-n | -I [-e max-postings]] [-k top-k [-T]]")
+
+# Worker side ############################################################################
+
+# Loaded in every worker process by load_index, with the worker's result cache, whose
+# fingerprint of the index files is taken before loading them
+settings = None
+index = None
+cache = None
+
+def load_index(dict_file, postings_file, use_numpy, top_k, use_impacts=False, max_postings=None,
+               approximate_tiers=False):
+    global settings, index, cache
+    settings = (dict_file, postings_file, use_numpy, top_k, use_impacts, max_postings, approximate_tiers)
+    previous = index
+    cache = ResultCache(index_files(dict_file, postings_file))
+    dictionary = load_dictionary(dict_file, postings_file)
+    doc_lengths = load_doc_lengths(postings_file)
+    set_tokenizer(load_tokenizer(postings_file))
+    scorer = None
+    if use_numpy:
+        from numpy_scoring import NumpyScorer
+        scorer = NumpyScorer(doc_lengths)
+    impacts = open_impacts(postings_file) if use_impacts else None
+    tiers = open_tiers(postings_file)
+    index = (dictionary, postings_file, doc_lengths, len(doc_lengths), scorer, top_k, DateIndex(dictionary),
+             impacts, tiers, max_postings, approximate_tiers and tiers is not None)
+    if previous is not None:
+        # Unmap the dictionary, document lengths, impact and tiered indexes of the last load,
+        # once nothing else holds them: its NumPy scorer wraps the mapped length arrays
+        mapped = (previous[0], previous[2], previous[7], previous[8])
+        del previous
+        for old in mapped:
+            if hasattr(old, 'close'):
+                old.close()
+
+def start_worker(*args):
+    load_index(*args)
+    # Warm up the tokenizer and stemmer so the first real query is not a cold one
+    search("court")
+
+def search(query):
+    if cache.index_fingerprint() != cache.fingerprint:
+        load_index(*settings)
+    (dictionary, postings_file, doc_lengths, total_docs, scorer, top_k, date_index, impacts, tiers, max_postings,
+     approximate_tiers) = index
+    key = cache_key(query, top_k, impacts is not None, max_postings, approximate_tiers)
+    ranked_results = cache.get(key, lambda: compute_tfidf_scores(
+        query, dictionary, postings_file, doc_lengths, total_docs, scorer, top_k, date_index=date_index,
+        impacts=impacts, max_postings=max_postings, tiers=tiers, approximate_tiers=approximate_tiers))
+    return ' '.join(map(str, ranked_results))
+
+def ready(_task):
+    return os.getpid()
+
+# Server side ############################################################################
+
+async def handle_client(reader, writer, pool):
+    loop = asyncio.get_running_loop()
+    try:
+        while line := await reader.readline():
+            query = line.decode('utf8').strip()
+            result = await loop.run_in_executor(pool, search, query)
+            writer.write((result + '\n').encode('utf8'))
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(pool, host, port, socket_file):
+    def on_connect(reader, writer):
+        return handle_client(reader, writer, pool)
+
+    if socket_file:
+        server = await asyncio.start_unix_server(on_connect, path=socket_file)
+        print(f"Serving on {socket_file}")
+    else:
+        server = await asyncio.start_server(on_connect, host, port)
+        print(f"Serving on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def run_server(dict_file, postings_file, host, port, socket_file, workers, use_numpy, top_k, use_impacts=False,
+               max_postings=None, approximate_tiers=False):
+    with ProcessPoolExecutor(workers, initializer=start_worker,
+                             initargs=(dict_file, postings_file, use_numpy, top_k, use_impacts, max_postings,
+                                       approximate_tiers)) as pool:
+        # Start and warm up every worker before accepting connections
+        list(pool.map(ready, range(workers)))
+        print(f"Index loaded, {workers} workers ready")
+        try:
+            asyncio.run(serve(pool, host, port, socket_file))
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = socket_file = None
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    workers = os.cpu_count()
+    use_numpy = False
+    top_k = None
+    use_impacts = False
+    max_postings = None
+    approximate_tiers = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:H:P:u:w:nIe:k:T')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-H':
+            host = a
+        elif o == '-P':
+            port = int(a)
+        elif o == '-u': # Unix socket instead of TCP
+            socket_file = a
+        elif o == '-w': # number of worker processes
+            workers = int(a)
+        elif o == '-n': # NumPy vectorized scoring
+            use_numpy = True
+        elif o == '-I': # score from the impact index
+            use_impacts = True
+        elif o == '-e': # with -I and -k, stop scoring after this many postings
+            max_postings = int(a)
+        elif o == '-k': # only return the top K documents
+            top_k = int(a)
+        elif o == '-T': # with -k, answer from tier 1 of the tiered index whenever it holds K documents
+            approximate_tiers = True
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    if max_postings and not (use_impacts and top_k):
+        print("-e needs -I and -k")
+        usage()
+        sys.exit(2)
+
+    run_server(dictionary_file, postings_file, host, port, socket_file, workers, use_numpy, top_k, use_impacts,
+               max_postings, approximate_tiers)
@@ -1,19 +1,21 @@
 #!/usr/bin/python3
 import re
-import nltk
 import sys
 import getopt
 import heapq
 import math
-import unicodedata
+from collections import Counter
+from postings import load_dictionary, load_doc_lengths, load_tokenizer, PostingsReader, postings_cache
+from batch import run_batch
+from query_eval import prune_terms
+from result_cache import ResultCache, index_files
 
-from nltk.stem import PorterStemmer
-from nltk.tokenize import sent_tokenize, word_tokenize
-stemmer = PorterStemmer()
+from text_analysis import analyze, set_tokenizer
 
 # Settings ###############################################################################
 
 debug = True
+PRUNE_TERMS = False  # leave punctuation and terms of every document out of scoring
 
 # Generic helpers ########################################################################
 
@@ -24,84 +26,71 @@ def dprint(*args, **kwargs):
 # Main code ##############################################################################
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-b] [-c cache-file]")
 
-def run_search(dict_file, postings_file, query_file, results_file):
+def run_search(dict_file, postings_file, query_file, results_file, batch=False, cache_file=None):
     """
     using the given dictionary file and postings file,
     perform searching on the given queries file and output the results to a file
     """
-    print('Running search on the queries...')
+    if not batch:
+        print('Running search on the queries...')
 
-    dictionary = load_dictionary(dict_file)
+    dictionary = load_dictionary(dict_file, postings_file)
+    # The starter only ranks on the content zone
     doc_lengths = load_doc_lengths(postings_file)
-    total_docs = len(doc_lengths)
+    set_tokenizer(load_tokenizer(postings_file))
+    total_docs = doc_lengths.num_docs
+
+    cache = ResultCache(index_files(dict_file, postings_file), cache_file=cache_file)
+    def search(query):
+        return cache.get(cache_key(query), lambda: compute_tfidf_scores(
+            query, dictionary, postings_file, doc_lengths, total_docs))
+
+    if batch:
+        run_batch(query_file, results_file, search)
+        cache.save()
+        print(cache.stats(), file=sys.stderr)
+        print(postings_cache.stats(dictionary), file=sys.stderr)
+        return
 
     with (open(query_file, 'r', encoding="utf8") as qfile,
           open(results_file, 'w', encoding="utf8") as rfile):
         query = qfile.readline().strip()
-        ranked_results = compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_docs)
+        ranked_results = search(query)
         rfile.write(' '.join(map(str, ranked_results)) + '\n')
+    cache.save()
     print("Search completed!")
 
-# Load dictionary
-def load_dictionary(dict_file):
-    dictionary = {}
-    with open(dict_file, 'r', encoding="utf8") as file:
-        for line in file:
-            term, offset, length = line.strip().split()
-            dictionary[term] = (int(offset), int(length))
-    return dictionary
-
-# Load document lengths
-def load_doc_lengths(postings_file):
-    doc_lengths = {}
-    with open(postings_file, 'r', encoding="utf8") as file:
-        for line in file:
-            if line.startswith("LC "):
-                _field, docID, length = line.strip().split()
-                doc_lengths[(int(docID), 'content')] = float(length)
-            else:
-                break
-    return doc_lengths
-
-# Get posting list
-def get_postings_list(file, offset):
-    file.seek(offset)
-    postings = file.readline().strip().split()
-    postings = [(int(p.split(':')[0]), int(p.split(':')[1])) for p in postings]
-    return postings
-
 def preprocess_query(query):
-    words = []
-
     # Since we will be doing the bare minimum of treating this as a freetext query for now,
     # remove all special tokens from the query.
     query = query.replace('"', '').replace(' AND ','')
+    return list(analyze(query))
 
-    query = unicodedata.normalize('NFKD', query)
-
-    sentences = sent_tokenize(query)
-    for sentence in sentences:
-        words.extend([stemmer.stem(word.lower()) for word in word_tokenize(sentence)])
-    return words
+# Result cache key of the query: the scoring settings and the stemmed query terms
+def cache_key(query):
+    return (PRUNE_TERMS, tuple(sorted(Counter(preprocess_query(query)).items())))
 
 # Main function for calculating cosine and retrieve the ranked results
 def compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_docs):
-    query_terms = [f"C:{query}" for query in preprocess_query(query)]
+    query_terms = preprocess_query(query)
+    if PRUNE_TERMS:
+        query_terms = prune_terms(query_terms, dictionary, total_docs, zones=('C',))
+    query_terms = [f"C:{term}" for term in query_terms]
     query_tf = {}
 
     for term in query_terms:
         query_tf[term] = query_tf.get(term, 0) + 1
 
     scores = {}
-    with open(postings_file, 'r', encoding="utf8") as p_file:
+    with PostingsReader(postings_file) as reader:
         for term in set(query_terms):
             if term in dictionary:
-                offset, df = dictionary[term]
-                postings = get_postings_list(p_file, offset)
+                info = dictionary[term]
+                postings = reader.postings(info)
 
-                idf = math.log10(total_docs / df)
+                idf = math.log10(total_docs / info.df)
                 query_weight = (1 + math.log10(query_tf[term])) * idf
 
                 for docID, tf in postings:
@@ -111,38 +100,45 @@ def compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_do
                     scores[docID] += query_weight * doc_weight  # Compute dot product
 
     # Normalize scores using document length
+    doc_index = doc_lengths.doc_indices
+    content_lengths = doc_lengths.lengths['content']
     for docID in scores:
-        scores[docID] /= doc_lengths[(docID, 'content')]
+        scores[docID] /= content_lengths[doc_index[docID]]
 
     # Return results in ranked order
     return sorted(scores.keys(), key=lambda docid: scores[docid], reverse=True)
 
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
-
-nltk.download('punkt_tab')
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:v')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file  = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    elif o == '-v': # verbose mode
-        debug = True
-    else:
-        assert False, "unhandled option"
-
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+if __name__ == '__main__':
+    dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+    batch = False
+    cache_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:bc:v')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file  = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-b': # batch mode: one query per line
+            batch = True
+        elif o == '-c': # keep the result cache in this file
+            cache_file = a
+        elif o == '-v': # verbose mode
+            debug = True
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
+        usage()
+        sys.exit(2)
+
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, batch, cache_file)
@@ -1,21 +1,24 @@
 #!/usr/bin/python3
 import re
-import nltk
 import sys
 import getopt
 import heapq
 import math
-import unicodedata
 from collections import defaultdict, Counter
+from postings import (load_dictionary, load_doc_lengths, load_tokenizer, PostingsReader, postings_cache, open_impacts,
+                      open_tiers)
+from batch import run_batch
+from query_eval import (maxscore_top_k, phrase_boosts, conjunctive_terms, ConjunctiveFilter, parse_filters, QUOTED_PHRASE,
+                        score_at_a_time, prune_terms, tiered_top_k)
+from result_cache import ResultCache, index_files
 
-from nltk.stem import PorterStemmer
-from nltk.tokenize import sent_tokenize, word_tokenize
-stemmer = PorterStemmer()
+from text_analysis import analyze, set_tokenizer
 
 # Settings ###############################################################################
 
 debug = True
 TITLE_WT = 5.
+PRUNE_TERMS = False  # leave punctuation tokens out of scoring
 
 # Generic helpers ########################################################################
 
@@ -26,74 +29,87 @@ def dprint(*args, **kwargs):
 # Main code ##############################################################################
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-n | -I [-e max-postings]] [-k top-k [-T]] [-b] [-c cache-file]")
 
-def run_search(dict_file, postings_file, query_file, results_file):
+def run_search(dict_file, postings_file, query_file, results_file, use_numpy=False, top_k=None, batch=False,
+               cache_file=None, use_impacts=False, max_postings=None, approximate_tiers=False):
     """
     using the given dictionary file and postings file,
     perform searching on the given queries file and output the results to a file
     """
-    print('Running search on the queries...')
+    if not batch:
+        print('Running search on the queries...')
 
-    dictionary = load_dictionary(dict_file)
+    dictionary = load_dictionary(dict_file, postings_file)
     doc_lengths = load_doc_lengths(postings_file)
+    set_tokenizer(load_tokenizer(postings_file))
     total_docs = len(doc_lengths)
+    scorer = None
+    if use_numpy:
+        from numpy_scoring import NumpyScorer
+        scorer = NumpyScorer(doc_lengths)
+    impacts = None
+    if use_impacts:
+        impacts = open_impacts(postings_file)
+        if impacts is None:
+            print(f"{postings_file} has no up-to-date impact index (index.py -I), scoring from the postings",
+                  file=sys.stderr)
+
+    # Tiered index for -k, used whenever the index has an up-to-date one
+    tiers = open_tiers(postings_file)
+    approximate_tiers = approximate_tiers and tiers is not None
+
+    cache = ResultCache(index_files(dict_file, postings_file), cache_file=cache_file)
+    def search(query):
+        key = cache_key(query, top_k, impacts is not None, max_postings, approximate_tiers)
+        return cache.get(key, lambda: compute_tfidf_scores(
+            query, dictionary, postings_file, doc_lengths, total_docs, scorer, top_k, impacts=impacts,
+            max_postings=max_postings, tiers=tiers, approximate_tiers=approximate_tiers))
+
+    if batch:
+        run_batch(query_file, results_file, search)
+        cache.save()
+        print(cache.stats(), file=sys.stderr)
+        print(postings_cache.stats(dictionary), file=sys.stderr)
+        return
 
     with (open(query_file, 'r', encoding="utf8") as qfile,
           open(results_file, 'w', encoding="utf8") as rfile):
         query = qfile.readline().strip()
-        ranked_results = compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_docs)
+        ranked_results = search(query)
         rfile.write(' '.join(map(str, ranked_results)) + '\n')
+    cache.save()
     print("Search completed!")
 
-# Load dictionary
-def load_dictionary(dict_file):
-    dictionary = {}
-    with open(dict_file, 'r', encoding="utf8") as file:
-        for line in file:
-            term, offset, length = line.strip().split()
-            dictionary[term] = (int(offset), int(length))
-    return dictionary
-
-# Load document lengths
-def load_doc_lengths(postings_file):
-    doc_lengths = {}
-    with open(postings_file, 'r', encoding="utf8") as file:
-        for line in file:
-            if line.startswith("LC "):
-                _field, docID, length = line.strip().split()
-                doc_lengths[(int(docID), 'content')] = float(length)
-            elif line.startswith("LT "):
-                _field, docID, length = line.strip().split()
-                doc_lengths[(int(docID), 'title')] = float(length)
-            else:
-                break
-    return doc_lengths
-
-# Get posting list
-def get_postings_list(file, offset):
-    file.seek(offset)
-    postings = file.readline().strip().split()
-    postings = [(int(p.split(':')[0]), int(p.split(':')[1])) for p in postings]
-    return postings
-
 def preprocess_query(query):
-    words = []
-
-    # Since we will be doing the bare minimum of treating this as a freetext query for now,
-    # remove all special tokens from the query.
+    # Terms are scored as a free-text query: quotes and ANDs are removed here, and applied
+    # by phrase_boosts and ConjunctiveFilter instead (court: and date: filters are already
+    # removed by parse_filters)
     query = query.replace('"', '').replace(' AND ',' ')
-
-    query = unicodedata.normalize('NFKD', query)
-
-    sentences = sent_tokenize(query)
-    for sentence in sentences:
-        words.extend([stemmer.stem(word.lower()) for word in word_tokenize(sentence)])
-    return words
+    return list(analyze(query))
+
+# Result cache key of the query: the scoring settings and everything of the query its
+# ranking depends on (NumPy and exact tiered scoring rank identically, so they share the
+# entries, but the quantized weights of an impact index and approximate tiers do not)
+def cache_key(query, top_k=None, impacts=False, max_postings=None, approximate_tiers=False):
+    raw_query, filters = parse_filters(query)
+    terms = tuple(sorted(Counter(preprocess_query(raw_query)).items()))
+    phrases = tuple(sorted(tuple(analyze(phrase)) for phrase in QUOTED_PHRASE.findall(raw_query)))
+    conjuncts = tuple(sorted(conjunctive_terms(raw_query) or ()))
+    return (TITLE_WT, PRUNE_TERMS, top_k, impacts, max_postings, approximate_tiers, terms, phrases, conjuncts, tuple(filters.courts),
+            tuple(filters.date_ranges))
 
 # Main function for calculating cosine and retrieve the ranked results
-def compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_docs):
+def compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_docs, scorer=None, top_k=None,
+                         filters=None, date_index=None, impacts=None, max_postings=None, tiers=None,
+                         approximate_tiers=False):
+    # court: and date: filters of the query, unless given as QueryFilters
+    raw_query, query_filters = parse_filters(query)
+    filters = filters or query_filters
+    query = raw_query
     query = preprocess_query(query)
+    if PRUNE_TERMS:
+        query = prune_terms(query, dictionary, total_docs)
     query_terms = []
     query_tf = Counter()
 
@@ -105,70 +121,156 @@ def compute_tfidf_scores(query, dictionary, postings_file, doc_lengths, total_do
 
     title_scores = defaultdict(float)
     content_scores = defaultdict(float)
-    with open(postings_file, 'r', encoding="utf8") as p_file:
+    zone_postings = []  # (zone, query_weight, postings, max_weight) for the NumPy scorer and top-K
+    with PostingsReader(postings_file) as reader:
+        # With AND or filters, only the documents holding every term and passing the
+        # filters are scored
+        conjunction = None
+        terms = conjunctive_terms(raw_query)
+        allowed = filters.allowed(dictionary, reader, doc_lengths, date_index) if filters else None
+        if terms or allowed is not None:
+            conjunction = ConjunctiveFilter(terms or (), dictionary, reader, allowed)
+            if not conjunction.doc_ids:
+                return []
+            # A query of filters alone matches the documents passing them, in doc ID order
+            if not query_terms:
+                return list(conjunction.doc_ids[:top_k] if top_k else conjunction.doc_ids)
+
+        # Documents holding a quoted phrase of the query (needs a positional index)
+        boosts = phrase_boosts(raw_query, dictionary, reader, postings_file)
+
+        if impacts:
+            # Precomputed document weights: only the query weights are computed here
+            impact_lists = []
+            for rawterm in set(query_terms):
+                for zone, zone_weight in (('C', 1.0), ('T', TITLE_WT)):
+                    term = f"{zone}:{rawterm}"
+                    if term in dictionary:
+                        idf = math.log10(total_docs / dictionary[term].df)
+                        query_weight = (1 + query_logtf[rawterm]) * idf * zone_weight
+                        impact_lists.append((query_weight, impacts.groups(term)))
+            allowed = set(conjunction.doc_ids) if conjunction else None
+            return score_at_a_time(impact_lists, top_k, boosts, allowed, max_postings)
+
+        if tiers and top_k and not conjunction:
+            # Top K from the tier-1 postings, unless the tails could change it
+            tier_lists = []
+            for rawterm in set(query_terms):
+                for zone, zone_name in (('C', 'content'), ('T', 'title')):
+                    term = f"{zone}:{rawterm}"
+                    if term in dictionary:
+                        idf = math.log10(total_docs / dictionary[term].df)
+                        query_weight = (1 + query_logtf[rawterm]) * idf
+                        tier_lists.append((zone_name, query_weight, *tiers.tier(term), tiers.tail(term)))
+            ranked = tiered_top_k(tier_lists, doc_lengths, TITLE_WT, top_k, boosts, approximate_tiers)
+            if ranked is not None:
+                return ranked
+
         for rawterm in set(query_terms):
             term = f"C:{rawterm}"
             if term in dictionary:
-                offset, df = dictionary[term]
-                postings = get_postings_list(p_file, offset)
+                info = dictionary[term]
+                postings = conjunction.postings(term, info, reader) if conjunction else reader.postings(info)
 
-                idf = math.log10(total_docs / df)
+                idf = math.log10(total_docs / info.df)
                 query_weight = (1 + query_logtf[rawterm]) * idf
 
-                for docID, tf in postings:
-                    doc_weight = 1 + math.log10(tf)
-                    content_scores[docID] += query_weight * doc_weight  # Compute dot product
+                if scorer or top_k:
+                    zone_postings.append(('content', query_weight, postings, info.max_weight))
+                else:
+                    for docID, tf in postings:
+                        doc_weight = 1 + math.log10(tf)
+                        content_scores[docID] += query_weight * doc_weight  # Compute dot product
 
             term = f"T:{rawterm}"
             if term in dictionary:
-                offset, df = dictionary[term]
-                postings = get_postings_list(p_file, offset)
+                info = dictionary[term]
+                postings = conjunction.postings(term, info, reader) if conjunction else reader.postings(info)
 
-                idf = math.log10(total_docs / df)
+                idf = math.log10(total_docs / info.df)
                 query_weight = (1 + query_logtf[rawterm]) * idf
 
-                for docID, tf in postings:
-                    doc_weight = 1 + math.log10(tf)
-                    title_scores[docID] += query_weight * doc_weight  # Compute dot product
+                if scorer or top_k:
+                    zone_postings.append(('title', query_weight, postings, info.max_weight))
+                else:
+                    for docID, tf in postings:
+                        doc_weight = 1 + math.log10(tf)
+                        title_scores[docID] += query_weight * doc_weight  # Compute dot product
+
+    if top_k:
+        return maxscore_top_k(zone_postings, doc_lengths, TITLE_WT, top_k, boosts)
+    if scorer:
+        return scorer.rank(zone_postings, TITLE_WT, boosts)
 
     scores = defaultdict(float)
     # Normalize scores using document length
+    doc_index = doc_lengths.doc_indices
+    title_lengths, content_lengths = doc_lengths.lengths['title'], doc_lengths.lengths['content']
     for docID in title_scores:
-        title_scores[docID] /= doc_lengths[(docID, 'title')]
+        title_scores[docID] /= title_lengths[doc_index[docID]]
         scores[docID] += title_scores[docID] * TITLE_WT
     for docID in content_scores:
-        content_scores[docID] /= doc_lengths[(docID, 'content')]
+        content_scores[docID] /= content_lengths[doc_index[docID]]
         scores[docID] += content_scores[docID]
+    for docID, boost in boosts.items():
+        if docID in scores:
+            scores[docID] *= boost
 
     # Return results in ranked order
     return sorted(scores.keys(), key=lambda docid: scores[docid], reverse=True)
 
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
-
-nltk.download('punkt_tab')
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:v')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file  = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    elif o == '-v': # verbose mode
-        debug = True
-    else:
-        assert False, "unhandled option"
-
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+if __name__ == '__main__':
+    dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+    use_numpy = False
+    top_k = None
+    batch = False
+    cache_file = None
+    use_impacts = False
+    max_postings = None
+    approximate_tiers = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:nIe:k:Tbc:v')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file  = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-n': # NumPy vectorized scoring
+            use_numpy = True
+        elif o == '-I': # score from the impact index
+            use_impacts = True
+        elif o == '-e': # with -I and -k, stop scoring after this many postings
+            max_postings = int(a)
+        elif o == '-k': # only return the top K documents
+            top_k = int(a)
+        elif o == '-T': # with -k, answer from tier 1 of the tiered index whenever it holds K documents
+            approximate_tiers = True
+        elif o == '-b': # batch mode: one query per line
+            batch = True
+        elif o == '-c': # keep the result cache in this file
+            cache_file = a
+        elif o == '-v': # verbose mode
+            debug = True
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
+        usage()
+        sys.exit(2)
+
+    if max_postings and not (use_impacts and top_k):
+        print("-e needs -I and -k")
+        usage()
+        sys.exit(2)
+
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, use_numpy, top_k, batch, cache_file,
+               use_impacts, max_postings, approximate_tiers)
\ No newline at end of file
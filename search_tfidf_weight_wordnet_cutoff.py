@@ -1,23 +1,23 @@
 #!/usr/bin/python3
 import re
-import nltk
 import sys
 import getopt
 import heapq
 import math
-import unicodedata
 from collections import defaultdict, Counter
+from postings import load_dictionary, load_doc_lengths, load_tokenizer, open_synonyms, PostingsReader, postings_cache
+from batch import run_batch
+from query_eval import phrase_boosts, prune_terms, QUOTED_PHRASE
+from result_cache import ResultCache, index_files
+from synonyms import expand_terms
 
-from nltk.stem import PorterStemmer
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import wordnet as wn
-
-stemmer = PorterStemmer()
+from text_analysis import analyze, sentences, stem, wordnet, set_tokenizer
 
 # Settings ###############################################################################
 
 debug = True
 TITLE_WT = 5.
+PRUNE_TERMS = False  # leave punctuation tokens out of scoring
 OUTPUT_CUTOFF = 1000
 NUM_MAX_SYNONYM_SENSES = 3
 
@@ -30,18 +30,34 @@ def dprint(*args, **kwargs):
 # Main code ##############################################################################
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-b] [-c cache-file]")
 
-def run_search(dict_file, postings_file, query_file, results_file):
+def run_search(dict_file, postings_file, query_file, results_file, batch=False, cache_file=None):
     """
     using the given dictionary file and postings file,
     perform searching on the given queries file and output the results to a file
     """
-    print('Running search on the queries...')
+    if not batch:
+        print('Running search on the queries...')
 
-    dictionary = load_dictionary(dict_file)
+    dictionary = load_dictionary(dict_file, postings_file)
     doc_lengths = load_doc_lengths(postings_file)
+    set_tokenizer(load_tokenizer(postings_file))
     total_docs = len(doc_lengths)
+    # Precomputed WordNet expansions (synonyms.py), or None to look them up live
+    synonyms = open_synonyms(postings_file)
+
+    cache = ResultCache(index_files(dict_file, postings_file), cache_file=cache_file)
+    def search(query, relevant_docs=()):
+        return cache.get(cache_key(query, synonyms, relevant_docs), lambda: compute_tfidf_scores(
+            query, dictionary, list(relevant_docs), postings_file, doc_lengths, total_docs, synonyms))
+
+    if batch:
+        run_batch(query_file, results_file, search)
+        cache.save()
+        print(cache.stats(), file=sys.stderr)
+        print(postings_cache.stats(dictionary), file=sys.stderr)
+        return
 
     relevant_docs = []
 
@@ -54,70 +70,48 @@ def run_search(dict_file, postings_file, query_file, results_file):
             relevant_docs.append(relevant_doc)
             relevant_doc = qfile.readline().strip()
 
-        ranked_results = compute_tfidf_scores(query, dictionary, relevant_docs, postings_file, doc_lengths, total_docs)
+        ranked_results = search(query, relevant_docs)
         rfile.write(' '.join(map(str, ranked_results)) + '\n')
+    cache.save()
     print("Search completed!")
 
-# Load dictionary
-def load_dictionary(dict_file):
-    dictionary = {}
-    with open(dict_file, 'r', encoding="utf8") as file:
-        for line in file:
-            term, offset, length = line.strip().split()
-            dictionary[term] = (int(offset), int(length))
-    return dictionary
-
-# Load document lengths
-def load_doc_lengths(postings_file):
-    doc_lengths = {}
-    with open(postings_file, 'r', encoding="utf8") as file:
-        for line in file:
-            if line.startswith("LC "):
-                _field, docID, length = line.strip().split()
-                doc_lengths[(int(docID), 'content')] = float(length)
-            elif line.startswith("LT "):
-                _field, docID, length = line.strip().split()
-                doc_lengths[(int(docID), 'title')] = float(length)
-            else:
-                break
-    return doc_lengths
-
-# Get posting list
-def get_postings_list(file, offset):
-    file.seek(offset)
-    postings = file.readline().strip().split()
-    postings = [(int(p.split(':')[0]), int(p.split(':')[1])) for p in postings]
-    return postings
-
 # Do query expansion for each query term with WordNet
 def expand_words(words):
     ret = []
     for word in words:
-        for synonyms in wn.synonyms(word)[:NUM_MAX_SYNONYM_SENSES]:
+        for synonyms in wordnet().synonyms(word)[:NUM_MAX_SYNONYM_SENSES]:
             if synonyms:
                 ret.extend(synonyms[0].split('_'))
     ret.extend(words)
-    print(ret)
+    dprint(ret)
     return ret
 
-def preprocess_query(query):
+def preprocess_query(query, synonyms=None):
     words = []
 
     # Since we will be doing the bare minimum of treating this as a freetext query for now,
     # remove all special tokens from the query.
     query = query.replace('"', '').replace(' AND ',' ')
-
-    query = unicodedata.normalize('NFKD', query)
-
-    sentences = sent_tokenize(query)
-    for sentence in sentences:
-        new_words = [word.lower() for word in word_tokenize(sentence)]
-        words.extend([stemmer.stem(word) for word in expand_words(new_words)])
+    for new_words in sentences(query):
+        if synonyms is not None:
+            words.extend(expand_terms(synonyms, new_words, NUM_MAX_SYNONYM_SENSES))
+        else:
+            words.extend([stem(word) for word in expand_words(new_words)])
     return words
 
+# Result cache key of the query: the scoring settings and everything of the query its
+# ranking depends on
+def cache_key(query, synonyms=None, relevant_docs=()):
+    terms = tuple(sorted(Counter(preprocess_query(query, synonyms)).items()))
+    phrases = tuple(sorted(tuple(analyze(phrase)) for phrase in QUOTED_PHRASE.findall(query)))
+    return (TITLE_WT, PRUNE_TERMS, OUTPUT_CUTOFF, NUM_MAX_SYNONYM_SENSES, synonyms is not None, terms, phrases, tuple(relevant_docs))
+
 # Main function for calculating cosine and retrieve the ranked results
-def compute_tfidf_scores(query, dictionary, relevant_docs, postings_file, doc_lengths, total_docs):
-    query = preprocess_query(query)
+def compute_tfidf_scores(query, dictionary, relevant_docs, postings_file, doc_lengths, total_docs, synonyms=None):
+    raw_query = query
+    query = preprocess_query(query, synonyms)
+    if PRUNE_TERMS:
+        query = prune_terms(query, dictionary, total_docs)
     query_terms = []
     query_tf = Counter()
 
@@ -129,14 +123,16 @@ def compute_tfidf_scores(query, dictionary, relevant_docs, postings_file, doc_le
 
     title_scores = defaultdict(float)
     content_scores = defaultdict(float)
-    with open(postings_file, 'r', encoding="utf8") as p_file:
+    with PostingsReader(postings_file) as reader:
+        # Documents holding a quoted phrase of the query (needs a positional index)
+        boosts = phrase_boosts(raw_query, dictionary, reader, postings_file)
         for rawterm in set(query_terms):
             term = f"C:{rawterm}"
             if term in dictionary:
-                offset, df = dictionary[term]
-                postings = get_postings_list(p_file, offset)
+                info = dictionary[term]
+                postings = reader.postings(info)
 
-                idf = math.log10(total_docs / df)
+                idf = math.log10(total_docs / info.df)
                 query_weight = (1 + query_logtf[rawterm]) * idf
 
                 for docID, tf in postings:
@@ -145,10 +141,10 @@ def compute_tfidf_scores(query, dictionary, relevant_docs, postings_file, doc_le
 
             term = f"T:{rawterm}"
             if term in dictionary:
-                offset, df = dictionary[term]
-                postings = get_postings_list(p_file, offset)
+                info = dictionary[term]
+                postings = reader.postings(info)
 
-                idf = math.log10(total_docs / df)
+                idf = math.log10(total_docs / info.df)
                 query_weight = (1 + query_logtf[rawterm]) * idf
 
                 for docID, tf in postings:
@@ -157,45 +153,56 @@ def compute_tfidf_scores(query, dictionary, relevant_docs, postings_file, doc_le
 
     scores = defaultdict(float)
     # Normalize scores using document length
+    doc_index = doc_lengths.doc_indices
+    title_lengths, content_lengths = doc_lengths.lengths['title'], doc_lengths.lengths['content']
     for docID in title_scores:
-        title_scores[docID] /= doc_lengths[(docID, 'title')]
+        title_scores[docID] /= title_lengths[doc_index[docID]]
         scores[docID] += title_scores[docID] * TITLE_WT
     for docID in content_scores:
-        content_scores[docID] /= doc_lengths[(docID, 'content')]
+        content_scores[docID] /= content_lengths[doc_index[docID]]
         scores[docID] += content_scores[docID]
+    for docID, boost in boosts.items():
+        if docID in scores:
+            scores[docID] *= boost
 
     for docID in relevant_docs:
         scores[docID] = 1e9
 
     # Return results in ranked order
-    return sorted(scores.keys(), key=lambda docid: scores[docid], reverse=True)[:OUTPUT_CUTOFF]
-
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
-
-nltk.download('punkt_tab')
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:v')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file  = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    elif o == '-v': # verbose mode
-        debug = True
-    else:
-        assert False, "unhandled option"
-
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    # Heap selection of the best OUTPUT_CUTOFF documents (same order as a full sort)
+    return heapq.nlargest(OUTPUT_CUTOFF, scores.keys(), key=lambda docid: scores[docid])
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+    batch = False
+    cache_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:bc:v')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file  = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-b': # batch mode: one query per line
+            batch = True
+        elif o == '-c': # keep the result cache in this file
+            cache_file = a
+        elif o == '-v': # verbose mode
+            debug = True
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
+        usage()
+        sys.exit(2)
+
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, batch, cache_file)
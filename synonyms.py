@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+import sys
+import getopt
+import time
+from functools import lru_cache
+from postings import load_dictionary, write_synonym_table
+from text_analysis import stem, wordnet
+
+# WordNet query expansion for search_tfidf_weight_wordnet.py and its cutoff variant.
+#
+# Each query word is expanded with the first synonym of each of its first few WordNet
+# senses. Looked up live, that costs the WordNet import and corpus load on the first query
+# and a synset lookup per query word. Instead, `python synonyms.py -d dictionary-file -p
+# postings-file` precomputes the expansions of every WordNet word once, keyed by its
+# stemmed term, into the synonym table of the index (see postings.py); the scripts read it
+# when it exists and only fall back to live WordNet without one.
+#
+# The table keeps only expansion terms that are C: or T: terms of the dictionary: other
+# terms have no postings, so dropping them leaves every score unchanged. Words are keyed
+# by their stem, so inflected query words find the expansion of their base form, and
+# several WordNet words with the same stem share the expansion of the shortest of them.
+
+# Senses recorded per term; the scripts expand with at most this many
+MAX_SENSES = 4
+
+# Number of (term, senses) expansions kept in memory
+SYNONYM_CACHE_SIZE = 2**14
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file")
+
+# The first synonym of each of the first `num_senses` WordNet senses of the word, split
+# into words; [] for a sense with no other word
+def sense_synonyms(word, num_senses):
+    return [synonyms[0].split('_') if synonyms else [] for synonyms in wordnet().synonyms(word)[:num_senses]]
+
+def build_synonym_table(dict_file, postings_file):
+    """ Write the synonym table of the index: stemmed term -> expansion terms per sense """
+    dictionary = load_dictionary(dict_file, postings_file)
+    vocabulary = {key[2:] for key in dictionary if key.startswith(('C:', 'T:'))}
+
+    # Word whose senses are recorded for each stem: the shortest, then the first in order
+    words = {}
+    for word in wordnet().all_lemma_names():
+        if '_' in word or word != word.lower():
+            continue
+        term = stem(word)
+        if term not in words or (len(word), word) < (len(words[term]), words[term]):
+            words[term] = word
+
+    table = {}
+    for term, word in words.items():
+        senses = [[synonym for synonym in map(stem, synonym_words) if synonym in vocabulary]
+                  for synonym_words in sense_synonyms(word, MAX_SENSES)]
+        if any(senses):
+            table[term] = senses
+    write_synonym_table(postings_file, table)
+    return len(table)
+
+@lru_cache(maxsize=SYNONYM_CACHE_SIZE)
+def expansions(table, term, num_senses):
+    return tuple(synonym for sense in table.senses(term)[:num_senses] for synonym in sense)
+
+def expand_terms(table, words, num_senses):
+    """
+    Stemmed terms of the query words, after the terms of their expansions from the first
+    `num_senses` senses in the synonym table
+    """
+    terms = []
+    for word in words:
+        terms.extend(expansions(table, stem(word), num_senses))
+    terms.extend(stem(word) for word in words)
+    return terms
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    start_time = time.perf_counter()
+    num_terms = build_synonym_table(dictionary_file, postings_file)
+    print(f"Wrote the expansions of {num_terms} terms in {time.perf_counter() - start_time:.1f} seconds")
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+import re
+import sys
+import unicodedata
+from functools import lru_cache
+
+# Text analysis shared by index.py and the search scripts: every text goes through the
+# same normalize -> tokenize -> stem pipeline (analyze), so documents and queries always
+# produce the same terms.
+#
+# Stemming dominates the cost of tokenizing, and legal text repeats the same few thousand
+# words over and over, so stems are memoized in a bounded LRU cache; stem.cache_info()
+# reports its hits and misses.
+#
+# Nothing is downloaded while searching. The NLTK data the scripts need is installed once,
+# ahead of time, by running this file: it checks every resource and downloads only the
+# missing ones. NLTK itself is imported, and its tokenizer models loaded, the first time
+# text is tokenized or stemmed, so option parsing and index loading never wait on it, and
+# whether the data is installed is checked only once per process.
+
+# Number of distinct words whose stems are kept
+STEM_CACHE_SIZE = 2**17
+
+# NLTK data used by the scripts: download package name -> nltk.data resource path
+RESOURCES = {
+    'punkt_tab': 'tokenizers/punkt_tab/english/',
+    'wordnet': 'corpora/wordnet',
+}
+
+# Resource checks ########################################################################
+
+def is_installed(package):
+    import nltk
+    try:
+        nltk.data.find(RESOURCES[package])
+        return True
+    except LookupError:
+        return False
+
+def require(package):
+    if not is_installed(package):
+        raise LookupError(f"NLTK resource '{package}' is not installed, "
+                          f"run `python text_analysis.py` once to install it")
+
+def preflight(download=True):
+    """
+    Check every resource the scripts need, downloading the missing ones if `download`.
+    Returns the names of the resources that are still missing.
+    """
+    import nltk
+    missing = []
+    for package in RESOURCES:
+        if is_installed(package):
+            print(f"{package}: installed")
+            continue
+        if download and nltk.download(package, quiet=True) and is_installed(package):
+            print(f"{package}: downloaded")
+            continue
+        print(f"{package}: missing")
+        missing.append(package)
+    return missing
+
+# Lazily loaded NLTK tools ###############################################################
+
+_tokenizers = None
+_porter_stem = None
+_wordnet = None
+
+# (sent_tokenize, word_tokenize) from NLTK, imported on first use
+def tokenizers():
+    global _tokenizers
+    if _tokenizers is None:
+        require('punkt_tab')
+        from nltk.tokenize import sent_tokenize, word_tokenize
+        _tokenizers = (sent_tokenize, word_tokenize)
+    return _tokenizers
+
+# NLTK's Porter stemmer, imported on first use; needs no NLTK data
+def porter_stem():
+    global _porter_stem
+    if _porter_stem is None:
+        from nltk.stem import PorterStemmer
+        _porter_stem = PorterStemmer().stem
+    return _porter_stem
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    return porter_stem()(word)
+
+# The WordNet corpus reader, imported on first use
+def wordnet():
+    global _wordnet
+    if _wordnet is None:
+        require('wordnet')
+        from nltk.corpus import wordnet as wn
+        _wordnet = wn
+    return _wordnet
+
+# Regex tokenizer ########################################################################
+#
+# A single-pass stand-in for Punkt sent_tokenize + word_tokenize (index.py -t regex). The
+# word rules are those of NLTK's Treebank-style word tokenizer, applied with one regex over
+# the whole text. The only thing Punkt contributes to the token stream is where a word's
+# final period is split off (at a sentence end, but not after an abbreviation), so instead
+# a period is split off a word followed by whitespace and anything but a lowercase letter,
+# or by the end of the text, except after single capital letters (initials).
+#
+# Against the English Punkt model the two token streams differ only in where the final
+# period of the words in PERIOD_DIFFERENCES goes, and benchmark.py tokenizer-conformance
+# fails on any other difference. Abbreviations the model knows ("Mr.", "No.", "s.", "Co.")
+# keep their period in the NLTK path, but lose it here before a capitalized word or a
+# number, giving the terms "no" and "." instead of "no.". After "viz" and "road" Punkt
+# ends a sentence before a lowercase word, splitting off the period this mode keeps.
+
+# Lowercased words whose final period the two tokenizers split differently
+PERIOD_DIFFERENCES = frozenset({'viz', 'road', 'mr', 'no', 's', 'co'})
+
+# Characters that are always tokens of their own
+SPLIT_CHARS = ";@#$%&?!*()[]{}<>«“‘„»”’`‒–—―"
+_split_class = re.escape(SPLIT_CHARS)
+
+REGEX_TOKEN = re.compile(rf"""
+    `+ | '' | \.{{2,}} | -- | " | [{_split_class}] | [,:](?!\d)
+  | (?P<word> (?: [^\s{_split_class}",:.'\-] | [,:](?=\d) | \.(?!\.) | -(?!-) | '(?!') )+ )
+""", re.X)
+SENTENCE_END = re.compile(r"""[\])}>"'»”’]*(?:\s+(?![a-z])|$)""")
+LEADING_QUOTE = re.compile(r"'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)", re.I)
+CLITIC = re.compile(r"(.*[^'])('[sSmMdD]|'ll|'LL|'re|'RE|'ve|'VE|n't|N'T|')")
+CONTRACTION = re.compile(r"(can)(not)|(d)('ye)|(gim)(me)|(gon)(na)|(got)(ta)|(lem)(me)|(more)('n)"
+                         r"|(wan)(na)|('t)(is)|('t)(was)", re.I)
+
+# Whether the double quote at `start` opens a quotation, as NLTK decides it: at the start
+# of a sentence or after a space or an opening bracket
+def is_opening_quote(text, start):
+    if start == 0 or text[start - 1] in ' ([{<':
+        return True
+    i = start - 1
+    while i >= 0 and text[i].isspace():
+        i -= 1
+    return i < start - 1 and (i < 0 or text[i] in '.?!')
+
+def regex_tokenize(text):
+    tokens = []
+    for match in REGEX_TOKEN.finditer(text):
+        token = match.group()
+        if token == '"':
+            tokens.append('``' if is_opening_quote(text, match.start()) else "''")
+            continue
+        if match.lastgroup != 'word':
+            tokens.append(token)
+            continue
+
+        # Split off the period of a word ending a sentence, unless it is an initial
+        period = None
+        end = match.end()
+        if (token[-1] == '.' and len(token) > 1 and token[-2] != '.' and SENTENCE_END.match(text, end)
+                and not (len(token) == 2 and token[0].isupper() and text[end:end + 1].isspace())):
+            token, period = token[:-1], '.'
+        if token[0] == "'" and LEADING_QUOTE.match(token):
+            tokens.append("'")
+            token = token[1:]
+        contraction = CONTRACTION.fullmatch(token)
+        clitic = CLITIC.fullmatch(token)
+        if contraction:
+            tokens.extend(part for part in contraction.groups() if part)
+        elif clitic:
+            tokens.extend(clitic.groups())
+        else:
+            tokens.append(token)
+        if period:
+            tokens.append(period)
+    return tokens
+
+# Pipeline ###############################################################################
+
+# Tokenizer used by sentences() and analyze(): 'nltk' (Punkt + word_tokenize) or 'regex'
+DEFAULT_TOKENIZER = 'nltk'
+TOKENIZERS = ('nltk', 'regex')
+tokenizer = DEFAULT_TOKENIZER
+
+def set_tokenizer(name=None):
+    global tokenizer
+    name = name or DEFAULT_TOKENIZER
+    if name not in TOKENIZERS:
+        raise ValueError(f"unknown tokenizer '{name}', expected one of {', '.join(TOKENIZERS)}")
+    tokenizer = name
+
+# Yield the lowercased tokens of every sentence of the NFKD-normalized text, one list
+# per sentence. The regex tokenizer does not find sentences and yields a single list.
+def sentences(text):
+    if not text:
+        return
+    text = unicodedata.normalize('NFKD', text)
+    if tokenizer == 'regex':
+        yield [word.lower() for word in regex_tokenize(text)]
+        return
+    split_sentences, split_words = tokenizers()
+    for sentence in split_sentences(text):
+        yield [word.lower() for word in split_words(sentence)]
+
+# Yield the stemmed terms of the text, in order
+def analyze(text):
+    for words in sentences(text):
+        for word in words:
+            yield stem(word)
+
+# Streamed text is tokenized in pieces of about PARAGRAPH_BLOCK characters, cut at the
+# last paragraph break (a blank line), so a long document is never held in full. A piece
+# with no paragraph break is cut at its last line break or space once it grows past
+# PARAGRAPH_BLOCK_MAX characters.
+PARAGRAPH_BLOCK = 1 << 16
+PARAGRAPH_BLOCK_MAX = 1 << 18
+PARAGRAPH_BREAK = re.compile(r"\n[^\S\n]*\n")
+
+# Regroup text chunks into pieces that end at paragraph boundaries
+def paragraphs(chunks):
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        if len(pending) < PARAGRAPH_BLOCK:
+            continue
+        cut = 0
+        for match in PARAGRAPH_BREAK.finditer(pending):
+            cut = match.end()
+        if not cut and len(pending) >= PARAGRAPH_BLOCK_MAX:
+            cut = max(pending.rfind('\n'), pending.rfind(' ')) + 1
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+    if pending:
+        yield pending
+
+# Yield the stemmed terms of text given as a stream of chunks
+def analyze_chunks(chunks):
+    for piece in paragraphs(chunks):
+        yield from analyze(piece)
+
+# Import NLTK and load the tokenizer models now instead of on first use
+def warm_up():
+    porter_stem()
+    for _words in sentences("Warm up."):
+        pass
+
+def stem_cache_stats():
+    info = stem.cache_info()
+    lookups = info.hits + info.misses
+    return (f"stem cache: {info.hits} hits, {info.misses} misses"
+            f" ({100 * info.hits / lookups if lookups else 0:.1f}% hit rate), {info.currsize} words cached")
+
+if __name__ == '__main__':
+    # Preflight: python text_analysis.py [-c]   (-c only checks, without downloading)
+    missing = preflight(download='-c' not in sys.argv[1:])
+    sys.exit(1 if missing else 0)